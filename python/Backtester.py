@@ -6,20 +6,44 @@ import pandas as pd
 import numpy as np
 import math
 from pprint import pprint
-import plotly.express as px
 import itertools as it
-from sklearn.model_selection import TimeSeriesSplit
 # -- User custom function, classes and objects
 from python.Logger import Logger
-from python.DatabaseWrapper import DatabaseWrapper
-from python.ExchangeConnector import ExchangeConnector
+from python.CandleStore import CandleStore
+from python.Candles import Candles
 from python.Strategy import Strategy
+from python.WfaExecutor import WfaExecutor
+from python.ExecutionSimulator import ExecutionSimulator
+from python.ParameterSearch import ParameterSearch
+from python.FoldStore import FoldStore
+from python.Robustness import Robustness
+from python.Resampler import Resampler
+from python.Profiler import PROFILER
 
 
 class Backtester:
+    """
+    Backtests and walk forward analysis of a strategy on one pair and interval. The candles are read from the database
+    or candle store, after updating them from the exchange unless update is False, or taken from the data argument,
+    and kept in a Candles container of which data is a view.
+    Plotting, the exchange client and the database are only loaded when they are used, so that an offline backtester
+    starts in the time it takes to import numpy and pandas.
+    """
 
     def __init__(self, pair: str = 'BTCUSDT', interval: str = '4h', initial_capital: int = 5000,
-                 start_date: datetime = None, end_date: datetime = None):
+                 start_date: datetime = None, end_date: datetime = None, storage: str = 'sql',
+                 execution: ExecutionSimulator = None, database_name: str = 'db/db', update: bool = True,
+                 data: pd.DataFrame = None, parameters: pd.DataFrame = None, precision: str = 'float64',
+                 base_interval: str = None):
+        """
+        :param data: candles indexed by open_time, as returned by DatabaseWrapper.read_candles, used instead of reading
+        the database. Nothing is updated
+        :param parameters: optimisation parameters with the columns of the parameters table (strategy, parameter,
+        start_value, end_value, step), used instead of reading them from the database
+        :param precision: 'float64' or 'float32', dtype in which the prices and volumes of the candles are kept
+        :param base_interval: stored interval from which interval is resampled (e.g. '1h' for '4h' or '1d'), only the
+        base interval is downloaded
+        """
         # Parameters
         self.start_date = start_date
         self.end_date = end_date
@@ -28,20 +52,56 @@ class Backtester:
         self.initial_capital = initial_capital
         self.capital = initial_capital
         self.maker_fee = 0.1 / 100
-        self.taker_fee = 0.1 / 100
+        self._taker_fee = 0.1 / 100
         self.data = pd.DataFrame
+        self.candles = None
+        self.precision = precision
+        self.base_interval = base_interval if base_interval != interval else None
+        self.execution = execution
+        self.update = update and data is None
+        self.storage = storage
+        self.database_name = database_name
+        self.parameters = parameters
+        self.profile_report = {}
 
         # Internal variables
-        self._exchange_connector = ExchangeConnector()
-        self._dbwrapper = DatabaseWrapper(self._exchange_connector)
+        self._dbwrapper = None
         self._strategy = {}
 
         # Logger
         self.logger = Logger(self.__class__.__name__).logger
 
         # Initialise data and strategy
-        self.get_data()
+        if data is None:
+            self.get_data()
+        else:
+            self.set_data(data)
         self._strategy = Strategy(self.get_strategy_allocation(), self.taker_fee)
+        self._strategy.execution = self.execution
+
+    @property
+    def dbwrapper(self):
+        # Created on first use, backtests on supplied data and parameters never open the database. The exchange
+        # connector is in turn created by the database wrapper when an update needs it
+        if self._dbwrapper is None:
+            from python.DatabaseWrapper import DatabaseWrapper
+            self._dbwrapper = DatabaseWrapper(candle_store=CandleStore() if self.storage == 'columnar' else None,
+                                              database_name=self.database_name)
+        return self._dbwrapper
+
+    def set_data(self, data: pd.DataFrame):
+        """
+        Uses the given candles, filtered to the date range defined in the class
+        :param data: candles indexed by open_time
+        :return:
+        """
+        if self.start_date is not None:
+            data = data[data.index >= pd.Timestamp(self.start_date)]
+        if self.end_date is not None:
+            data = data[data.index <= pd.Timestamp(self.end_date)]
+        self.candles = Candles.from_frame(data, self.pair, self.interval, self.precision)
+        self.data = self.candles.frame()
+        self.logger.info(f'Using {len(self.data)} rows of data from {self.data.index.min()} to {self.data.index.max()}')
 
     def get_data(self):
         """
@@ -49,24 +109,23 @@ class Backtester:
         Then reads the data and does the requires transformations.
         :return:
         """
-        # Update data
-        try:
-            self._dbwrapper.market_data_update(self.pair, self.interval)
-        except Exception as e:
-            self.logger.error(f'Data could not be updated: {e}')
-
-        # Create query
-        query = f"SELECT * FROM {self._dbwrapper.candles_table} WHERE pair='{self.pair}' AND interval='{self.interval}'"
-        if self.start_date:
-            query += f" AND open_time >= '{self.start_date}'"
-        if self.end_date:
-            query += f" AND close_time <= '{self.end_date}'"
+        # Update data, derived intervals are resampled from the stored base candles even without update
+        if self.update:
+            try:
+                self.dbwrapper.market_data_update(self.pair, self.interval, self.base_interval)
+            except Exception as e:
+                self.logger.error(f'Data could not be updated: {e}')
+        elif self.base_interval:
+            try:
+                self.dbwrapper.resample_update(self.pair, self.interval, self.base_interval)
+            except Exception as e:
+                self.logger.error(f'Data could not be resampled from {self.base_interval}: {e}')
 
         try:
-            # Read and convert data
-            self.data = self._dbwrapper.read_sql_table(query)
-            self.data[['open_time', 'close_time']] = self.data[['open_time', 'close_time']].apply(pd.to_datetime)
-            self.data.set_index('open_time', inplace=True)
+            # Read typed data, only the rows in the date range
+            data = self.dbwrapper.read_candles(self.pair, self.interval, self.start_date, self.end_date)
+            self.candles = Candles.from_frame(data, self.pair, self.interval, self.precision)
+            self.data = self.candles.frame()
 
             # Log data read
             self.logger.info(f'Successfully downloaded {str(len(self.data))} rows of data')
@@ -83,31 +142,55 @@ class Backtester:
 
     @property
     def taker_fee(self):
-        return self.taker_fee
+        return self._taker_fee
 
-    def run_wfa(self, strategy: str, start_date: datetime = None, end_date: datetime = None):
+    @PROFILER.timed('wfa')
+    def run_wfa(self, strategy: str, start_date: datetime = None, end_date: datetime = None, batched: bool = False,
+                workers: int = 1, search: ParameterSearch = None, fold_store: FoldStore = None, profile: str = None):
         """
         Runs Walk Forward Analysis by selecting the best parameters that fit the training set and testing the same values
         on the test set
         :param strategy:
         :param start_date:
         :param end_date:
+        :param batched: True to score the whole parameter grid of each fold at once with Strategy.batch_<strategy>
+        instead of running one backtest per parameter combination
+        :param workers: number of processes used to optimise the folds, 1 runs everything in this process and None
+        uses all available cores
+        :param search: adaptive search (RandomSearch, SuccessiveHalving or BayesianSearch) used instead of testing the
+        whole grid on every fold. Each fold starts from the best parameters of the previous one, so folds run in
+        order in this process, and draws from its own seed spawned from the seed of the search
+        :param fold_store: store of fold results. Folds already stored for the same configuration and candles are read
+        from it instead of being optimised again. Folds are anchored to the epoch, so new candles only change the last
+        fold and the results are the same with or without a store. With an adaptive search the store is only used when
+        the search has a seed
+        :param profile: 'stages' to record the time spent in every stage of the run, 'cprofile' to also profile it with
+        cProfile. The report is logged at the end and kept in profile_report
         :return:
         """
+        if profile:
+            with PROFILER.run(cprofile=profile == 'cprofile'):
+                self.run_wfa(strategy, start_date, end_date, batched, workers, search, fold_store)
+            self.profile_report = PROFILER.to_dict()
+            self.logger.info(f'WFA stages:\n{PROFILER.report().to_string(index=False)}')
+            return
+
         # Set parameters
         look_back = 500
         train_perc = 0.8
+        warm_up = 100
         param_grid = self.create_parameter_grid(strategy)
         train_size = math.ceil(look_back * train_perc)
         test_size = math.floor(look_back * round(1 - train_perc, 1))
 
         # Instantiate strategy
         self._strategy = Strategy(self.get_strategy_allocation(), self.taker_fee)
+        self._strategy.execution = self.execution
         self._strategy.wfa_scores = pd.DataFrame()
 
         # Filter data
         if not start_date and not end_date:
-            data = self.data.copy()
+            data = self.data
         elif not start_date:
             data = self.data[self.data.index <= end_date]
         elif not end_date:
@@ -115,58 +198,195 @@ class Backtester:
         else:
             data = self.data[(self.data.index >= start_date) & (self.data.index <= end_date)]
 
-        # Create splitter
-        splits = (len(data) - train_size) // test_size
-        tscv = TimeSeriesSplit(n_splits=splits, max_train_size=train_size, test_size=test_size)
+        # Create splitter. Test windows are anchored to the epoch, every window covering test_size candles of time,
+        # so the folds keep their boundaries and candles when rows are added at the end or removed from the start.
+        # Windows without train_size rows and their warm-up before them are left out, the last one holds the remaining
+        # rows
+        open_time = data.index.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+        windows = open_time // (test_size * Resampler.interval_ms(self.interval))
+        starts = np.flatnonzero(np.diff(windows, prepend=windows[:1] - 1))
+        ends = np.append(starts[1:], len(data))
+        folds = [(np.arange(start - train_size, start), np.arange(start, end))
+                 for start, end in zip(starts, ends) if start >= train_size + warm_up]
+
+        # Read the folds already stored, keyed by the candles from the first warm-up row to the last test row. An
+        # adaptive search also depends on the parameters it starts from and on the seed of the fold, so those folds are
+        # only stored with a seed and their keys are computed in order, once the previous fold is known
+        stored_folds = [None] * len(folds)
+        if fold_store is not None and search is not None and search.seed is None:
+            self.logger.warning('Adaptive search without a seed is not reproducible, the fold store is not used')
+            fold_store = None
+        if fold_store is not None:
+            config_hash = fold_store.config_hash(strategy, param_grid, taker_fee=self.taker_fee,
+                                                 execution=self.execution, search=search)
+
+            def fold_key(fold: int, warm_start: dict = None):
+                train_index, test_index = folds[fold]
+                state = {} if search is None else {
+                    'warm_start': sorted((k, float(v)) for k, v in warm_start.items()) if warm_start else None,
+                    'seed': (search.seed, fold)}
+                return fold_store.key(config_hash,
+                                      (data.index[train_index[0]], data.index[test_index[0]],
+                                       data.index[test_index[-1]]),
+                                      data.iloc[max(test_index[0] - len(train_index) - warm_up, 0):test_index[-1] + 1],
+                                      **state)
+
+            fold_keys = [None if search is not None else fold_key(fold) for fold in range(len(folds))]
+            if search is None:
+                with PROFILER.stage('fold_store'):
+                    stored_folds = [fold_store.load(strategy, key) for key in fold_keys]
+                self.logger.info(f'Reusing {len(folds) - stored_folds.count(None)} of {len(folds)} stored folds')
+
+        # Optimise all folds in parallel, from the first train row (plus its warm-up rows) to the first test row
+        if search is not None and workers != 1:
+            self.logger.warning('Adaptive search runs folds in order, workers is ignored')
+            workers = 1
+        if workers != 1:
+            executor = WfaExecutor(self.get_strategy_allocation(), self.taker_fee, workers, self.execution)
+            pending = [fold for fold, stored in enumerate(stored_folds) if stored is None]
+            fold_positions = [(max(folds[fold][1][0] - len(folds[fold][0]) - warm_up, 0), folds[fold][0][0],
+                               folds[fold][1][0]) for fold in pending]
+            with PROFILER.stage('optimise'):
+                optimised = dict(zip(pending, executor.optimise(strategy, param_grid, data, fold_positions, batched)))
+
+        # Test results of every fold are written into arrays sized from the split plan and the scores of every fold
+        # into a list, both turned into dataframes once at the end
+        columns = ['close', 'position'] + (['fill_return'] if self.execution is not None else [])
+        total_rows = sum(len(test_index) for _, test_index in folds)
+        results_index = np.empty(total_rows, dtype='datetime64[ns]')
+        results_values = {}
+        fold_rows = [None] * len(folds)
+        cursor = 0
 
         # Sliding window
         self.logger.info(f'Performing WFA on {len(data)} rows')
-        for train_index, test_index in tscv.split(data):
-            # Divide train and test sets
-            train_data, test_data = data.iloc[train_index], data.iloc[test_index]
-
-            # Save dates and set data
-            first_train_date = train_data.index.min()
-            first_test_date = test_data.index.min()
-            last_date = test_data.index.max()
-
-            # Add 100 more rows to train data
-            train_data_long = data[data.index < first_test_date].copy()
-            if len(train_data_long) > (len(train_data) + 100):
-                train_data_long = train_data_long.iloc[-len(train_data) - 100:]
-            train_data = train_data_long
-            self._strategy.set_data(train_data)
-
-            # Get best parameter combination
-            self.logger.info(f'Optimising window from {first_train_date} to {last_date}')
-            best_score = -np.inf
-            for params in param_grid:
-                # Run strategy
-                score = self.run_backtest(strategy=strategy, params=params, data=train_data,
-                                          first_date=first_train_date)
-                # Keep best score
-                if score > best_score:
-                    best_score = score
-                    opt_params = params
-                    self.logger.info(f'    New best score: {best_score}. '
-                                     f'    Parameters: {params}')
-
-            # Add 100 more rows to test data
-            test_data_long = data[data.index <= last_date].copy()
-            if len(test_data_long) > (len(test_data) + 100):
-                test_data_long = test_data_long.iloc[-len(test_data) - 100:]
-            test_data = test_data_long
-
-            # Get test score and save train and test scores into wfa_scores
-            test_score = self.run_backtest(strategy=strategy, params=opt_params, data=test_data,
-                                           first_date=first_test_date, append_results=True)
-            new_row = {'train_score': [best_score], 'test_score': [test_score], 'parameters': [opt_params],
-                       'first_train_date': [first_train_date], 'first_test_date': [first_test_date],
-                       'last_test_date': [last_date]}
-            self._strategy.wfa_scores = pd.concat([self._strategy.wfa_scores, pd.DataFrame(new_row)], ignore_index=True)
-
+        opt_params = None
+        for fold, (train_index, test_index) in enumerate(folds):
+            if fold_store is not None and search is not None:
+                fold_keys[fold] = fold_key(fold, opt_params)
+                with PROFILER.stage('fold_store'):
+                    stored_folds[fold] = fold_store.load(strategy, fold_keys[fold])
+
+            if stored_folds[fold] is not None:
+                # Restore stored folds
+                fold_rows[fold], self._strategy.results = stored_folds[fold]
+                opt_params = fold_rows[fold]['parameters']
+            else:
+                # Train and test windows are positional views, each preceded by their warm-up rows
+                with PROFILER.stage('fold_slicing'):
+                    first_train_date = data.index[train_index[0]]
+                    first_test_date = data.index[test_index[0]]
+                    last_date = data.index[test_index[-1]]
+                    train_data = data.iloc[max(test_index[0] - len(train_index) - warm_up, 0):test_index[0]]
+                    test_data = data.iloc[max(test_index[0] - warm_up, 0):test_index[-1] + 1]
+                    self._strategy.set_data(train_data)
+
+                # Get best parameter combination
+                self.logger.info(f'Optimising window from {first_train_date} to {last_date}')
+                with PROFILER.stage('optimise'):
+                    best_score = -np.inf
+                    if workers != 1:
+                        best_score, opt_params = optimised[fold]
+                        self.logger.info(f'    Best score: {best_score}. '
+                                         f'    Parameters: {opt_params}')
+                    elif search is not None:
+                        evaluate = self._search_evaluator(strategy, param_grid, train_data, first_train_date, batched)
+                        best_score, opt_params = search.search(param_grid, evaluate, warm_start=opt_params, fold=fold)
+                        self.logger.info(f'    Best score: {best_score}. '
+                                         f'    Parameters: {opt_params}')
+                    elif batched:
+                        # Score all combinations at once and keep the first best one, as the sequential search does
+                        scores = self.run_backtest_batch(strategy=strategy, param_grid=param_grid, data=train_data,
+                                                         first_date=first_train_date)
+                        best = int(np.argmax(np.nan_to_num(scores, nan=-np.inf)))
+                        best_score, opt_params = scores[best], param_grid[best]
+                        self.logger.info(f'    Best score: {best_score}. '
+                                         f'    Parameters: {opt_params}')
+                    else:
+                        # One run per combination, the execution rules and scores of all of them at once
+                        scores = self.run_backtest_batch(strategy=strategy, param_grid=param_grid, data=train_data,
+                                                         first_date=first_train_date, batched=False)
+                        for params, score in zip(param_grid, scores):
+                            # Keep best score
+                            if score > best_score:
+                                best_score = score
+                                opt_params = params
+                                self.logger.info(f'    New best score: {best_score}. '
+                                                 f'    Parameters: {params}')
+
+                # Get test score and save train and test scores into wfa_scores
+                with PROFILER.stage('test'):
+                    test_score = self.run_backtest(strategy=strategy, params=opt_params, data=test_data,
+                                                   first_date=first_test_date)
+                fold_rows[fold] = {'train_score': best_score, 'test_score': test_score, 'parameters': opt_params,
+                                   'first_train_date': first_train_date, 'first_test_date': first_test_date,
+                                   'last_test_date': last_date}
+                if fold_store is not None:
+                    with PROFILER.stage('fold_store'):
+                        fold_store.save(strategy, fold_keys[fold], fold_rows[fold], self._strategy.results[columns])
+
+            # Write the test results of the fold
+            with PROFILER.stage('results'):
+                results = self._strategy.results
+                rows = len(results)
+                results_index[cursor:cursor + rows] = results.index.to_numpy(dtype='datetime64[ns]')
+                for column in columns:
+                    if column not in results_values:
+                        results_values[column] = np.empty(total_rows, dtype=results[column].dtype)
+                    results_values[column][cursor:cursor + rows] = results[column].to_numpy()
+                cursor += rows
+
+        self._strategy.results_all = pd.DataFrame({column: values[:cursor] for column, values in results_values.items()},
+                                                  index=pd.DatetimeIndex(results_index[:cursor], name=data.index.name))
+        self._strategy.wfa_scores = pd.DataFrame(fold_rows)
+
+        if search is not None:
+            if fold_store is not None:
+                self.logger.info(f'Reused {len(folds) - stored_folds.count(None)} of {len(folds)} stored folds')
+            self.logger.info(f'Search evaluations: {search.report()}')
         self._get_wfa_output(strategy)
 
+    def run_robustness(self, method: str = 'block_bootstrap', paths: int = Robustness.DEFAULT_PATHS, seed: int = None,
+                       workers: int = 1, confidence: float = 0.9, **kwargs):
+        """
+        Monte Carlo analysis of the out-of-sample results of the last run_wfa
+        :param method: resampling method of the return paths, one of Robustness.METHODS
+        :param paths: number of paths
+        :param seed: seed of the random generator, the same seed gives the same distributions
+        :param workers: number of processes simulating the paths
+        :param confidence: probability covered by the confidence intervals
+        :param kwargs: arguments of the method (block_length, max_offset)
+        :return: Robustness with the metrics of every path in distribution, and its summary
+        """
+        robustness = Robustness(self._strategy.results_all, self.taker_fee, seed, workers)
+        robustness.run(method, paths, **kwargs)
+        summary = robustness.summary(confidence)
+        self.logger.info(f'Robustness of {self.pair} {self.interval} with {paths} paths ({method}):\n{summary}')
+        return robustness, summary
+
+    def _search_evaluator(self, strategy: str, param_grid: list, data: pd.DataFrame, first_date: datetime,
+                          batched: bool):
+        """
+        Creates the evaluate function of a ParameterSearch for one in-sample window
+        :param strategy: strategy name corresponding to a function in Strategy class
+        :param param_grid: list of parameter sets
+        :param data: dataframe with the in-sample window and its warm-up rows
+        :param first_date: first date of the in-sample window
+        :param batched: True to score the parameter sets with run_backtest_batch
+        :return: function (indices, fraction) returning the scores of param_grid[indices] on the last fraction of the
+        window
+        """
+        window = data.index[data.index >= first_date]
+
+        def evaluate(indices: list, fraction: float = 1):
+            # Shorter windows keep the earlier rows as warm-up
+            window_start = window[min(len(window) - 1, int(len(window) * (1 - fraction)))]
+            params = [param_grid[i] for i in indices]
+            return self.run_backtest_batch(strategy=strategy, param_grid=params, data=data, first_date=window_start,
+                                           batched=batched)
+
+        return evaluate
+
     def run_backtest(self, strategy: str, params: dict, data: pd.DataFrame = None, first_date: datetime = None,
                      append_results: bool = False):
         """
@@ -187,26 +407,77 @@ class Backtester:
         # Run strategy
         getattr(self._strategy, 'run_' + strategy)(params)
 
+        # Apply exit and sizing rules
+        if self.execution is not None:
+            positions, fill_returns = self._strategy.execute(self._strategy.results['position'].to_numpy())
+            self._strategy.results = self._strategy.results.assign(position=positions, fill_return=fill_returns)
+
         # Excludes extra rows added for calculation purposes
         if first_date:
             self._strategy.results = self._strategy.results[self._strategy.results.index >= first_date]
 
         # Append results to result_all when we have test results
         if append_results:
-            self._strategy.results_all = pd.concat([self._strategy.results_all,
-                                                    self._strategy.results[['close', 'position']]])
+            columns = ['close', 'position'] + (['fill_return'] if self.execution is not None else [])
+            with PROFILER.stage('concat'):
+                self._strategy.results_all = pd.concat([self._strategy.results_all, self._strategy.results[columns]])
         return self._strategy.get_score(self._strategy.results)
 
+    def run_backtest_batch(self, strategy: str, param_grid: list, data: pd.DataFrame = None,
+                           first_date: datetime = None, batched: bool = True):
+        """
+        Runs and calculates the score of a strategy for every set of parameters in a single vectorized pass. Each
+        indicator window is computed once and all combinations are scored from a (rows x combinations) position matrix
+        :param strategy: strategy name corresponding to a batch function in Strategy class
+        :param param_grid: list of parameter sets as returned by create_parameter_grid
+        :param data: dataframe containing the data the use for the strategy
+        :param first_date: first date used to calculate the scores, see run_backtest
+        :param batched: False to compute the positions with one run_<strategy> per parameter set, the execution rules
+        and the scores are still computed for all of them at once
+        :return: numpy array with the score of each parameter set, in the same order as param_grid
+        """
+        # Set data
+        if data is None:
+            data = self.data
+        self._strategy.set_data(data)
+
+        # Run strategy for all parameter sets
+        if batched:
+            signals = getattr(self._strategy, 'batch_' + strategy)(param_grid)
+        else:
+            signals = self._strategy.grid_positions(strategy, param_grid)
+        positions, fill_returns = self._strategy.execute(signals)
+        close = data['close'].to_numpy()
+
+        # Excludes extra rows added for calculation purposes
+        if first_date:
+            mask = (data.index >= first_date)
+            positions, close = positions[mask], close[mask]
+            fill_returns = None if fill_returns is None else fill_returns[mask]
+
+        return self._strategy.compute_scores(close, positions, fill_returns)
+
+    @PROFILER.timed('parameter_grid')
     def create_parameter_grid(self, strategy: str):
         """
         Creates a grid of all parameter combinations given the start, end, and step value for each parameter
         :param strategy: name of the backtesting strategy
         :return: dictionary of all combinations
         """
-        # Read data from database
-        query = f"SELECT * FROM {self._dbwrapper.parameters_table} WHERE strategy = '{strategy}'"
-        params_df = self._dbwrapper.read_sql_table(query)
+        # Read data from the supplied parameters or the database
+        if self.parameters is not None:
+            params_df = self.parameters[self.parameters['strategy'] == strategy].copy()
+        else:
+            query = f"SELECT * FROM {self.dbwrapper.parameters_table} WHERE strategy = '{strategy}'"
+            params_df = self.dbwrapper.read_sql_table(query)
+        return self.parameter_grid(params_df)
 
+    @staticmethod
+    def parameter_grid(params_df: pd.DataFrame):
+        """
+        :param params_df: rows of the parameters table of one strategy
+        :return: dictionary of all combinations
+        """
         # Create grid
         params_dict = dict()
         params_df.loc[params_df.step == 0, 'step'] = 1
@@ -245,6 +516,8 @@ class Backtester:
         :param cols: 
         :return: 
         """
+        import plotly.express as px
+
         fig = px.line(self.data, x='open_time', y='close', title=self.pair, color='black')
         fig.show()
 
@@ -0,0 +1,264 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Logger import Logger
+from python.SyntheticCandles import SyntheticCandles
+from python.Indicators import Indicators
+from python.Strategy import Strategy
+from python.DatabaseWrapper import DatabaseWrapper
+from python.CandleStore import CandleStore
+from python.Backtester import Backtester
+from python.ExecutionSimulator import ExecutionSimulator
+
+
+class Benchmark:
+    """
+    Times the hot paths of the project on deterministic synthetic candles: indicators, strategies, metrics, backtests,
+    walk forward analysis and the database and candle store reads and writes. Every case reports its best time over
+    the repeats, its throughput in rows per second and the peak memory of a separate traced run. Results are saved as
+    JSON and can be compared with a stored baseline to flag regressions.
+    """
+    SIZES = [10000, 100000, 1000000]
+    DEFAULT_TOLERANCE = 0.2
+    PAIR = 'BENCHUSDT'
+    # Hourly candles, a million 4h candles would end after the last date pandas can represent
+    INTERVAL = '1h'
+    BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parents[0]
+    PARAMETERS = pd.DataFrame([['macd', 'sma_short', 10, 50, 10],
+                               ['macd', 'sma_long', 50, 200, 50],
+                               ['modified_macd', 'sma_short', 10, 50, 10],
+                               ['modified_macd', 'sma_long', 50, 200, 50],
+                               ['momentum_h', 'hurst_length', 50, 100, 50],
+                               ['momentum_h', 'hurst_threshold', 0.5, 0.6, 0.1],
+                               ['bnh', 'none', 0, 0, 0]],
+                              columns=['strategy', 'parameter', 'start_value', 'end_value', 'step'])
+    MACD_PARAMS = {'sma_short': 20, 'sma_long': 100}
+    MOMENTUM_PARAMS = {'hurst_length': 100, 'hurst_threshold': 0.5}
+    TARGET_VOLATILITY = 0.005
+
+    def __init__(self, sizes: list = None, repeats: int = 3, seed: int = 0):
+        # Parameters
+        self.sizes = sizes if sizes else self.SIZES
+        self.repeats = repeats
+        self.seed = seed
+        self.results = []
+
+        # Internal variables
+        self._workdir = None
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def cases(self):
+        """
+        :return: list of (name, max_rows, factory) tuples. The factory receives the fixtures of a size and returns the
+        timed function and an optional untimed setup run before every repeat
+        """
+        macd, momentum = self.MACD_PARAMS, self.MOMENTUM_PARAMS
+        return [
+            ('Indicators.sma', None, lambda f: (lambda: Indicators.sma(f['data'], 50), None)),
+            ('Indicators.ema', None, lambda f: (lambda: Indicators.ema(f['data'], 50), None)),
+            ('Indicators.mom', None, lambda f: (lambda: Indicators.mom(f['data'], 50), None)),
+            ('Indicators.hurst', 100000, lambda f: (lambda: Indicators.hurst(f['data'], 100), None)),
+            ('Strategy.run_macd', None, lambda f: (lambda: f['strategy'].run_macd(macd), None)),
+            ('Strategy.run_modified_macd', None, lambda f: (lambda: f['strategy'].run_modified_macd(macd), None)),
+            ('Strategy.run_bnh', None, lambda f: (lambda: f['strategy'].run_bnh({}), None)),
+            ('Strategy.run_momentum_h', 100000, lambda f: (lambda: f['strategy'].run_momentum_h(momentum), None)),
+            ('PerformanceMetrics.get_metrics', None, lambda f: (lambda: f['strategy'].get_metrics(f['results']), None)),
+            ('Backtester.run_backtest', None,
+             lambda f: (lambda: f['backtester'].run_backtest('modified_macd', macd), None)),
+            ('Backtester.run_backtest_batch', None,
+             lambda f: (lambda: f['backtester'].run_backtest_batch('modified_macd', f['grid']), None)),
+            ('Backtester.run_wfa', 100000,
+             lambda f: (lambda: f['backtester'].run_wfa('modified_macd', batched=True), None)),
+            ('Backtester.run_wfa sized', 100000,
+             lambda f: (lambda: f['sized_backtester'].run_wfa('bnh'), None)),
+            ('DatabaseWrapper.upsert_candles', None,
+             lambda f: (lambda: f['dbwrapper'].upsert_candles(f['raw']), lambda: self._delete_candles(f['dbwrapper']))),
+            ('DatabaseWrapper.read_candles', None,
+             lambda f: (lambda: f['dbwrapper'].read_candles(self.PAIR, self.INTERVAL), None)),
+            ('CandleStore.append', None,
+             lambda f: (lambda: f['store'].append(self.PAIR, self.INTERVAL, f['raw']),
+                        lambda: f['store'].delete(self.PAIR, self.INTERVAL))),
+            ('CandleStore.read', None, lambda f: (lambda: f['store'].read(self.PAIR, self.INTERVAL), None)),
+        ]
+
+    def _delete_candles(self, dbwrapper: DatabaseWrapper):
+        dbwrapper.execute_sql_procedure(f"DELETE FROM {dbwrapper.candles_table} WHERE pair = '{self.PAIR}'")
+
+    def _fixtures(self, rows: int):
+        """
+        Creates the synthetic candles of a size and the objects that read them, in a temporary folder
+        :param rows: number of candles
+        :return: dictionary of fixtures
+        """
+        generator = SyntheticCandles(seed=self.seed)
+        raw = generator.generate_raw(rows, self.PAIR, self.INTERVAL)
+        database_name = os.path.join(self._workdir, f'bench_{rows}')
+        dbwrapper = DatabaseWrapper(database_name=database_name)
+        dbwrapper.upsert_candles(raw)
+        self.PARAMETERS.to_sql(dbwrapper.parameters_table, dbwrapper._sql_connection, if_exists='replace', index=False)
+        store = CandleStore(os.path.join(self._workdir, f'candles_{rows}'))
+        store.append(self.PAIR, self.INTERVAL, raw)
+
+        backtester = Backtester(self.PAIR, self.INTERVAL, database_name=database_name, update=False)
+        # Volatility sizing holds fractional positions, also reported by the last recommendation of run_wfa
+        sized_backtester = Backtester(self.PAIR, self.INTERVAL, database_name=database_name, update=False,
+                                      execution=ExecutionSimulator(target_volatility=self.TARGET_VOLATILITY))
+        strategy = Strategy(backtester.get_strategy_allocation(), backtester.taker_fee)
+        strategy.set_data(backtester.data)
+        strategy.run_modified_macd(self.MACD_PARAMS)
+        return {'data': backtester.data,
+                'raw': raw,
+                'dbwrapper': dbwrapper,
+                'store': store,
+                'backtester': backtester,
+                'sized_backtester': sized_backtester,
+                'strategy': strategy,
+                'results': strategy.results,
+                'grid': backtester.create_parameter_grid('modified_macd')}
+
+    def measure(self, func, setup=None):
+        """
+        :param func: function to time
+        :param setup: function run before every repeat, not timed
+        :return: tuple of (best time in seconds, peak traced memory in MB)
+        """
+        times = []
+        for _ in range(self.repeats):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        # Memory is traced in a separate run, tracing slows down the allocations
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return min(times), peak / 1024 ** 2
+
+    def run(self, names: list = None):
+        """
+        Runs the cases whose name contains any of names, all of them by default
+        :param names: filters of the case names
+        :return: list of results as dictionaries
+        """
+        cases = [case for case in self.cases() if not names or any(name in case[0] for name in names)]
+        self.results = []
+
+        # Indicator results are not reused between repeats and the modules do not log every call
+        cache_enabled = Indicators.cache.enabled
+        Indicators.cache.enabled = False
+        logging.disable(logging.INFO)
+        self._workdir = tempfile.mkdtemp(prefix='benchmark_')
+        try:
+            for rows in self.sizes:
+                fixtures = self._fixtures(rows)
+                for name, max_rows, factory in cases:
+                    if max_rows and rows > max_rows:
+                        continue
+                    func, setup = factory(fixtures)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        seconds, peak_mb = self.measure(func, setup)
+                    self.results.append({'case': name,
+                                         'rows': rows,
+                                         'seconds': round(seconds, 6),
+                                         'rows_per_s': round(rows / seconds, 1) if seconds else None,
+                                         'peak_mb': round(peak_mb, 3)})
+                    print(f'{name:<34} {rows:>9} rows {seconds:>10.4f} s {peak_mb:>10.1f} MB')
+                fixtures['dbwrapper']._sql_connection.dispose()
+        finally:
+            logging.disable(logging.NOTSET)
+            Indicators.cache.enabled = cache_enabled
+            shutil.rmtree(self._workdir, ignore_errors=True)
+        return self.results
+
+    def to_dict(self):
+        """
+        :return: machine-readable results with the environment they were measured in
+        """
+        return {'created': pd.Timestamp.now().isoformat(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'seed': self.seed,
+                'repeats': self.repeats,
+                'results': self.results}
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @staticmethod
+    def compare(results: list, baseline: dict, tolerance: float = DEFAULT_TOLERANCE):
+        """
+        Compares results with a baseline saved by save
+        :param results: list of results returned by run
+        :param baseline: dictionary loaded from a saved results file
+        :param tolerance: relative change of time or memory above which a case is flagged
+        :return: dataframe with the changes of every case present in both, flagged in the status column
+        """
+        current = pd.DataFrame(results)
+        previous = pd.DataFrame(baseline.get('results', []))
+        if current.empty or previous.empty:
+            return pd.DataFrame()
+        compared = current.merge(previous, on=['case', 'rows'], suffixes=('', '_baseline'))
+        compared['time_change'] = (compared['seconds'] / compared['seconds_baseline'] - 1).round(3)
+        compared['memory_change'] = (compared['peak_mb'] / compared['peak_mb_baseline'].replace(0, np.nan) - 1).round(3)
+        compared['status'] = np.select([(compared['time_change'] > tolerance) | (compared['memory_change'] > tolerance),
+                                        compared['time_change'] < -tolerance / (1 + tolerance)],
+                                       ['REGRESSION', 'faster'], 'ok')
+        return compared[['case', 'rows', 'seconds_baseline', 'seconds', 'time_change', 'peak_mb_baseline', 'peak_mb',
+                         'memory_change', 'status']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the hot paths of the project on synthetic candles')
+    parser.add_argument('--rows', type=int, nargs='+', default=Benchmark.SIZES, help='number of candles of each run')
+    parser.add_argument('--repeats', type=int, default=3, help='runs of every case, the best time is reported')
+    parser.add_argument('--cases', nargs='+', help='only run the cases whose name contains any of these')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic candles')
+    parser.add_argument('--output', default=str(Benchmark.BASE_DIR / 'benchmarks' / 'results.json'),
+                        help='JSON file where the results are saved')
+    parser.add_argument('--baseline', default=str(Benchmark.BASE_DIR / 'benchmarks' / 'baseline.json'),
+                        help='JSON file of a previous run to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='also save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=Benchmark.DEFAULT_TOLERANCE,
+                        help='relative slowdown or memory increase flagged as a regression')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.rows, args.repeats, args.seed)
+    benchmark.run(args.cases)
+    benchmark.save(args.output)
+    if args.save_baseline:
+        benchmark.save(args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            comparison = Benchmark.compare(benchmark.results, json.load(f), args.tolerance)
+        print(comparison.to_string(index=False))
+        if (comparison['status'] == 'REGRESSION').any():
+            sys.exit(1)
@@ -0,0 +1,166 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Logger import Logger
+
+
+class CandleStore:
+    """
+    Columnar candle storage: every (pair, interval) series is a directory with one file of fixed-width values per
+    column, sorted by open_time. Files are memory-mapped on read, so loading a series does not parse anything and date
+    ranges are found with a binary search over open_time.
+    """
+    COLUMNS = {'open_time': np.int64,
+               'open': np.float64,
+               'high': np.float64,
+               'low': np.float64,
+               'close': np.float64,
+               'volume': np.float64,
+               'close_time': np.int64,
+               'number_of_trades': np.float64}
+    TIME_COLUMNS = ['open_time', 'close_time']
+    BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parents[0]
+
+    def __init__(self, path: str = None):
+        self.path = Path(path) if path else self.BASE_DIR / 'db' / 'candles'
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def _series_dir(self, pair: str, interval: str):
+        return self.path / f'{pair}_{interval}'
+
+    def _column_file(self, pair: str, interval: str, column: str):
+        return self._series_dir(pair, interval) / f'{column}.bin'
+
+    def rows(self, pair: str, interval: str):
+        """
+        :return: number of complete rows stored for the pair and interval
+        """
+        sizes = [self._column_file(pair, interval, column).stat().st_size // np.dtype(dtype).itemsize
+                 if self._column_file(pair, interval, column).exists() else 0
+                 for column, dtype in self.COLUMNS.items()]
+        return min(sizes)
+
+    def read_arrays(self, pair: str, interval: str, start_date=None, end_date=None, columns: list = None):
+        """
+        Returns read-only memory-mapped views of the stored columns, without copying them
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param start_date: first open_time to return
+        :param end_date: last close_time to return
+        :param columns: columns to return, all by default. open_time is always returned
+        :return: dictionary of numpy arrays, times as int64 epoch milliseconds
+        """
+        columns = ['open_time'] + [column for column in (columns or self.COLUMNS) if column != 'open_time']
+        rows = self.rows(pair, interval)
+        if not rows:
+            return {column: np.empty(0, dtype=self.COLUMNS[column]) for column in columns}
+
+        arrays = {column: np.memmap(self._column_file(pair, interval, column), dtype=self.COLUMNS[column], mode='r',
+                                    shape=(rows,))
+                  for column in set(columns) | {'close_time'}}
+
+        # Binary search of the date range over the sorted time columns
+        first = np.searchsorted(arrays['open_time'], self._to_epoch_ms(start_date), 'left') if start_date else 0
+        last = np.searchsorted(arrays['close_time'], self._to_epoch_ms(end_date), 'right') if end_date else rows
+        return {column: arrays[column][first:max(first, last)] for column in columns}
+
+    def read(self, pair: str, interval: str, start_date=None, end_date=None, columns: list = None):
+        """
+        Reads a series as a dataframe indexed by open_time, in the same shape as Backtester.get_data
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param start_date: first open_time to return
+        :param end_date: last close_time to return
+        :param columns: columns to return, all by default
+        :return: pandas dataframe with candlestick data
+        """
+        arrays = self.read_arrays(pair, interval, start_date, end_date, columns)
+        index = pd.DatetimeIndex(arrays.pop('open_time').astype('datetime64[ms]'), name='open_time')
+        data = {column: values.astype('datetime64[ms]') if column in self.TIME_COLUMNS else values
+                for column, values in arrays.items()}
+        return pd.DataFrame(data, index=index)
+
+    def last_open_time(self, pair: str, interval: str, skip: int = 0):
+        """
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param skip: number of candles at the end of the series to ignore
+        :return: open_time of the last stored candle as a timestamp, None if there is no data
+        """
+        rows = self.rows(pair, interval) - skip
+        if rows <= 0:
+            return None
+        open_time = np.memmap(self._column_file(pair, interval, 'open_time'), dtype=np.int64, mode='r', shape=(rows,))
+        return pd.to_datetime(int(open_time[-1]), unit='ms')
+
+    def append(self, pair: str, interval: str, data: pd.DataFrame):
+        """
+        Appends candles to a series. Candles from the first new open_time onwards replace the stored ones, so
+        re-downloading the last (still open) candle updates it instead of duplicating it. Candles older than the stored
+        data are ignored.
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param data: dataframe with at least the columns in COLUMNS, as returned by read_candlestick_data
+        :return: number of rows written
+        """
+        if data is None or not len(data):
+            return 0
+
+        # Convert to fixed-width arrays sorted by open_time
+        data = data.drop_duplicates('open_time', keep='last').sort_values('open_time')
+        arrays = {column: (self._to_epoch_ms(data[column]) if column in self.TIME_COLUMNS else
+                           data[column].to_numpy(dtype=dtype))
+                  for column, dtype in self.COLUMNS.items()}
+
+        self._series_dir(pair, interval).mkdir(parents=True, exist_ok=True)
+        rows = self.rows(pair, interval)
+        if rows:
+            stored = np.memmap(self._column_file(pair, interval, 'open_time'), dtype=np.int64, mode='r',
+                               shape=(rows,))
+            # Only overwrite the tail when the new candles reach the end of the stored ones
+            if arrays['open_time'][-1] >= stored[-1]:
+                keep = int(np.searchsorted(stored, arrays['open_time'][0], 'left'))
+            else:
+                keep = rows
+                new = arrays['open_time'] > stored[-1]
+                arrays = {column: values[new] for column, values in arrays.items()}
+            del stored
+        else:
+            keep = 0
+
+        # Truncate every column to the rows kept (also repairs columns left longer by an interrupted write) and append
+        for column, values in arrays.items():
+            with open(self._column_file(pair, interval, column), 'ab') as f:
+                f.truncate(keep * np.dtype(self.COLUMNS[column]).itemsize)
+                f.write(np.ascontiguousarray(values, dtype=self.COLUMNS[column]).tobytes())
+
+        return len(arrays['open_time'])
+
+    def delete(self, pair: str, interval: str):
+        """
+        Removes a series from the store
+        :return:
+        """
+        series_dir = self._series_dir(pair, interval)
+        if series_dir.exists():
+            for column_file in series_dir.iterdir():
+                column_file.unlink()
+            series_dir.rmdir()
+
+    @staticmethod
+    def _to_epoch_ms(values):
+        """
+        Converts dates (datetime, string, timestamp or series of them) to int64 epoch milliseconds
+        """
+        if isinstance(values, pd.Series):
+            if pd.api.types.is_numeric_dtype(values):
+                return values.to_numpy(dtype=np.int64)
+            return pd.to_datetime(values).to_numpy(dtype='datetime64[ms]').astype(np.int64)
+        return pd.Timestamp(values).to_datetime64().astype('datetime64[ms]').astype(np.int64)
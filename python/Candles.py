@@ -0,0 +1,136 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+
+
+class Candles:
+    """
+    Compact container of one candle series. The pair and interval are kept once as metadata instead of as string
+    columns, times are datetime64 epoch timestamps, trade counts are integers and prices and volumes are float64 or,
+    to halve their memory, float32. Every column is its own contiguous array and frame and slice return views of them,
+    so the dataframes handed to the strategies do not copy the candles.
+    """
+    TIME_COLUMNS = ['open_time', 'close_time']
+    COUNT_COLUMNS = ['number_of_trades']
+    PRECISIONS = ['float64', 'float32']
+    TIME_DTYPE = np.dtype('datetime64[ns]')
+    COUNT_DTYPE = np.dtype('int64')
+
+    def __init__(self, pair: str, interval: str, open_time, columns: dict, precision: str = 'float64'):
+        """
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param open_time: open times of the candles, sorted
+        :param columns: dictionary of column name and values, in the order they are returned
+        :param precision: 'float64' or 'float32', dtype of the prices, volumes and any other float column
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f'Unknown precision {precision}, use one of {self.PRECISIONS}')
+        self.pair = pair
+        self.interval = interval
+        self.precision = precision
+        self.open_time = self._typed('open_time', open_time)
+        self.columns = {column: self._typed(column, values) for column, values in columns.items()}
+
+    def _typed(self, column: str, values):
+        """
+        :return: values as a contiguous array of the dtype of the column, without copying them if they already are
+        """
+        values = np.asarray(values)
+        if column in self.TIME_COLUMNS:
+            # Integers are epoch milliseconds, as stored in the database and the candle store
+            dtype = self.TIME_DTYPE if values.dtype.kind == 'M' else 'datetime64[ms]'
+            return np.ascontiguousarray(values.astype(dtype, copy=False).astype(self.TIME_DTYPE, copy=False))
+        if column in self.COUNT_COLUMNS:
+            # Missing counts are stored as 0, integers have no NaN
+            if values.dtype.kind == 'f':
+                values = np.nan_to_num(values, nan=0)
+            return np.ascontiguousarray(values, dtype=self.COUNT_DTYPE)
+        if values.dtype.kind == 'f':
+            return np.ascontiguousarray(values, dtype=self.precision)
+        return np.ascontiguousarray(values)
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, pair: str = None, interval: str = None, precision: str = 'float64'):
+        """
+        :param data: candles indexed by open_time, as returned by DatabaseWrapper.read_candles, or with open_time, pair
+        and interval columns, as returned by ExchangeConnector.read_candlestick_data
+        :param pair: currency pair, read from the pair column when not given
+        :param interval: data granularity, read from the interval column when not given
+        :param precision: 'float64' or 'float32', dtype of the prices and volumes
+        :return: Candles
+        """
+        metadata = {}
+        for name, value in [('pair', pair), ('interval', interval)]:
+            if name in data.columns:
+                values = data[name].unique()
+                if len(values) > 1:
+                    raise ValueError(f'Candles of more than one {name}: {list(values)}')
+                value = value if value else (values[0] if len(values) else None)
+            metadata[name] = value
+
+        open_time = data['open_time'] if 'open_time' in data.columns else data.index
+        columns = {column: data[column].to_numpy() for column in data.columns
+                   if column not in ['pair', 'interval', 'open_time']}
+        return cls(metadata['pair'], metadata['interval'], open_time.to_numpy(), columns, precision)
+
+    @classmethod
+    def from_arrays(cls, pair: str, interval: str, arrays: dict, precision: str = 'float64'):
+        """
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param arrays: dictionary of column arrays including open_time, as returned by CandleStore.read_arrays
+        :param precision: 'float64' or 'float32', dtype of the prices and volumes
+        :return: Candles
+        """
+        arrays = dict(arrays)
+        return cls(pair, interval, arrays.pop('open_time'), arrays, precision)
+
+    def __len__(self):
+        return len(self.open_time)
+
+    def __getitem__(self, column: str):
+        return self.open_time if column == 'open_time' else self.columns[column]
+
+    @property
+    def nbytes(self):
+        """
+        :return: bytes held by the arrays of the series
+        """
+        return self.open_time.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    def slice(self, start: int = None, stop: int = None):
+        """
+        :param start: first row
+        :param stop: row after the last one
+        :return: Candles with views of the rows between start and stop
+        """
+        rows = slice(start, stop)
+        candles = Candles.__new__(Candles)
+        candles.pair, candles.interval, candles.precision = self.pair, self.interval, self.precision
+        candles.open_time = self.open_time[rows]
+        candles.columns = {column: values[rows] for column, values in self.columns.items()}
+        return candles
+
+    def astype(self, precision: str):
+        """
+        :param precision: 'float64' or 'float32'
+        :return: Candles with the float columns in the given precision, the same object if they already are
+        """
+        if precision == self.precision:
+            return self
+        return Candles(self.pair, self.interval, self.open_time, self.columns, precision)
+
+    def frame(self, start: int = None, stop: int = None):
+        """
+        :param start: first row
+        :param stop: row after the last one
+        :return: pandas dataframe indexed by open_time, in the shape of DatabaseWrapper.read_candles, whose columns are
+        views of the arrays of the series
+        """
+        rows = slice(start, stop)
+        index = pd.DatetimeIndex(self.open_time[rows], name='open_time', copy=False)
+        return pd.DataFrame({column: values[rows] for column, values in self.columns.items()}, index=index, copy=False)
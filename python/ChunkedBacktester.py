@@ -0,0 +1,170 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+from pprint import pprint
+# -- User custom function, classes and objects
+from python.Logger import Logger
+from python.CandleStore import CandleStore
+from python.Candles import Candles
+from python.Strategy import Strategy
+from python.Indicators import Indicators
+from python.StreamingMetrics import StreamingMetrics
+from python.ExecutionSimulator import ExecutionSimulator
+from python.Profiler import PROFILER
+
+
+class ChunkedBacktester:
+    """
+    Out-of-core backtest of a strategy on one pair and interval, for histories that do not fit comfortably in memory.
+    The candles are read in chunks of chunksize rows and each chunk is run with the last rows of the previous one as
+    indicator warm-up. The execution rules continue from the positions left open by the previous chunk and the metrics
+    are accumulated by StreamingMetrics, so the positions and metrics are those of Backtester.run_backtest on the whole
+    history while the memory is bounded by the chunk size.
+    """
+    DEFAULT_CHUNKSIZE = 100000
+
+    def __init__(self, pair: str = 'BTCUSDT', interval: str = '4h', initial_capital: int = 5000,
+                 start_date: datetime = None, end_date: datetime = None, storage: str = 'sql',
+                 execution: ExecutionSimulator = None, database_name: str = 'db/db',
+                 chunksize: int = DEFAULT_CHUNKSIZE, precision: str = 'float64', chunks=None):
+        """
+        :param chunksize: rows read and run at a time
+        :param precision: 'float64' or 'float32', dtype in which the prices and volumes of every chunk are kept
+        :param chunks: function returning an iterator of candle dataframes indexed by open_time and in order, used
+        instead of reading the database (e.g. to read the chunks from files)
+        """
+        # Parameters
+        self.pair = pair
+        self.interval = interval
+        self.initial_capital = initial_capital
+        self.start_date = start_date
+        self.end_date = end_date
+        self.storage = storage
+        self.execution = execution
+        self.database_name = database_name
+        self.chunksize = chunksize
+        self.precision = precision
+        self.chunks = chunks
+        self.taker_fee = 0.1 / 100
+        self.metrics = StreamingMetrics(self.initial_capital, self.taker_fee)
+
+        # Internal variables
+        self._dbwrapper = None
+        self._strategy = Strategy(self.initial_capital, self.taker_fee)
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    @property
+    def dbwrapper(self):
+        # Created on first use, as in Backtester
+        if self._dbwrapper is None:
+            from python.DatabaseWrapper import DatabaseWrapper
+            self._dbwrapper = DatabaseWrapper(candle_store=CandleStore() if self.storage == 'columnar' else None,
+                                              database_name=self.database_name)
+        return self._dbwrapper
+
+    def read_chunks(self):
+        """
+        :return: iterator of candle dataframes of at most chunksize rows within the date range, with only the columns
+        used by the strategies and the execution rules
+        """
+        if self.chunks is None:
+            columns = ['close'] + (ExecutionSimulator.OHLC_COLUMNS[:3] if self.execution is not None else [])
+            yield from self.dbwrapper.read_candles(self.pair, self.interval, self.start_date, self.end_date,
+                                                   columns, self.chunksize)
+            return
+
+        for chunk in self.chunks():
+            if self.start_date is not None:
+                chunk = chunk[chunk.index >= pd.Timestamp(self.start_date)]
+            if self.end_date is not None:
+                chunk = chunk[chunk.index <= pd.Timestamp(self.end_date)]
+            yield chunk
+
+    @staticmethod
+    def warmup_rows(params: dict):
+        """
+        :param params: set of parameters of the strategy
+        :return: rows of the previous chunk needed to compute the indicators of the first row of a chunk, the longest
+        indicator window
+        """
+        lengths = [int(value) for value in params.values() if isinstance(value, (int, float, np.number))]
+        return max(lengths + [0])
+
+    def iter_backtest(self, strategy: str, params: dict, warmup: int = None):
+        """
+        Runs the strategy chunk by chunk, accumulating the metrics in metrics
+        :param strategy: strategy name corresponding to a function in Strategy class
+        :param params: set of parameters used to run the strategy
+        :param warmup: rows of the previous chunk prepended to each chunk, warmup_rows by default
+        :return: iterator of the results dataframe of every chunk, with close, position and, with execution rules,
+        fill_return columns
+        """
+        warmup = self.warmup_rows(params) if warmup is None else warmup
+        self.metrics.reset()
+        state = {}
+        previous = None
+        for chunk in self.read_chunks():
+            if not len(chunk):
+                continue
+            chunk = Candles.from_frame(chunk, self.pair, self.interval, self.precision).frame()
+            data = chunk if previous is None or not warmup else pd.concat([previous.iloc[-warmup:], chunk])
+
+            # Signals on the warm-up and chunk rows, only those of the chunk are kept
+            self._strategy.set_data(data)
+            getattr(self._strategy, 'run_' + strategy)(params)
+            results = self._strategy.results.iloc[len(data) - len(chunk):]
+            positions, fill_returns = results['position'].to_numpy(), None
+
+            # Apply exit and sizing rules from the positions left by the previous chunk
+            if self.execution is not None:
+                with PROFILER.stage('execution'):
+                    positions, fill_returns = self.execution.run(positions, chunk, state)
+                results = results.assign(position=positions, fill_return=fill_returns)
+
+            with PROFILER.stage('metrics'):
+                self.metrics.update(chunk['close'].to_numpy(), positions, chunk.index, fill_returns)
+            previous = data
+            yield results[['close', 'position'] + (['fill_return'] if self.execution is not None else [])]
+
+    def run_backtest(self, strategy: str, params: dict, warmup: int = None):
+        """
+        Runs the strategy over the whole history without keeping the results of the chunks
+        :param strategy: strategy name corresponding to a function in Strategy class
+        :param params: set of parameters used to run the strategy
+        :param warmup: rows of the previous chunk prepended to each chunk, warmup_rows by default
+        :return: dictionary of metrics, as returned by PerformanceMetrics.compute_metrics
+        """
+        # The indicators of a chunk are not requested again, caching them would only grow the memory up to the limit
+        # of the cache
+        cache_enabled = Indicators.cache.enabled
+        Indicators.cache.enabled = False
+        rows = 0
+        try:
+            for results in self.iter_backtest(strategy, params, warmup):
+                rows += len(results)
+        finally:
+            Indicators.cache.enabled = cache_enabled
+        self.logger.info(f'Backtested {rows} rows of {self.pair} {self.interval} in chunks of {self.chunksize}')
+        return self.metrics.get_metrics()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest a strategy on a long history in chunks')
+    parser.add_argument('--pair', default='BTCUSDT')
+    parser.add_argument('--interval', default='1m')
+    parser.add_argument('--strategy', default='modified_macd')
+    parser.add_argument('--params', nargs='*', default=['sma_short=20', 'sma_long=100'],
+                        help='strategy parameters as name=value')
+    parser.add_argument('--storage', default='sql', choices=['sql', 'columnar'])
+    parser.add_argument('--chunksize', type=int, default=ChunkedBacktester.DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    params = {name: float(value) for name, value in (param.split('=') for param in args.params)}
+    bt = ChunkedBacktester(args.pair, args.interval, storage=args.storage, chunksize=args.chunksize)
+    pprint(bt.run_backtest(args.strategy, params), sort_dicts=False, width=60)
@@ -7,14 +7,19 @@ import calendar
 import time
 from pathlib import Path
 import math
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
 from dateutil import relativedelta
 import datetime
 from dateutil import tz
 # User custom function, classes and objects
-from python.ExchangeConnector import ExchangeConnector
+from python.CandleStore import CandleStore
+from python.Resampler import Resampler
+from python.RateLimiter import RateLimiter, EXCHANGE_RATE_LIMITER
 from python.Logger import Logger
+from python.Profiler import PROFILER
 
 
 class DatabaseWrapper:
@@ -25,15 +30,31 @@ class DatabaseWrapper:
     H_PER_DAY = 24
     DAY_PER_W = 7
     DEFAULT_API_LIMIT = 1000
+    KLINES_REQUEST_WEIGHT = 2
+    MAX_CONCURRENT_REQUESTS = 8
+    MAX_RETRIES = 3
+    RETRY_BACKOFF_S = 0.5
     BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parents[0]
+    # Version 2: integer epoch milliseconds and a unique (pair, interval, open_time) key in the candles table
+    SCHEMA_VERSION = 2
+    CANDLE_COLUMNS = ['pair', 'interval', 'open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time',
+                      'number_of_trades']
 
-    def __init__(self, exchange_connector=None):
-        self.database_name = 'db/db'
+    def __init__(self, exchange_connector=None, candle_store: CandleStore = None, rate_limiter: RateLimiter = None,
+                 max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS, database_name: str = 'db/db'):
+        self.database_name = database_name
         self.candles_table = 'RAW_CANDLES_DATA'
         self.parameters_table = 'OPTIMISATION_PARAMETERS'
 
+        # Candles are kept in the candle store instead of candles_table when one is given
+        self.candle_store = candle_store
+
+        # Requests to the exchange share the weight budget of the rate limiter, by default the one of the whole process
+        self.rate_limiter = rate_limiter if rate_limiter else EXCHANGE_RATE_LIMITER
+        self.max_concurrent_requests = max_concurrent_requests
+
         # Internal variables
-        self._exchange_connector = exchange_connector if exchange_connector else ExchangeConnector()
+        self._exchange_connector = exchange_connector
         self._sql_connection = {}
 
         # Logger
@@ -41,14 +62,184 @@ class DatabaseWrapper:
 
         # Functions
         self.create_db_connection()
+        self.check_schema()
+
+    @property
+    def exchange_connector(self):
+        # Created on first use, so that working with the database alone does not load the exchange client. Candles are
+        # public market data, the pooled client needs no credentials
+        if self._exchange_connector is None:
+            from python.ExchangeClient import ExchangeClient
+            self._exchange_connector = ExchangeClient(rate_limiter=self.rate_limiter,
+                                                      pool_size=self.max_concurrent_requests,
+                                                      max_retries=self.MAX_RETRIES,
+                                                      retry_backoff_s=self.RETRY_BACKOFF_S)
+        return self._exchange_connector
 
     def create_db_connection(self):
         try:
             db_path = os.path.join(self.BASE_DIR, "{}.db".format(self.database_name))
             self._sql_connection = create_engine('sqlite:///' + db_path, echo=False)
+            event.listen(self._sql_connection, 'connect', self._set_sqlite_pragmas)
         except Exception as e:
             self.logger.error(f'Error creating SQL connection: {e}')
 
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets backtests keep reading while an update is writing
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def check_schema(self):
+        """
+        Creates the candles table in new databases and warns when an existing one needs to be migrated
+        :return:
+        """
+        try:
+            if self.get_schema_version() >= self.SCHEMA_VERSION:
+                return
+            with self._sql_connection.connect() as connection:
+                exists = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                                                    (self.candles_table,)).first()
+            if exists:
+                self.logger.warning(f'{self.candles_table} uses an old schema, run python/MigrateDatabase.py to '
+                                    f'migrate it to version {self.SCHEMA_VERSION}')
+            else:
+                self.create_candles_table()
+        except Exception as e:
+            self.logger.error(f'Error checking the database schema: {e}')
+
+    def get_schema_version(self):
+        """
+        :return: schema version of the database, 0 for databases created before versioning
+        """
+        with self._sql_connection.connect() as connection:
+            return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+    def create_candles_table(self, table: str = None):
+        """
+        Creates the candles table with the current schema if it does not exist
+        :param table: name of the table, candles_table by default
+        :return:
+        """
+        with self._sql_connection.begin() as connection:
+            connection.exec_driver_sql(self._create_candles_query(table))
+            if not table:
+                connection.exec_driver_sql(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def _create_candles_query(self, table: str = None):
+        return f"CREATE TABLE IF NOT EXISTS {table or self.candles_table} (" \
+               f"pair TEXT NOT NULL, interval TEXT NOT NULL, open_time INTEGER NOT NULL, open REAL, high REAL, " \
+               f"low REAL, close REAL, volume REAL, close_time INTEGER NOT NULL, number_of_trades INTEGER, " \
+               f"PRIMARY KEY (pair, interval, open_time)) WITHOUT ROWID"
+
+    def migrate_schema(self, chunksize: int = 100000):
+        """
+        Migrates a candles table created with text timestamps and no unique key to the current schema. Rows are
+        copied in chunks through upsert_candles, so duplicated candles are merged, and the old table is dropped
+        :param chunksize: number of rows read at a time from the old table
+        :return: number of rows in the migrated table
+        """
+        if self.get_schema_version() >= self.SCHEMA_VERSION:
+            self.logger.info(f'Database already has schema version {self.SCHEMA_VERSION}')
+            return None
+
+        with self._sql_connection.connect() as connection:
+            exists = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                                                (self.candles_table,)).first()
+        if not exists:
+            self.create_candles_table()
+            return 0
+
+        self.logger.info(f'Migrating {self.candles_table} to schema version {self.SCHEMA_VERSION}')
+
+        # Every step runs in a single transaction of one connection, with the schema version set last, so a migration
+        # that fails part-way leaves the old table as it was and can be run again. The DBAPI connection is used
+        # directly, the driver does not open transactions before the schema changes on its own
+        old_table = f'{self.candles_table}_V1'
+        connection = self._sql_connection.raw_connection()
+        dbapi_connection = connection.dbapi_connection
+        isolation_level = dbapi_connection.isolation_level
+        dbapi_connection.isolation_level = None
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(f'ALTER TABLE {self.candles_table} RENAME TO {old_table}')
+                cursor.execute(self._create_candles_query())
+                for chunk in pd.read_sql(f'SELECT * FROM {old_table}', con=dbapi_connection, chunksize=chunksize):
+                    chunk[['open_time', 'close_time']] = chunk[['open_time', 'close_time']].apply(pd.to_datetime)
+                    cursor.executemany(self._upsert_candles_query(), self._candle_rows(chunk))
+                cursor.execute(f'DROP TABLE {old_table}')
+                cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+                rows = cursor.execute(f'SELECT COUNT(*) FROM {self.candles_table}').fetchone()[0]
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        finally:
+            dbapi_connection.isolation_level = isolation_level
+            connection.close()
+        self.logger.info(f'Migrated {rows} rows of {self.candles_table} to schema version {self.SCHEMA_VERSION}')
+        return rows
+
+    @PROFILER.timed('sql_write')
+    def upsert_candles(self, data: pd.DataFrame):
+        """
+        Inserts candles, replacing the values of the ones already stored, with a single executemany in one transaction
+        :param data: dataframe with the columns in CANDLE_COLUMNS, times as datetimes
+        :return: number of rows written
+        """
+        if data is None or not len(data):
+            return 0
+
+        with self._sql_connection.begin() as connection:
+            connection.exec_driver_sql(self._upsert_candles_query(), self._candle_rows(data))
+        return len(data)
+
+    def _upsert_candles_query(self):
+        updates = ', '.join(f'{column}=excluded.{column}' for column in self.CANDLE_COLUMNS[3:])
+        return f"INSERT INTO {self.candles_table} ({', '.join(self.CANDLE_COLUMNS)}) " \
+               f"VALUES ({', '.join('?' * len(self.CANDLE_COLUMNS))}) " \
+               f"ON CONFLICT(pair, interval, open_time) DO UPDATE SET {updates}"
+
+    def _candle_rows(self, data: pd.DataFrame):
+        """
+        :param data: dataframe with the columns in CANDLE_COLUMNS, times as datetimes
+        :return: list of rows of native python values in the order of CANDLE_COLUMNS, times as epoch milliseconds
+        """
+        columns = []
+        for column in self.CANDLE_COLUMNS:
+            if column in ['open_time', 'close_time']:
+                values = pd.to_datetime(data[column]).to_numpy(dtype='datetime64[ms]').astype('int64')
+            elif column == 'number_of_trades':
+                # Missing counts are written as NULL, an integer array has no NaN
+                values = data[column].astype('Int64').to_numpy(dtype=object, na_value=None)
+            elif column in ['pair', 'interval']:
+                values = data[column].to_numpy(dtype=object)
+            else:
+                values = data[column].to_numpy(dtype=float)
+            columns.append(values.tolist())
+        return list(zip(*columns))
+
+    def get_last_open_time(self, pair: str, interval: str, skip: int = 0):
+        """
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param skip: number of candles at the end of the series to ignore
+        :return: open_time of the last stored candle as a timestamp, None if there is no data
+        """
+        if self.candle_store:
+            return self.candle_store.last_open_time(pair, interval, skip)
+
+        query = f"SELECT open_time FROM {self.candles_table} WHERE pair = ? AND interval = ? " \
+                f"ORDER BY open_time DESC LIMIT 1 OFFSET ?"
+        with self._sql_connection.connect() as connection:
+            last = connection.exec_driver_sql(query, (pair, interval, skip)).scalar()
+        return pd.to_datetime(last, unit='ms') if last is not None else None
+
     def execute_sql_procedure(self, query: str):
         try:
             return self._sql_connection.execute(query)
@@ -61,10 +252,176 @@ class DatabaseWrapper:
         except Exception as e:
             self.logger.error(f'Error reading SQL table: {e}')
 
-    def market_data_update(self, pair: str, interval: str):
+    @PROFILER.timed('data_read')
+    def read_candles(self, pair: str, interval: str, start_date=None, end_date=None, columns: list = None,
+                     chunksize: int = None):
+        """
+        Reads the candles of a pair and interval with a parameterized query. Only the requested columns are read and the
+        date range is resolved on the (pair, interval, open_time) key. Prices come back as float64 and times as
+        datetime64, indexed by open_time
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param start_date: first open_time to return
+        :param end_date: last close_time to return
+        :param columns: columns to return, all the candle values by default
+        :param chunksize: if given, returns an iterator of dataframes of at most chunksize rows
+        :return: pandas dataframe with candlestick data, or iterator of dataframes
+        """
+        columns = columns if columns else self.CANDLE_COLUMNS[3:]
+        unknown = set(columns) - set(self.CANDLE_COLUMNS[3:])
+        if unknown:
+            raise ValueError(f'Unknown candle columns: {unknown}')
+        start_ms = pd.Timestamp(start_date).value // 10 ** 6 if start_date else None
+        end_ms = pd.Timestamp(end_date).value // 10 ** 6 if end_date else None
+
+        chunks = self._read_candle_chunks(pair, interval, start_ms, end_ms, list(columns), chunksize)
+        if chunksize:
+            return chunks
+        frames = list(chunks)
+        return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+    def _read_candle_chunks(self, pair: str, interval: str, start_ms: int, end_ms: int, columns: list,
+                            chunksize: int = None):
+        # Candle store: slices of the memory-mapped columns
+        if self.candle_store:
+            arrays = self.candle_store.read_arrays(pair, interval, start_ms and pd.to_datetime(start_ms, unit='ms'),
+                                                   end_ms and pd.to_datetime(end_ms, unit='ms'), columns)
+            rows = len(arrays['open_time'])
+            step = chunksize if chunksize else max(rows, 1)
+            for start in range(0, max(rows, 1), step):
+                yield self._candles_frame([values[start:start + step] for values in arrays.values()], columns)
+            return
+
+        # Database: open_time bounds use the key, close_time <= end_date implies open_time <= end_date
+        query = f"SELECT open_time, {', '.join(columns)} FROM {self.candles_table} WHERE pair = ? AND interval = ?"
+        params = [pair, interval]
+        if start_ms is not None:
+            query += " AND open_time >= ?"
+            params.append(start_ms)
+        if end_ms is not None:
+            query += " AND open_time <= ? AND close_time <= ?"
+            params += [end_ms, end_ms]
+        query += " ORDER BY open_time"
+
+        # The DBAPI cursor avoids building a result row object per candle
+        connection = self._sql_connection.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunksize) if chunksize else cursor.fetchall()
+                # Every value is numeric and epoch milliseconds are exact as float64
+                values = np.array(rows, dtype='float64').reshape(-1, len(columns) + 1).T
+                if len(rows) or not chunksize:
+                    yield self._candles_frame(values, columns)
+                if not chunksize or len(rows) < chunksize:
+                    break
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _candles_frame(values: list, columns: list):
+        """
+        Builds a typed candles dataframe indexed by open_time
+        :param values: list with the open_time values followed by the values of each column
+        :param columns: names of the columns after open_time
+        :return: pandas dataframe with candlestick data
+        """
+        data = {}
+        for column, column_values in zip(['open_time'] + columns, values):
+            if column in ['open_time', 'close_time']:
+                data[column] = np.asarray(column_values, dtype='int64').astype('datetime64[ms]')
+            else:
+                data[column] = np.asarray(column_values, dtype='float64')
+        index = pd.DatetimeIndex(data.pop('open_time'), name='open_time')
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def market_data_update(self, pair: str, interval: str, base_interval: str = None):
+        """
+        Downloads the candles missing in the database for a pair and interval
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param base_interval: if given, only this interval is downloaded and interval is resampled from it
+        :return:
+        """
+        self.market_data_update_many([pair], [interval], base_interval)
+
+    @PROFILER.timed('data_update')
+    def market_data_update_many(self, pairs: list, intervals: list, base_interval: str = None):
+        """
+        Downloads the candles missing in the database for every combination of pairs and intervals. Pages of all the
+        series are requested concurrently, within the request weight budget of the exchange, and failed pages are
+        retried. Each series is reassembled in order and written in a single transaction once all its pages are in.
+        :param pairs: list of currency pairs
+        :param intervals: list of data granularities as strings (e.g. '1h', '4h', '1d', '1w')
+        :param base_interval: if given, only this interval is downloaded and every other interval is resampled from it
+        with resample_update, so that the history of a pair is only fetched once
+        :return:
+        """
+        if base_interval:
+            derived = [interval for interval in intervals if interval != base_interval]
+            for interval in derived:
+                Resampler.check(base_interval, interval)
+            self.market_data_update_many(pairs, [base_interval])
+            for pair in pairs:
+                for interval in derived:
+                    try:
+                        rows = self.resample_update(pair, interval, base_interval)
+                        self.logger.info(f'Rows resampled for {pair} {interval} from {base_interval} : {str(rows)}')
+                    except Exception as e:
+                        self.logger.error(f'{pair} {interval} could not be resampled from {base_interval}: {e}')
+            return
+
+        series = [(pair, interval) for pair in pairs for interval in intervals]
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as pool:
+            futures = {}
+            for pair, interval in series:
+                pages = self._get_update_pages(pair, interval)
+                futures[(pair, interval)] = [pool.submit(self._read_page, pair, interval, start_ts, end_ts)
+                                             for start_ts, end_ts in pages]
+
+            for (pair, interval), page_futures in futures.items():
+                try:
+                    pages = [future.result() for future in page_futures]
+                except Exception as e:
+                    # Writing the other pages would leave a gap that later updates would never fill
+                    self.logger.error(f'Data for {pair} {interval} could not be downloaded: {e}')
+                    continue
+                rows = self._write_candles(pair, interval, pages)
+                self.logger.info(f'Rows inserted for {pair} {interval} in '
+                                 f'{self.candle_store.path if self.candle_store else self.candles_table} : {str(rows)}')
+
+    @PROFILER.timed('resample')
+    def resample_update(self, pair: str, interval: str, base_interval: str):
+        """
+        Derives the candles of interval from the stored candles of base_interval and stores them as any other series.
+        Only the buckets from the last stored one onwards are rebuilt, so that new base candles complete the last
+        bucket and add the following ones
+        :param pair: currency pair
+        :param interval: data granularity to build (e.g. '4h', '1d', '1w')
+        :param base_interval: stored data granularity it is built from (e.g. '1m', '15m', '1h')
+        :return: number of rows written
+        """
+        Resampler.check(base_interval, interval)
+        base = self.read_candles(pair, base_interval, start_date=self.get_last_open_time(pair, interval))
+        data = Resampler.resample(base, interval).reset_index()
+        data.insert(0, 'interval', interval)
+        data.insert(0, 'pair', pair)
+        if self.candle_store:
+            return self.candle_store.append(pair, interval, data)
+        return self.upsert_candles(data)
+
+    def _get_update_pages(self, pair: str, interval: str):
+        """
+        Removes the rows older than MAX_RECORDS candles and splits the missing period in pages of at most
+        DEFAULT_API_LIMIT candles
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :return: list of (start_ts, end_ts) tuples in milliseconds
+        """
         # Set initial values
-        amount = int(interval[0])
-        unit = interval[1]
+        amount = int(interval[:-1])
+        unit = interval[-1]
         current_ts_s = time.time()
 
         # Delete rows before first date to comply with MAX_RECORDS
@@ -74,22 +431,15 @@ class DatabaseWrapper:
                         self.MIN_PER_H * self.SEC_PER_MIN * int(unit == 'h') +
                         self.SEC_PER_MIN * int(unit == 'm')) * amount
         first_ts_s = max(current_ts_s - max_sec_diff, 0)
-        first_date = pd.to_datetime(first_ts_s * 1e9)
-        query = f"DELETE FROM {self.candles_table} WHERE pair = '{pair}' AND interval = '{interval}' " \
-                f"AND open_time < '{first_date}'"
-        self.execute_sql_procedure(query)
-
-        # Delete last row to update last price
-        query = f"DELETE FROM {self.candles_table} WHERE pair = '{pair}' AND interval = '{interval}' " \
-                f"AND open_time = (SELECT MAX(open_time) as max_date FROM {self.candles_table} " \
-                f"WHERE pair = '{pair}' AND interval = '{interval}')"
-        self.execute_sql_procedure(query)
-
-        # Select latest date for pair and interval in database
-        query = f"SELECT MAX(open_time) as max_date FROM {self.candles_table} " \
-                f"WHERE pair = '{pair}' AND interval = '{interval}'"
-        res = self.read_sql_table(query)
-        max_date = res['max_date'].values[0]
+        if not self.candle_store:
+            # The candle store keeps the whole history
+            query = f"DELETE FROM {self.candles_table} WHERE pair = ? AND interval = ? AND open_time < ?"
+            with self._sql_connection.begin() as connection:
+                connection.exec_driver_sql(query, (pair, interval, round(first_ts_s * 1e3)))
+
+        # Download again from the candle before the last one so that the last price is updated, writes replace the
+        # candles that are already stored
+        max_date = self.get_last_open_time(pair, interval, skip=1)
 
         # Get amount of records to insert and difference in seconds between present and first value to insert
         if max_date:
@@ -109,19 +459,51 @@ class DatabaseWrapper:
         from_ts_s = max(current_ts_s - sec_diff, 0)
         sec_diff = current_ts_s - from_ts_s
 
-        # Write values to database by reading a maximum of 1000 records at a time
+        # Split in pages of a maximum of 1000 records
         iterations = math.ceil(records / self.DEFAULT_API_LIMIT)
-        rows = 0
+        pages = []
         for i in range(iterations):
             to_ts_s = from_ts_s + sec_diff // iterations
-            data = self._exchange_connector.read_candlestick_data(pair=pair, interval=interval,
-                                                                  start_ts=round(from_ts_s * 1e3),
-                                                                  end_ts=round(to_ts_s * 1e3))
-            rows += len(data)
+            pages.append((round(from_ts_s * 1e3), round(to_ts_s * 1e3)))
             from_ts_s = to_ts_s
-            res = data.to_sql(self.candles_table, con=self._sql_connection, if_exists='append', index=False)
+        return pages
+
+    @PROFILER.timed('download')
+    def _read_page(self, pair: str, interval: str, start_ts: int, end_ts: int):
+        """
+        Reads one page of candles, waiting for request weight budget and retrying with exponential backoff on errors
+        :return: pandas dataframe with candlestick data
+        """
+        # Connectors with their own rate limiter wait for the weight budget and retry by themselves
+        if getattr(self.exchange_connector, 'rate_limiter', None) is not None:
+            return self.exchange_connector.read_candlestick_data(pair=pair, interval=interval, start_ts=start_ts,
+                                                                 end_ts=end_ts, raise_errors=True)
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.rate_limiter.acquire(self.KLINES_REQUEST_WEIGHT)
+            try:
+                return self.exchange_connector.read_candlestick_data(pair=pair, interval=interval, start_ts=start_ts,
+                                                                     end_ts=end_ts, raise_errors=True)
+            except Exception as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                self.logger.warning(f'Retrying page {start_ts} to {end_ts} of {pair} {interval}: {e}')
+                time.sleep(self.RETRY_BACKOFF_S * 2 ** attempt)
+
+    def _write_candles(self, pair: str, interval: str, pages: list):
+        """
+        Writes the downloaded pages of a series in a single transaction
+        :param pages: list of dataframes in chronological order
+        :return: number of rows written
+        """
+        if not pages:
+            return 0
 
-        self.logger.info(f'Rows inserted in {self.candles_table} : {str(rows)}')
+        # Consecutive pages share their boundary candle
+        data = pd.concat(pages, ignore_index=True).drop_duplicates('open_time', keep='last')
+        if self.candle_store:
+            return self.candle_store.append(pair, interval, data)
+        return self.upsert_candles(data)
 
 
 if __name__ == '__main__':
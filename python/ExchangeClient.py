@@ -0,0 +1,175 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import json
+import time
+import random
+import operator
+from email.utils import parsedate_to_datetime
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+# -- User custom function, classes and objects
+from python.RateLimiter import EXCHANGE_RATE_LIMITER, RateLimiter
+from python.Logger import Logger
+
+
+class ExchangeClient:
+    """
+    HTTP client of the public market data endpoints of the exchange, made for bulk downloads. Requests reuse the
+    pooled connections of one session, wait for the request weight budget of a rate limiter shared by every client of
+    the process and are retried with exponential backoff on rate limits, server errors and connection errors. Klines
+    are decoded from the response straight into typed numpy arrays.
+    """
+    BASE_URL = 'https://api.binance.com'
+    KLINES_PATH = '/api/v3/klines'
+    KLINES_REQUEST_WEIGHT = 2
+    USED_WEIGHT_HEADER = 'X-MBX-USED-WEIGHT-1M'
+    POOL_SIZE = 8
+    MAX_RETRIES = 3
+    RETRY_BACKOFF_S = 0.5
+    TIMEOUT_S = 10
+    # Statuses worth retrying: rate limited, banned for a while after ignoring the rate limit, server errors
+    RETRY_STATUSES = {418, 429, 500, 502, 503, 504}
+    # Position of every kline field in the rows of the response and its dtype
+    KLINE_FIELDS = {'open_time': (0, np.int64),
+                    'open': (1, np.float64),
+                    'high': (2, np.float64),
+                    'low': (3, np.float64),
+                    'close': (4, np.float64),
+                    'volume': (5, np.float64),
+                    'close_time': (6, np.int64),
+                    'number_of_trades': (8, np.int64)}
+
+    def __init__(self, base_url: str = BASE_URL, rate_limiter: RateLimiter = None, pool_size: int = POOL_SIZE,
+                 max_retries: int = MAX_RETRIES, retry_backoff_s: float = RETRY_BACKOFF_S,
+                 timeout_s: float = TIMEOUT_S):
+        """
+        :param base_url: url of the exchange API, or of a local server in tests
+        :param rate_limiter: request weight budget, the one shared by the whole process by default
+        :param pool_size: connections kept open, at least the number of threads making requests
+        :param max_retries: retries of a failed request
+        :param retry_backoff_s: wait before the first retry, doubled on every retry
+        :param timeout_s: timeout of every request
+        """
+        # Parameters
+        self.base_url = base_url.rstrip('/')
+        self.rate_limiter = rate_limiter if rate_limiter else EXCHANGE_RATE_LIMITER
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+        self.timeout_s = timeout_s
+        self.requests = 0
+        self.retries = 0
+
+        # Internal variables
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def request(self, path: str, params: dict = None, weight: int = 1):
+        """
+        Sends a GET request within the weight budget, retrying it when it can succeed later
+        :param path: path of the endpoint
+        :param params: query parameters, None values are left out
+        :param weight: request weight of the endpoint
+        :return: body of the response
+        """
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(weight)
+            self.requests += 1
+            wait = self.retry_backoff_s * 2 ** attempt * (1 + random.random())
+            try:
+                response = self._session.get(self.base_url + path, params=params, timeout=self.timeout_s)
+                used_weight = response.headers.get(self.USED_WEIGHT_HEADER)
+                if used_weight is not None:
+                    self.rate_limiter.observe(float(used_weight))
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.content
+                # Rate limits say how long to wait
+                wait = self.retry_after(response.headers.get('Retry-After'), wait)
+                error = requests.HTTPError(f'{response.status_code} {response.reason}', response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+            self.retries += 1
+            self.logger.warning(f'Retrying {path} in {wait:.2f} s: {error}')
+            time.sleep(wait)
+
+    @staticmethod
+    def retry_after(value: str, default: float):
+        """
+        :param value: Retry-After header, either seconds or an HTTP date
+        :param default: wait used when the header is missing or cannot be read
+        :return: seconds to wait before retrying
+        """
+        if not value:
+            return default
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError, OverflowError):
+            return default
+
+    @classmethod
+    def decode_klines(cls, content: bytes):
+        """
+        :param content: body of a klines response, a list of klines as lists
+        :return: dictionary of typed numpy arrays with the fields in KLINE_FIELDS, times as epoch milliseconds
+        """
+        rows = json.loads(content)
+        return {column: np.fromiter(map(operator.itemgetter(position), rows), dtype, len(rows))
+                for column, (position, dtype) in cls.KLINE_FIELDS.items()}
+
+    def read_klines(self, pair: str, interval: str = '1d', start_ts: int = None, end_ts: int = None,
+                    limit: int = 1000):
+        """
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param start_ts: starting timestamp of data request in milliseconds
+        :param end_ts: ending timestamp of data request in milliseconds
+        :param limit: maximum number of rows to return
+        :return: dictionary of typed numpy arrays, see decode_klines
+        """
+        params = {'symbol': pair,
+                  'interval': interval,
+                  'startTime': start_ts,
+                  'endTime': end_ts,
+                  'limit': limit}
+        return self.decode_klines(self.request(self.KLINES_PATH, params, self.KLINES_REQUEST_WEIGHT))
+
+    def read_candlestick_data(self, pair: str, interval: str = '1d', start_ts: int = None, end_ts: int = None,
+                              limit: int = 1000, raise_errors: bool = False) -> pd.DataFrame:
+        """
+        Same dataframe as ExchangeConnector.read_candlestick_data, so that the client can replace the connector of a
+        DatabaseWrapper
+        :param raise_errors: True to raise request errors once the retries are exhausted, False to log them and return
+        no data
+        :return: pandas dataframe with candlestick data
+        """
+        try:
+            arrays = self.read_klines(pair, interval, start_ts, end_ts, limit)
+        except Exception as e:
+            if raise_errors:
+                raise
+            self.logger.error(f'Error reading klines of {pair} {interval}: {e}')
+            arrays = {column: np.empty(0, dtype) for column, (_, dtype) in self.KLINE_FIELDS.items()}
+
+        data = {'pair': pair, 'interval': interval}
+        for column, values in arrays.items():
+            data[column] = values.astype('datetime64[ms]') if column in ['open_time', 'close_time'] else values
+        return pd.DataFrame(data, columns=list(data))
+
+    def close(self):
+        self._session.close()
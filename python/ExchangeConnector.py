@@ -20,13 +20,14 @@ class ExchangeConnector(AppConfig):
         self.logger = Logger(self.__class__.__name__).logger
 
     def read_candlestick_data(self, pair: str, interval: str = '1d', start_ts: int = None, end_ts: int = None,
-                              limit: int = 1000) -> pd.DataFrame:
+                              limit: int = 1000, raise_errors: bool = False) -> pd.DataFrame:
         """
         :param pair: Currency pair for data request
         :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
         :param start_ts: starting timestamp of data request in miliseconds
         :param end_ts: ending timestamp of data request in miliseconds
         :param limit: Maximum number of rows to return
+        :param raise_errors: True to raise request errors instead of logging them and returning no data
         :return: pandas dataframe with candelstick data
         """
 
@@ -36,7 +37,7 @@ class ExchangeConnector(AppConfig):
                   'startTime': start_ts,
                   'endTime': end_ts,
                   'limit': limit}
-        data = self._method('klines', params)
+        data = self._method('klines', params, raise_errors)
             
         data = pd.DataFrame(data, columns=['open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time',
                                            'quote_asset_volume', 'number_of_trades', 'taker_buy_base_asset_volume',
@@ -62,11 +63,13 @@ class ExchangeConnector(AppConfig):
         # TODO
         pass
 
-    def _method(self, endpoint: str, params: dict = None):
+    def _method(self, endpoint: str, params: dict = None, raise_errors: bool = False):
         try:
             method = getattr(self.client, endpoint)
             return method() if params is None else method(**params)
         except Exception as e:
+            if raise_errors:
+                raise
             self.logger.error(f'Error calling {endpoint}: {e}')
 
 
@@ -0,0 +1,202 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+
+
+class ExecutionSimulator:
+    """
+    Path-dependent execution of strategy signals: stop-loss, take-profit and trailing stop exits inside the bar and
+    volatility-scaled position sizing. The bars are walked in order but every step updates all the columns of the
+    signal matrix at once, so the cost of a whole parameter grid is one pass over the rows.
+
+    Positions follow the convention of the metrics code: the position of a row is held from its close to the next
+    close. Entries are filled at the close of the signal row. A stop or take-profit hit during a bar is filled at its
+    level, or at the open when the bar gaps through it, and that difference with the close is returned as the fill
+    return of the row. After a stop or take-profit exit the signal must go flat or change direction before re-entering.
+    """
+    OHLC_COLUMNS = ['open', 'high', 'low', 'close']
+
+    def __init__(self, stop_loss: float = None, take_profit: float = None, trailing_stop: float = None,
+                 target_volatility: float = None, volatility_length: int = 20, max_leverage: float = 1):
+        """
+        :param stop_loss: loss from the entry price that closes the position, as a fraction (e.g. 0.05)
+        :param take_profit: gain from the entry price that closes the position, as a fraction
+        :param trailing_stop: loss from the best price since the entry that closes the position, as a fraction
+        :param target_volatility: standard deviation of the log returns per bar targeted by the position size. The size
+        is fixed at the entry. None trades the signal size
+        :param volatility_length: number of bars used to estimate the volatility
+        :param max_leverage: maximum position size of the volatility sizing
+        """
+        # Parameters
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.trailing_stop = trailing_stop
+        self.target_volatility = target_volatility
+        self.volatility_length = int(volatility_length)
+        self.max_leverage = max_leverage
+
+    @property
+    def active(self):
+        return any(rule is not None for rule in (self.stop_loss, self.take_profit, self.trailing_stop,
+                                                 self.target_volatility))
+
+    def get_sizes(self, close: np.ndarray):
+        """
+        :param close: numpy array of close prices
+        :return: numpy array with the position size of an entry at each row, NaN while the volatility is unknown
+        """
+        if self.target_volatility is None:
+            return np.ones(len(close))
+        log_ret = pd.Series(np.log(close)).diff()
+        volatility = log_ret.rolling(self.volatility_length).std().to_numpy()
+        with np.errstate(divide='ignore'):
+            return np.minimum(self.target_volatility / volatility, self.max_leverage)
+
+    def run(self, positions, data: pd.DataFrame, state: dict = None):
+        """
+        Applies the exit and sizing rules to the positions of a strategy
+        :param positions: numpy array of signal positions with shape (rows,) or (rows, combinations)
+        :param data: dataframe with the open, high, low and close prices of the same rows
+        :param state: optional dictionary with the positions open before the first row of data and the last close
+        prices, as left by the run of the previous rows. It is updated with those after the last row, so that a long
+        history can be run in consecutive chunks with the result of a single run. Empty to start flat
+        :return: tuple of (positions, fill_returns) numpy arrays with the shape of positions, fill_returns being the
+        log return of the exits filled inside the bar relative to the close
+        """
+        shape = np.shape(positions)
+        signals = np.asarray(positions, dtype=float).reshape(len(data), -1)
+        if not self.active:
+            return signals.reshape(shape), np.zeros(shape)
+
+        open_, high, low, close = (data[column].to_numpy(dtype=float) for column in self.OHLC_COLUMNS)
+        state = {} if state is None else state
+        # The volatility of the first rows uses the close prices of the previous chunk
+        history = state.get('close', np.empty(0))
+        closes = np.concatenate([history, close])
+        sizes = self.get_sizes(closes)[len(history):]
+        rules = [np.nan if rule is None else rule for rule in (self.stop_loss, self.take_profit, self.trailing_stop)]
+
+        cols = signals.shape[1]
+        positions = (state.get('held', np.zeros(cols)).copy(), state.get('entry', np.full(cols, np.nan)).copy(),
+                     state.get('best', np.full(cols, np.nan)).copy(), state.get('blocked', np.zeros(cols)).copy())
+        # A single column, as in run_backtest, is walked on plain floats
+        walk = self._run_column if cols == 1 else self._run_matrix
+        adjusted, fill_returns, (held, entry, best, blocked) = walk(signals, open_, high, low, close, sizes, rules,
+                                                                     positions)
+
+        state.update(held=held, entry=entry, best=best, blocked=blocked,
+                     close=closes[-(self.volatility_length + 1):])
+        return adjusted.reshape(shape), fill_returns.reshape(shape)
+
+    @staticmethod
+    def _run_matrix(signals, open_, high, low, close, sizes, rules: list, positions: tuple):
+        """
+        Walks the bars updating all the columns of the signal matrix at once
+        :param signals: numpy array of signal positions with shape (rows, combinations)
+        :param rules: stop loss, take profit and trailing stop, NaN when not used
+        :param positions: tuple of (held, entry, best, blocked) arrays with the state of every column before the first
+        row
+        :return: tuple of (positions, fill_returns, state after the last row)
+        """
+        stop_loss, take_profit, trailing_stop = rules
+        held, entry, best, blocked = positions
+        rows, cols = signals.shape
+        adjusted = np.zeros((rows, cols))
+        fill_returns = np.zeros((rows, cols))
+
+        for t in range(rows):
+            # Exits inside the bar, computed with prices signed by the direction so longs and shorts share the logic
+            direction = np.sign(held)
+            if direction.any():
+                favourable = np.where(direction > 0, high[t], low[t])
+                adverse = np.where(direction > 0, low[t], high[t])
+                stop = direction * np.fmax(direction * entry * (1 - direction * stop_loss),
+                                           direction * best * (1 - direction * trailing_stop))
+                take = entry * (1 + direction * take_profit)
+
+                # The stop goes first when both levels are inside the same bar
+                stopped = (direction != 0) & (direction * adverse <= direction * stop)
+                taken = (direction != 0) & ~stopped & (direction * favourable >= direction * take)
+                exit_price = np.where(stopped, direction * np.minimum(direction * open_[t], direction * stop),
+                                      direction * np.maximum(direction * open_[t], direction * take))
+                exited = stopped | taken
+                if exited.any():
+                    fill_returns[t, exited] = held[exited] * (np.log(exit_price[exited]) - np.log(close[t]))
+                    blocked[exited] = direction[exited]
+                    held[exited] = 0
+                best = direction * np.fmax(direction * best, direction * favourable)
+
+            # Orders at the close: keep the size of an open position, enter new ones at the current size
+            signal = signals[t]
+            side = np.sign(signal)
+            blocked[side != blocked] = 0
+            enter = (side != 0) & (side != np.sign(held)) & (blocked == 0)
+            held = np.where(side == 0, 0, np.where(blocked != 0, 0, held))
+            if enter.any():
+                held[enter] = np.nan_to_num(signal[enter] * sizes[t])
+                entry[enter] = close[t]
+                best[enter] = close[t]
+            adjusted[t] = held
+
+        return adjusted, fill_returns, (held, entry, best, blocked)
+
+    @staticmethod
+    def _run_column(signals, open_, high, low, close, sizes, rules: list, positions: tuple):
+        """
+        Same walk as _run_matrix for a single column on Python floats, a bar costs a few float operations instead of a
+        dozen numpy calls on arrays of one element. The log returns of the exits are computed at the end
+        """
+        stop_loss, take_profit, trailing_stop = rules
+        held, entry, best, blocked = (float(values[0]) for values in positions)
+        sides = np.sign(signals[:, 0]).tolist()
+        signal_values, sizes = signals[:, 0].tolist(), np.asarray(sizes, dtype=float).tolist()
+        open_list, high_list, low_list, close_list = (prices.tolist() for prices in (open_, high, low, close))
+        adjusted = [0.] * len(sides)
+        exit_rows, exit_prices, exit_sizes = [], [], []
+
+        def fmax(a, b):
+            # np.fmax on floats: NaN only if both are NaN
+            return b if a != a else a if b != b else max(a, b)
+
+        for t, side in enumerate(sides):
+            # Exits inside the bar, with prices signed by the direction as in _run_matrix
+            if held != 0:
+                direction = 1. if held > 0 else -1.
+                favourable, adverse = (high_list[t], low_list[t]) if direction > 0 else (low_list[t], high_list[t])
+                stop = direction * fmax(direction * entry * (1 - direction * stop_loss),
+                                        direction * best * (1 - direction * trailing_stop))
+                take = entry * (1 + direction * take_profit)
+
+                # The stop goes first when both levels are inside the same bar
+                exit_price = None
+                if direction * adverse <= direction * stop:
+                    exit_price = direction * min(direction * open_list[t], direction * stop)
+                elif direction * favourable >= direction * take:
+                    exit_price = direction * max(direction * open_list[t], direction * take)
+                if exit_price is not None:
+                    exit_rows.append(t)
+                    exit_prices.append(exit_price)
+                    exit_sizes.append(held)
+                    blocked = direction
+                    held = 0.
+                best = direction * fmax(direction * best, direction * favourable)
+
+            # Orders at the close
+            if side != blocked:
+                blocked = 0.
+            enter = side != 0 and side != (held > 0) - (held < 0) and blocked == 0
+            if side == 0 or blocked != 0:
+                held = 0.
+            if enter:
+                held = float(np.nan_to_num(signal_values[t] * sizes[t]))
+                entry = best = close_list[t]
+            adjusted[t] = held
+
+        fill_returns = np.zeros((len(sides), 1))
+        if exit_rows:
+            fill_returns[exit_rows, 0] = np.array(exit_sizes) * (np.log(exit_prices) - np.log(close[exit_rows]))
+        state = tuple(np.array([value]) for value in (held, entry, best, blocked))
+        return np.array(adjusted)[:, None], fill_returns, state
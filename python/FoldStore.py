@@ -0,0 +1,168 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import os
+import json
+import hashlib
+import inspect
+from pathlib import Path
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Logger import Logger
+
+
+class FoldStore:
+    """
+    Persisted walk forward analysis folds. Every fold is a file with its scores, chosen parameters and test positions,
+    named after a key of the strategy, its configuration (parameter grid, fee, execution and search settings), the fold
+    boundaries and a hash of the candles the fold reads. A new run only recomputes the folds whose key is not stored,
+    which after an update are the ones that contain new or changed candles.
+    """
+    BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parents[0]
+    DATE_FIELDS = ['first_train_date', 'first_test_date', 'last_test_date']
+
+    def __init__(self, path: str = None):
+        self.path = Path(path) if path else self.BASE_DIR / 'db' / 'folds'
+        self.hits = 0
+        self.misses = 0
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    @staticmethod
+    def _digest(*parts):
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            digest.update(part if isinstance(part, (bytes, memoryview)) else repr(part).encode())
+        return digest.hexdigest()
+
+    def config_hash(self, strategy: str, param_grid: list, **settings):
+        """
+        :param strategy: strategy name
+        :param param_grid: list of parameter sets tested on every fold
+        :param settings: any other setting that changes the result of a fold (fees, execution rules, search...). Objects
+        are hashed by their class and the attributes named after the arguments of their constructor
+        :return: hash of the configuration as a hex string
+        """
+        described = {}
+        for name, value in sorted(settings.items()):
+            if hasattr(value, '__dict__'):
+                arguments = inspect.signature(type(value).__init__).parameters
+                value = (type(value).__name__, [(argument, getattr(value, argument, None)) for argument in arguments
+                                                if argument != 'self'])
+            described[name] = value
+        return self._digest(strategy, [sorted((k, float(v)) for k, v in params.items()) for params in param_grid],
+                            described)
+
+    def key(self, config_hash: str, boundaries: tuple, data: pd.DataFrame, **state):
+        """
+        :param config_hash: hash returned by config_hash
+        :param boundaries: dates that delimit the fold
+        :param data: candles read by the fold, including its warm-up rows
+        :param state: anything else the result of the fold depends on, e.g. the warm start and seed of an adaptive
+        search
+        :return: key of the fold
+        """
+        values = np.ascontiguousarray(data.select_dtypes('number').to_numpy(dtype=float))
+        index = np.ascontiguousarray(data.index.to_numpy(dtype='datetime64[ns]').view('int64'))
+        # State is only hashed when given, so the keys of the folds without it do not change
+        return self._digest(config_hash, tuple(str(boundary) for boundary in boundaries), list(data.columns),
+                            index.data, values.data, *([sorted(state.items())] if state else []))
+
+    def _fold_file(self, strategy: str, key: str):
+        return self.path / strategy / f'{key}.npz'
+
+    def load(self, strategy: str, key: str):
+        """
+        :param strategy: strategy name
+        :param key: key of the fold
+        :return: tuple of (row of wfa_scores as a dictionary, test results dataframe), None if the fold is not stored
+        """
+        fold_file = self._fold_file(strategy, key)
+        if not fold_file.exists():
+            self.misses += 1
+            return None
+
+        try:
+            with np.load(fold_file, allow_pickle=False) as stored:
+                row = json.loads(str(stored['row']))
+                index = pd.DatetimeIndex(stored['index'].view('datetime64[ns]'),
+                                         name=str(stored['index_name']) or None)
+                results = pd.DataFrame({column: stored[f'column_{column}'] for column in stored['columns']},
+                                       index=index)
+        except Exception as e:
+            self.logger.error(f'Stored fold {fold_file} could not be read: {e}')
+            self.misses += 1
+            return None
+
+        for field in self.DATE_FIELDS:
+            row[field] = pd.Timestamp(row[field])
+        self.hits += 1
+        return row, results
+
+    def save(self, strategy: str, key: str, row: dict, results: pd.DataFrame):
+        """
+        Stores a fold, replacing any previous version atomically
+        :param strategy: strategy name
+        :param key: key of the fold
+        :param row: row of wfa_scores with the scores, parameters and dates of the fold
+        :param results: test results of the fold
+        :return:
+        """
+        fold_file = self._fold_file(strategy, key)
+        fold_file.parent.mkdir(parents=True, exist_ok=True)
+        row = {name: str(value) if name in self.DATE_FIELDS else value for name, value in row.items()}
+        arrays = {f'column_{column}': results[column].to_numpy() for column in results.columns}
+
+        temp_file = fold_file.with_suffix('.tmp.npz')
+        np.savez(temp_file, row=json.dumps(row, default=float), columns=np.array(results.columns, dtype=str),
+                 index=results.index.to_numpy(dtype='datetime64[ns]').view('int64'),
+                 index_name=results.index.name or '', **arrays)
+        os.replace(temp_file, fold_file)
+
+    def clear(self, strategy: str = None):
+        """
+        Removes the stored folds of a strategy, or of every strategy
+        :return:
+        """
+        if not self.path.exists():
+            return
+        directories = [self.path / strategy] if strategy else [d for d in self.path.iterdir() if d.is_dir()]
+        for directory in directories:
+            if directory.exists():
+                for fold_file in directory.iterdir():
+                    fold_file.unlink()
+                directory.rmdir()
+
+
+if __name__ == '__main__':
+    # Checks that a nightly update, a candle more at the end and a candle less at the start, only recomputes the last
+    # fold and that the store does not change the results
+    import io
+    import logging
+    import tempfile
+    import contextlib
+    from python.Backtester import Backtester
+    from python.SyntheticCandles import SyntheticCandles
+
+    logging.disable(logging.INFO)
+    parameters = pd.DataFrame([['modified_macd', 'sma_short', 10, 50, 10],
+                               ['modified_macd', 'sma_long', 50, 200, 50]],
+                              columns=['strategy', 'parameter', 'start_value', 'end_value', 'step'])
+    candles = SyntheticCandles().generate(3001, '4h')
+    fold_store = FoldStore(tempfile.mkdtemp(prefix='folds_'))
+
+    def run_wfa(data: pd.DataFrame, store: FoldStore = None):
+        bt = Backtester('BTCUSDT', '4h', data=data, parameters=parameters)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bt.run_wfa('modified_macd', fold_store=store)
+        return bt._strategy.wfa_scores
+
+    run_wfa(candles.iloc[:-1], fold_store)
+    fold_store.hits, fold_store.misses = 0, 0
+    wfa_scores = run_wfa(candles.iloc[1:], fold_store)
+    assert fold_store.misses == 1, f'{fold_store.misses} of {len(wfa_scores)} folds recomputed after the update'
+    assert wfa_scores.equals(run_wfa(candles.iloc[1:])), 'Results differ with and without the fold store'
+    fold_store.clear()
+    print(f'Only the last of {len(wfa_scores)} folds was recomputed after the update')
@@ -0,0 +1,142 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import functools
+import hashlib
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Logger import Logger
+
+
+class IndicatorCache:
+    """
+    Bounded LRU memoization of indicator results. Entries are keyed by the indicator name, its arguments and a
+    fingerprint of the input series, so any request over the same rows with the same values is served from memory.
+    The arrays holding the candles are expected not to change once an indicator has been computed on them.
+    """
+    DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        # Parameters
+        self.max_bytes = max_bytes
+        self.enabled = True
+
+        # Internal variables
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Digest of every array owning fingerprinted values, by id, while the array is alive
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def fingerprint(self, series: pd.Series):
+        """
+        Cheap fingerprint of a series: its length, first and last index values and the position of its values within
+        the array that owns them, together with the digest of that array. The digest is computed once per array, so
+        the windows of the same candles, as the folds of a WFA, are fingerprinted in constant time
+        :param series: input series of the indicator
+        :return: hashable tuple identifying the series
+        """
+        values = series.to_numpy()
+        if not len(values):
+            return 0, values.dtype.str
+        owner = values
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        offset = values.__array_interface__['data'][0] - owner.__array_interface__['data'][0]
+        index = series.index.to_numpy()
+        return len(values), index[0], index[-1], values.dtype.str, values.strides, offset, self._digest(owner)
+
+    def _digest(self, array: np.ndarray):
+        """
+        :return: shape, dtype and digest of the values of array, memoized until the array is released
+        """
+        key = id(array)
+        entry = self._digests.get(key)
+        if entry is not None and entry[0]() is array:
+            return entry[1]
+
+        digest = array.shape, array.dtype.str, \
+            hashlib.blake2b(np.ascontiguousarray(array).data, digest_size=16).digest()
+        self._digests[key] = (weakref.ref(array, lambda _: self._digests.pop(key, None)), digest)
+        return digest
+
+    def get_or_compute(self, key: tuple, compute):
+        """
+        Returns the cached result for key or computes, stores and returns it
+        :param key: hashable key of the result
+        :param compute: function without arguments that computes the result on a miss
+        :return: indicator result
+        """
+        if not self.enabled:
+            return compute()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0].copy()
+
+        self.misses += 1
+        result = compute()
+        self._store(key, result)
+        return result.copy()
+
+    def cached(self, func):
+        """
+        Decorator for indicator functions with signature (df, length, column='close') that memoizes their results
+        :param func: indicator function
+        :return: wrapped function
+        """
+        @functools.wraps(func)
+        def wrapper(df, length, column='close'):
+            if not self.enabled:
+                return func(df, length, column)
+            key = (func.__name__, length, column) + self.fingerprint(df[column])
+            return self.get_or_compute(key, lambda: func(df, length, column))
+        return wrapper
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters
+        :return:
+        """
+        self._entries.clear()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        :return: dictionary with the hit and miss counters and the memory used by the cache
+        """
+        requests = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes}
+
+    def _store(self, key: tuple, result):
+        size = result.memory_usage(index=True, deep=False) if isinstance(result, pd.Series) else result.nbytes
+        if size > self.max_bytes:
+            return
+
+        # Evict least recently used entries until the new one fits
+        while self._entries and self._bytes + size > self.max_bytes:
+            _, (evicted, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+        self._entries[key] = (result, size)
+        self._bytes += size
@@ -2,34 +2,125 @@
 
 # -- Built-in and installed packages
 import pandas as pd
-import pyeeg
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 # -- User custom function, classes and objects
 from python.Logger import Logger
+from python.IndicatorCache import IndicatorCache
+from python.Profiler import PROFILER
 
 
 class Indicators:
+    # Results shared by every instance, see IndicatorCache
+    cache = IndicatorCache()
+    # Maximum number of elements of the intermediate arrays of the vectorized Hurst exponent
+    HURST_CHUNK_ELEMENTS = 2 ** 20
 
     def __init__(self):
         # Logger
         self.logger = Logger(self.__class__.__name__).logger
 
     @staticmethod
+    @PROFILER.timed('indicators')
+    @cache.cached
     def sma(df, length: int, column='close'):
         sma_vals = df[column].rolling(window=length).mean()
         return sma_vals
 
     @staticmethod
+    @PROFILER.timed('indicators')
+    @cache.cached
     def ema(df, length: int, column='close'):
         ema_vals = df[column].ewm(span=length, adjust=False).mean()
         return ema_vals
 
     @staticmethod
+    @PROFILER.timed('indicators')
+    @cache.cached
     def hurst(df, length: int, column='close'):
-        hurst_vals = df[column].rolling(length).apply(lambda x: pyeeg.hurst(x))
-        return hurst_vals
+        values = df[column].to_numpy(dtype=float)
+        hurst_vals = np.full(len(values), np.nan)
+
+        # Strided view of every full window, computed in chunks to bound the memory of the intermediate arrays
+        if len(values) >= length > 1:
+            windows = sliding_window_view(values, length)
+            chunk = max(1, Indicators.HURST_CHUNK_ELEMENTS // (length * length))
+            for start in range(0, len(windows), chunk):
+                hurst_vals[length - 1 + start:length - 1 + start + chunk] = \
+                    Indicators.hurst_exponent(windows[start:start + chunk])
+
+            # Windows with missing values have no result, as in rolling(length)
+            hurst_vals[length - 1:][np.isnan(windows).any(axis=1)] = np.nan
+
+        return pd.Series(hurst_vals, index=df.index, name=column)
+
+    @staticmethod
+    def hurst_many(df, lengths: list, column='close'):
+        """
+        Rolling Hurst exponent for several window lengths
+        :param df: dataframe containing the input column
+        :param lengths: list of window lengths
+        :param column: input column
+        :return: dataframe with one hurst_<length> column per window length
+        """
+        return pd.DataFrame({f'hurst_{length}': Indicators.hurst(df, length, column) for length in lengths},
+                            index=df.index)
+
+    @staticmethod
+    def hurst_exponent(windows):
+        """
+        Hurst exponent estimated with the rescaled range method, as in pyeeg.hurst: R/S is computed over every prefix of
+        the window and the exponent is the slope of log(R/S) against log(T), skipping the first prefixes where R or S
+        are still constant. Windows where that takes 10 or more prefixes have no result.
+        :param windows: numpy array with one window, or a 2-D array with one window per row
+        :return: Hurst exponent of the window, or numpy array with the exponent of each row
+        """
+        windows = np.asarray(windows, dtype=float)
+        single = windows.ndim == 1
+        windows = np.atleast_2d(windows)
+        n = windows.shape[1]
+        t = np.arange(1, n + 1)
+
+        # R/S is invariant to shifts of the window, centering on the first value avoids cancellation with prices
+        x = windows - windows[:, :1]
+        y = np.cumsum(x, axis=1)
+        ave = y / t
+        s_t = np.sqrt(np.clip(np.cumsum(x * x, axis=1) / t - ave ** 2, 0, None))
+
+        # Range of the cumulative deviations from the mean of each prefix i, over t <= i. Prefixes are processed in
+        # blocks so that only the lower triangle of the (i, t) matrix is computed
+        r_t = np.empty_like(y)
+        block = 16
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            deviations = y[:, None, :stop] - t[None, None, :stop] * ave[:, start:stop, None]
+            outside = ~np.tri(stop - start, stop, start, dtype=bool)
+            deviations[:, outside] = -np.inf
+            r_t[:, start:stop] = deviations.max(axis=2)
+            deviations[:, outside] = np.inf
+            r_t[:, start:stop] -= deviations.min(axis=2)
+
+        # First prefix from which both S and R change
+        s_changes, r_changes = np.diff(s_t, axis=1) != 0, np.diff(r_t, axis=1) != 0
+        k = np.maximum(np.where(s_changes.any(axis=1), s_changes.argmax(axis=1) + 1, n - 1),
+                       np.where(r_changes.any(axis=1), r_changes.argmax(axis=1) + 1, n - 1))
+
+        # Least squares slope of log(R/S) against log(T) over the prefixes from k
+        fit = np.arange(n) >= k[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_rs = np.where(fit, np.log(r_t / s_t), 0)
+            log_t = np.where(fit, np.log(t), 0)
+            count = fit.sum(axis=1)
+            log_t_dev = np.where(fit, log_t - (log_t.sum(axis=1) / count)[:, None], 0)
+            log_rs_dev = np.where(fit, log_rs - (log_rs.sum(axis=1) / count)[:, None], 0)
+            h = (log_t_dev * log_rs_dev).sum(axis=1) / (log_t_dev ** 2).sum(axis=1)
+        h[k >= 10] = np.nan
+
+        return h[0] if single else h
 
     @staticmethod
+    @PROFILER.timed('indicators')
+    @cache.cached
     def mom(df, length, column='close'):
         mom_vals = df[column].pct_change(periods=length)
         return mom_vals
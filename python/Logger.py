@@ -8,7 +8,7 @@ import logging
 class Logger:
 
     def __init__(self, name: str):
-        self.logger = logging.getLogger(name)
+        self._logger = logging.getLogger(name)
         self.set_config()
 
     @staticmethod
@@ -19,11 +19,11 @@ class Logger:
 
     @property
     def logger(self):
-        return self.logger
+        return self._logger
 
     @logger.setter
     def logger(self, name):
-        self.logger = logging.getLogger(name)
+        self._logger = logging.getLogger(name)
 
 if __name__ == '__main__':
     logger = Logger('TEST')
@@ -0,0 +1,18 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import argparse
+# -- User custom function, classes and objects
+from python.DatabaseWrapper import DatabaseWrapper
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrates the candles table of a database to the current schema '
+                                                 f'(version {DatabaseWrapper.SCHEMA_VERSION})')
+    parser.add_argument('--database', default='db/db',
+                        help='database path without the .db extension, relative to the project folder')
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows copied at a time')
+    args = parser.parse_args()
+
+    dbw = DatabaseWrapper(database_name=args.database)
+    dbw.migrate_schema(chunksize=args.chunksize)
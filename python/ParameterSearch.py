@@ -0,0 +1,215 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import math
+import warnings
+import numpy as np
+# -- User custom function, classes and objects
+from python.Logger import Logger
+
+
+class ParameterSearch:
+    """
+    Base class of the adaptive searches over a parameter grid, used by Backtester.run_wfa instead of testing every
+    combination. A search only sees the grid through an evaluate function, evaluate(indices, fraction), that returns the
+    scores of the grid positions in indices computed on the last fraction of the in-sample window.
+
+    Every search spends at most budget evaluations per fold, always evaluates the best parameters of the previous fold
+    first and keeps count of the evaluations done, so that report can compare them with the exhaustive grid. Folds
+    searched with their index draw from their own seed, spawned from seed, so the result of a fold only depends on its
+    data, its warm start and its index, not on the folds searched before it.
+    """
+
+    def __init__(self, budget: int = 50, seed: int = None):
+        # Parameters
+        self.budget = budget
+        self.seed = seed
+
+        # Internal variables
+        self._rng = np.random.default_rng(seed)
+        self._param_grid = []
+        self._evaluate = None
+        self._scores = {}
+        self.evaluations = 0
+        self.evaluated_rows = 0.0
+        self.grid_evaluations = 0
+        self.folds = 0
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def fold_seed(self, fold: int):
+        """
+        :param fold: index of the fold
+        :return: seed sequence of the fold, the fold-th child of seed, None without a seed
+        """
+        return None if self.seed is None else np.random.SeedSequence(self.seed, spawn_key=(fold,))
+
+    def search(self, param_grid: list, evaluate, warm_start: dict = None, fold: int = None):
+        """
+        Finds the best parameter set of one fold
+        :param param_grid: list of parameter sets as returned by Backtester.create_parameter_grid
+        :param evaluate: function (indices, fraction) returning a numpy array with the scores of param_grid[indices]
+        :param warm_start: best parameter set of the previous fold, evaluated first when it is part of the grid
+        :param fold: index of the fold, draws from the seed of the fold instead of continuing the draws of the
+        previous searches
+        :return: tuple of (best_score, best_params)
+        """
+        if fold is not None:
+            self._rng = np.random.default_rng(self.fold_seed(fold))
+        self.folds += 1
+        self.grid_evaluations += len(param_grid)
+        self._param_grid = param_grid
+        self._evaluate = evaluate
+        self._scores = {}
+
+        first = [param_grid.index(warm_start)] if warm_start in param_grid else []
+        self._run(first, min(self.budget, len(param_grid)))
+
+        best = max(self._scores, key=lambda i: self._sortable(self._scores[i]))
+        return self._scores[best], param_grid[best]
+
+    def _run(self, first: list, budget: int):
+        """
+        Evaluates parameter sets of the grid with _score until the budget is spent
+        :param first: grid positions evaluated first
+        :param budget: number of full window evaluations available
+        :return:
+        """
+        raise NotImplementedError
+
+    def _score(self, indices, fraction: float = 1):
+        """
+        Evaluates grid positions, only the scores on the full window are kept as candidates for the best
+        :return: numpy array with the scores of indices
+        """
+        indices = [int(i) for i in indices]
+        if not indices:
+            return np.empty(0)
+        scores = np.asarray(self._evaluate(indices, fraction), dtype=float)
+        self.evaluations += len(indices)
+        self.evaluated_rows += len(indices) * fraction
+        if fraction == 1:
+            self._scores.update(zip(indices, scores))
+        return scores
+
+    def _sample(self, n: int, exclude=()):
+        """
+        :return: list of n random grid positions that are not in exclude
+        """
+        candidates = np.setdiff1d(np.arange(len(self._param_grid)), list(exclude))
+        return list(self._rng.choice(candidates, size=min(n, len(candidates)), replace=False))
+
+    @staticmethod
+    def _sortable(score):
+        # NaN scores rank below every other score, as in the exhaustive search
+        return -np.inf if np.isnan(score) else score
+
+    def report(self):
+        """
+        :return: dictionary with the evaluations done and the ones saved compared with the exhaustive grid
+        """
+        return {'search': self.__class__.__name__,
+                'folds': self.folds,
+                'evaluations': self.evaluations,
+                'full_window_evaluations': round(self.evaluated_rows, 2),
+                'grid_evaluations': self.grid_evaluations,
+                'saved_evaluations': round(self.grid_evaluations - self.evaluated_rows, 2),
+                'saved_perc': round((1 - self.evaluated_rows / self.grid_evaluations) * 100, 2)
+                if self.grid_evaluations else 0}
+
+
+class RandomSearch(ParameterSearch):
+    """
+    Evaluates a random sample of budget parameter sets of the grid on the full window
+    """
+
+    def _run(self, first: list, budget: int):
+        self._score(first + self._sample(budget - len(first), first))
+
+
+class SuccessiveHalving(ParameterSearch):
+    """
+    Successive halving over growing windows: the candidates are evaluated on the most recent min_fraction of the
+    in-sample window, the best 1/eta of them move on to a window eta times longer and so on until the survivors are
+    evaluated on the full window. The number of initial candidates is the largest one that fits in the budget.
+    """
+
+    def __init__(self, budget: int = 50, seed: int = None, eta: int = 3, min_fraction: float = 1 / 9):
+        super().__init__(budget, seed)
+        self.eta = eta
+        self.min_fraction = min_fraction
+
+    def _run(self, first: list, budget: int):
+        rounds = 1 + max(0, math.floor(math.log(1 / self.min_fraction, self.eta) + 1e-9))
+        fractions = [self.eta ** -(rounds - 1 - i) for i in range(rounds)]
+
+        # Every round keeps 1/eta of the candidates, so each costs about initial * fractions[0] full evaluations
+        initial = max(1, int(budget / sum(self.eta ** -i * fraction for i, fraction in enumerate(fractions))))
+        initial = min(initial, len(self._param_grid))
+        candidates = first + self._sample(initial - len(first), first)
+        for fraction in fractions:
+            scores = self._score(candidates, fraction)
+            if fraction == 1:
+                break
+            # Keep the best ones, with the warm start ranking first on ties
+            order = sorted(range(len(candidates)), key=lambda j: -self._sortable(scores[j]))
+            candidates = [candidates[j] for j in order[:max(1, math.ceil(len(candidates) / self.eta))]]
+
+
+class BayesianSearch(ParameterSearch):
+    """
+    Model-based search: a gaussian process fitted to the evaluated parameter sets predicts the score of the rest of the
+    grid, and each iteration evaluates the batch_size sets with the highest expected improvement over the best score
+    """
+
+    def __init__(self, budget: int = 50, seed: int = None, initial_points: int = 10, batch_size: int = 5):
+        super().__init__(budget, seed)
+        self.initial_points = initial_points
+        self.batch_size = batch_size
+
+    def _features(self):
+        """
+        :return: numpy array of shape (grid size, parameters) with every parameter scaled to [0, 1]
+        """
+        features = np.array([[float(value) for value in params.values()] for params in self._param_grid])
+        span = np.ptp(features, axis=0)
+        return (features - features.min(axis=0)) / np.where(span > 0, span, 1)
+
+    def _run(self, first: list, budget: int):
+        # Imported on first use, scikit-learn and scipy are only needed by this search
+        from scipy.stats import norm
+        from sklearn.exceptions import ConvergenceWarning
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+
+        features = self._features()
+        self._score(first + self._sample(min(self.initial_points, budget) - len(first), first))
+
+        model = GaussianProcessRegressor(kernel=Matern(length_scale=0.2, nu=2.5) + WhiteKernel(1e-3),
+                                         normalize_y=True, random_state=self.seed)
+        while len(self._scores) < budget:
+            evaluated = np.array(list(self._scores))
+            pending = np.setdiff1d(np.arange(len(self._param_grid)), evaluated)
+            if not len(pending):
+                break
+
+            # Failed evaluations are modelled as the worst score seen
+            scores = np.array([self._scores[i] for i in evaluated])
+            finite = np.isfinite(scores)
+            if not finite.any():
+                self._score(self._sample(min(self.batch_size, budget - len(self._scores)), evaluated))
+                continue
+            scores = np.where(finite, scores, scores[finite].min())
+            # Few noisy scores often push the kernel parameters to their bounds, the fit is still usable
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', ConvergenceWarning)
+                model.fit(features[evaluated], scores)
+
+            # Expected improvement of every pending parameter set
+            mean, std = model.predict(features[pending], return_std=True)
+            std = np.maximum(std, 1e-9)
+            z = (mean - scores.max()) / std
+            improvement = (mean - scores.max()) * norm.cdf(z) + std * norm.pdf(z)
+            batch = min(self.batch_size, budget - len(self._scores))
+            self._score(pending[np.argsort(-improvement, kind='stable')[:batch]])
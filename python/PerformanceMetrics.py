@@ -4,13 +4,14 @@
 import math
 import numpy as np
 import pandas as pd
-import plotly.express as px
 # -- User custom function, classes and objects
 from python.Logger import Logger
+from python.Profiler import PROFILER
 
 
 class PerformanceMetrics:
     YEARLY_TRADING_DAYS = 365
+    ROLLING_METRICS = ['rate_of_return', 'sharpe_ratio', 'drawdown', 'win_rate']
 
     def __init__(self, initial_capital, taker_fee):
         # Parameters
@@ -20,127 +21,278 @@ class PerformanceMetrics:
         # Logger
         self.logger = Logger(self.__class__.__name__).logger
 
-    # def get_score(self, results_df):
-    #     try:
-    #         self.metrics = {}
-    #         return self.compute_score(results_df)
-    #     except Exception as e:
-    #         self.logger.error(f'Error computing the score: {e}')
-
-    def _strategy_log_returns(self, df):
-        # Calculate necessary fields for metrics
-        df['log_ret'] = (np.log(df['close'] / df['close'].shift(1))).fillna(0)
-        df['new_order'] = df.position != df.position.shift(1).fillna(0)
-        df['s_log_ret'] = (df['position'].shift(1) * df['log_ret'] +
-                           np.log(1 - self.taker_fee) * df['new_order'].shift(1)).fillna(0)
-        return df.s_log_ret
+    def get_score(self, results_df):
+        try:
+            return self.compute_score(results_df)
+        except Exception as e:
+            self.logger.error(f'Error computing the score: {e}')
 
-    @staticmethod
-    def _strategy_rate_of_return(df):
-        s_returns = round((np.exp(df['s_log_ret'].sum()) - 1) * 100, 2)
-        return s_returns
+    def _strategy_log_returns(self, close, positions, fill_returns=None):
+        """
+        Log returns of the market and of the strategy for every column of positions
+        :param close: numpy array of close prices with shape (rows,), or (rows, combinations) to give every column of
+        positions its own prices
+        :param positions: numpy array of positions with shape (rows, combinations)
+        :param fill_returns: optional numpy array with the shape of positions of log returns added to each row, as
+        returned by ExecutionSimulator.run for the exits filled inside the bar
+        :return: tuple of (log_ret, new_order, s_log_ret) arrays, log_ret with the shape of close and the others with
+        the shape of positions
+        """
+        log_ret = np.zeros(close.shape)
+        log_ret[1:] = np.log(close[1:] / close[:-1])
+        market_log_ret = log_ret[:, None] if log_ret.ndim == 1 else log_ret
 
-    @staticmethod
-    def _number_of_trades(df):
-        # Calculate number of trades
-        df['new_order'] = df.position != df.position.shift(1).fillna(0)
-        num_trades = df['new_order'].sum()
-        return num_trades
+        # A new order is placed every time the position differs from the previous one (flat before the first row), every
+        # unit of position traded pays the fee
+        turnover = np.empty(positions.shape)
+        turnover[:1] = np.abs(positions[:1])
+        turnover[1:] = np.abs(positions[1:] - positions[:-1])
+        new_order = turnover != 0
 
-    @staticmethod
-    def _max_dd(df):
-        # Calculate cumulative log returns
-        df['cum_s_log_ret'] = df['s_log_ret'].cumsum()
-
-        # Calculate the maximum cumulative log returns
-        df['max_cum_s_log_ret'] = df['cum_s_log_ret'].cummax()
-
-        # Drawdown is the difference between max cumulative log returns and current log returns
-        df['drawdown'] = (df['cum_s_log_ret'] - df['max_cum_s_log_ret'])
-
-        # Get the maximum drawdown
-        dd = {'max_dd_period': str(pd.to_datetime(df.loc[df['drawdown'] == df['drawdown'].min()].index[0])),
-              'max_dd_value': round((np.exp(df['drawdown'].min()) - 1) * 100, 2)}
-        return dd
-
-    def _pnl(self, df):
-        df['cum_s_log_ret'] = df['s_log_ret'].cumsum()
-        df['pnl'] = (self.initial_capital * df['cum_s_log_ret'].apply(np.exp) - self.initial_capital).round(2)
-        return df.pnl
-
-    def _buy_and_hold(self, df):
-        # Calculate return of buy and hold strategy
-        df['log_ret'] = (np.log(df['close'] / df['close'].shift(1))).fillna(0)
-        df['cum_log_ret'] = df['log_ret'].cumsum()
-        bnh_perc = round((np.exp(df['cum_log_ret'].iloc[-1] + np.log(1 - self.taker_fee)) - 1) * 100, 2)
-        return bnh_perc
-
-    def _sharpe_ratio(self, df):
-        # Calculate annualized sharpe ratio
-        df['s_ret'] = df.s_log_ret.apply(np.exp) - 1
-        sharpe_ratio = round(df['s_ret'].mean() / df['s_ret'].std() * math.sqrt(self.YEARLY_TRADING_DAYS), 2)
-        return sharpe_ratio
-
-    def _win_rate(self, df):
-        # Calculate the number of winning trades
-        df['new_order'] = df.position != df.position.shift(1).fillna(0)
-        df['trade'] = df.new_order.cumsum()
-        df_agg = df.groupby('trade')['s_log_ret'].sum().reset_index()
-        num_winning_trades = (df_agg['s_log_ret'] > 0).sum()
-
-        # Calculate the total number of trades
-        total_trades = len(df_agg)
-
-        # Calculate the win rate
-        win_rate = num_winning_trades / total_trades
-
-        return win_rate
-
-    def _calmar_ratio(self, df):
-        # TODO
-        pass
-
-    def _gain_to_pain_ratio(self, df):
-        # TODO
-        pass
-
-    def _profit_ratio(self, df):
-        # TODO
-        pass
+        # Returns of each row come from the position and the orders of the previous row
+        s_log_ret = np.zeros(positions.shape)
+        s_log_ret[1:] = positions[:-1] * market_log_ret[1:] + np.log(1 - self.taker_fee) * turnover[:-1]
+        if fill_returns is not None:
+            s_log_ret[1:] += np.asarray(fill_returns, dtype=float).reshape(positions.shape)[1:]
+        return log_ret, new_order, s_log_ret
+
+    def _win_rate(self, new_order, s_log_ret, cum_s_log_ret):
+        """
+        Share of trades with a positive return. A trade is every run of rows between two new orders, the returns of a
+        trade are the difference of the cumulative returns at its last row and at the last row of the previous one
+        """
+        rows = np.arange(len(new_order))[:, None]
+        last_row = np.zeros(new_order.shape, dtype=bool)
+        last_row[:-1] = new_order[1:]
+        last_row[-1:] = True
+
+        # Cumulative returns at the end of the previous trade, zero for the first one
+        previous_end = np.maximum.accumulate(np.where(last_row, rows, -1), axis=0)
+        previous_end = np.vstack([np.full((1, new_order.shape[1]), -1), previous_end[:-1]])
+        previous_cum = np.where(previous_end >= 0,
+                                np.take_along_axis(cum_s_log_ret, np.maximum(previous_end, 0), axis=0), 0)
+
+        winning_trades = (last_row & (cum_s_log_ret - previous_cum > 0)).sum(axis=0)
+        total_trades = last_row.sum(axis=0)
+        return winning_trades / total_trades
+
+    @PROFILER.timed('metrics')
+    def compute_metrics(self, close, positions, index=None, fill_returns=None):
+        """
+        Computes every performance metric from the close prices and positions in a single pass over the arrays,
+        without modifying them. Positions can be a 2-D array to score many strategies at once.
+        :param close: numpy array of close prices with shape (rows,), or (rows, combinations) with the prices of each
+        column of positions
+        :param positions: numpy array of positions with shape (rows,) or (rows, combinations)
+        :param index: labels of the rows used to report the date of the maximum drawdown, defaults to row numbers
+        :param fill_returns: optional log returns of the exits filled inside the bar, see _strategy_log_returns
+        :return: dictionary of metrics, with scalar values for 1-D positions and numpy arrays for 2-D positions
+        """
+        close = np.asarray(close, dtype=float)
+        single = np.ndim(positions) == 1
+        positions = np.asarray(positions, dtype=float).reshape(len(close), -1)
+        index = pd.RangeIndex(len(close)) if index is None else pd.Index(index)
+        log_ret, new_order, s_log_ret = self._strategy_log_returns(close, positions, fill_returns)
+
+        # Cumulative returns, drawdown and simple returns
+        cum_s_log_ret = s_log_ret.cumsum(axis=0)
+        total_log_ret = cum_s_log_ret[-1]
+        drawdown = cum_s_log_ret - np.maximum.accumulate(cum_s_log_ret, axis=0)
+        max_dd = drawdown.min(axis=0)
+        s_ret = np.exp(s_log_ret) - 1
+        losses = -np.where(s_ret < 0, s_ret, 0).sum(axis=0)
+
+        # Trades
+        number_of_trades = new_order.sum(axis=0)
+        win_rate = self._win_rate(new_order, s_log_ret, cum_s_log_ret)
+
+        # Calmar: annualised return over maximum drawdown, with the same yearly periods as the sharpe ratio
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annual_return = np.exp(total_log_ret * self.YEARLY_TRADING_DAYS / len(close)) - 1
+            calmar_ratio = annual_return / (1 - np.exp(max_dd))
+            gain_to_pain_ratio = s_ret.sum(axis=0) / losses
+            profit_ratio = np.where(s_ret > 0, s_ret, 0).sum(axis=0) / losses
+            sharpe_ratio = s_ret.mean(axis=0) / s_ret.std(axis=0, ddof=1) * math.sqrt(self.YEARLY_TRADING_DAYS)
+
+        metrics = {'rate_of_return': np.round((np.exp(total_log_ret) - 1) * 100, 2),
+                   'profit_and_loss': np.round(self.initial_capital * np.exp(total_log_ret) - self.initial_capital, 2),
+                   'buy_and_hold': np.round((np.exp(log_ret.sum(axis=0) + np.log(1 - self.taker_fee)) - 1) * 100, 2),
+                   'max_drawdown': {'max_dd_period': index[drawdown.argmin(axis=0)].map(str).to_numpy(),
+                                    'max_dd_value': np.round((np.exp(max_dd) - 1) * 100, 2)},
+                   'sharpe_ratio': np.round(sharpe_ratio, 2),
+                   'number_of_trades': number_of_trades,
+                   'win_rate': win_rate,
+                   'calmar_ratio': np.round(calmar_ratio, 2),
+                   'gain_to_pain_ratio': np.round(gain_to_pain_ratio, 2),
+                   'profit_ratio': np.round(profit_ratio, 2)}
+
+        if single:
+            metrics = {key: ({k: v[0] for k, v in value.items()} if isinstance(value, dict) else
+                             value if np.ndim(value) == 0 else value[0])
+                       for key, value in metrics.items()}
+        return metrics
 
     def get_metrics(self, df):
         metrics = {}
         try:
-            df['s_log_ret'] = self._strategy_log_returns(df)
-            metrics['rate_of_return'] = self._strategy_rate_of_return(df)
-            metrics['profit_and_loss'] = self._pnl(df)
-            metrics['buy_and_hold'] = self._buy_and_hold(df)
-            metrics['max_drawdown'] = self._max_dd()
-            metrics['sharpe_ratio'] = self._sharpe_ratio(df)
-            metrics['number_of_trades'] = self._number_of_trades(df)
-            metrics['wind_rate'] = self._win_rate(df)
-            # metrics['calmar_ratio'] = self._calmar_ratio(df)
-            # metrics['gain_to_pain_ratio'] = self._gain_to_pain_ratio(df)
-            # metrics['profit_ratio'] = self._profit_ratio(df)
-
+            metrics = self.compute_metrics(df['close'].to_numpy(), df['position'].to_numpy(), df.index,
+                                           self._fill_returns(df))
         except Exception as e:
             self.logger.error(f'Error computing the metrics: {e}')
 
         return metrics
 
+    @staticmethod
+    def _rolling_sum(values, window: int):
+        """
+        :return: sum of the last window values at every row from cumulative sums, NaN before the first full window
+        """
+        cumulative = np.concatenate([[0], np.cumsum(values, dtype=float)])
+        rolling = np.full(len(values), np.nan)
+        rolling[window - 1:] = cumulative[window:] - cumulative[:-window]
+        return rolling
+
+    @staticmethod
+    def _rolling_max(values, window: int):
+        """
+        Maximum of the last window values at every row, NaN before the first full window. Values are split in blocks of
+        window rows, each window spans the end of one block and the start of the next, so its maximum is the maximum of
+        a suffix maximum and a prefix maximum (van Herk/Gil-Werman), in O(n) for any window length
+        """
+        rows = len(values)
+        rolling = np.full(rows, np.nan)
+        if window > rows:
+            return rolling
+        blocks = np.pad(np.asarray(values, dtype=float), (0, -rows % window), constant_values=-np.inf)
+        blocks = blocks.reshape(-1, window)
+        prefix = np.maximum.accumulate(blocks, axis=1).ravel()[:rows]
+        suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()[:rows]
+        rolling[window - 1:] = np.maximum(suffix[:rows - window + 1], prefix[window - 1:])
+        return rolling
+
+    @PROFILER.timed('metrics')
+    def compute_rolling_metrics(self, close, positions, windows: list, index=None, fill_returns=None):
+        """
+        Computes the metrics of the trailing window of every row for several window lengths, each length in a single
+        O(n) pass of cumulative sums and block maximums over the same returns as compute_metrics:
+        - rate_of_return: return of the window, in percentage
+        - sharpe_ratio: sharpe ratio of the returns of the window, annualised as in compute_metrics
+        - drawdown: drawdown at the row from the highest equity of the window, in percentage
+        - win_rate: share of winning trades among the trades closed in the window
+        With a window as long as the data the last row gives the rate of return, sharpe ratio and win rate of
+        compute_metrics. Rows before the first full window are NaN.
+        :param close: numpy array of close prices with shape (rows,)
+        :param positions: numpy array of positions with shape (rows,)
+        :param windows: list of window lengths in rows
+        :param index: labels of the rows, defaults to row numbers
+        :param fill_returns: optional log returns of the exits filled inside the bar, see _strategy_log_returns
+        :return: dataframe with a (window, metric) column for every window length and metric in ROLLING_METRICS
+        """
+        close = np.asarray(close, dtype=float)
+        positions = np.asarray(positions, dtype=float).reshape(len(close), 1)
+        index = pd.RangeIndex(len(close)) if index is None else pd.Index(index)
+        _, new_order, s_log_ret = self._strategy_log_returns(close, positions, fill_returns)
+        cum_s_log_ret = s_log_ret.cumsum(axis=0)
+        s_log_ret, cum_s_log_ret = s_log_ret[:, 0], cum_s_log_ret[:, 0]
+
+        # Simple returns centred on their mean, so that the rolling sums of squares do not lose precision
+        s_ret = np.exp(s_log_ret) - 1
+        centred = s_ret - s_ret.mean() if len(s_ret) else s_ret
+
+        # Trades end at the row before a new order and at the last row, as in _win_rate
+        last_row = np.append(new_order[1:, 0], True) if len(new_order) else new_order[:, 0]
+        trade_end = np.where(last_row, np.arange(len(last_row)), -1)
+        previous_end = np.concatenate([[-1], np.maximum.accumulate(trade_end)[:-1]]) if len(trade_end) else trade_end
+        previous_cum = np.where(previous_end >= 0, cum_s_log_ret[np.maximum(previous_end, 0)], 0)
+        winning = last_row & (cum_s_log_ret - previous_cum > 0)
+
+        # Equity in logs before every row, the highest one of a window includes the equity it starts from
+        equity = np.concatenate([[0], cum_s_log_ret])
+
+        metrics = {}
+        for window in windows:
+            window = int(window)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate_of_return = (np.exp(self._rolling_sum(s_log_ret, window)) - 1) * 100
+                centred_sum = self._rolling_sum(centred, window)
+                variance = (self._rolling_sum(centred ** 2, window) - centred_sum ** 2 / window) / (window - 1)
+                mean = centred_sum / window + (s_ret.mean() if len(s_ret) else 0)
+                sharpe_ratio = mean / np.sqrt(np.maximum(variance, 0)) * math.sqrt(self.YEARLY_TRADING_DAYS)
+                drawdown = (np.exp(cum_s_log_ret - self._rolling_max(equity, window + 1)[1:]) - 1) * 100
+                win_rate = self._rolling_sum(winning, window) / self._rolling_sum(last_row, window)
+            metrics.update({(window, 'rate_of_return'): rate_of_return,
+                            (window, 'sharpe_ratio'): sharpe_ratio,
+                            (window, 'drawdown'): drawdown,
+                            (window, 'win_rate'): win_rate})
+
+        columns = pd.MultiIndex.from_tuples(list(metrics), names=['window', 'metric'])
+        return pd.DataFrame(np.column_stack(list(metrics.values())) if metrics else None, index=index, columns=columns)
+
+    def get_rolling_metrics(self, df, windows: list):
+        """
+        Rolling metrics of a results dataframe, e.g. results_all after run_wfa, see compute_rolling_metrics
+        :param df: dataframe with close and position columns, and fill_return with execution rules
+        :param windows: list of window lengths in rows
+        :return: dataframe with a (window, metric) column for every window length and metric
+        """
+        rolling_metrics = pd.DataFrame()
+        try:
+            rolling_metrics = self.compute_rolling_metrics(df['close'].to_numpy(), df['position'].to_numpy(), windows,
+                                                           df.index, self._fill_returns(df))
+        except Exception as e:
+            self.logger.error(f'Error computing the rolling metrics: {e}')
+
+        return rolling_metrics
+
     def compute_score(self, df):
         """
         Compute a combined score based on several metrics
         :return:
         """
-        return self._strategy_rate_of_return(df)
+        fill_returns = self._fill_returns(df)
+        return self.compute_scores(df['close'].to_numpy(), df['position'].to_numpy()[:, None],
+                                   None if fill_returns is None else fill_returns[:, None])[0]
+
+    @staticmethod
+    def _fill_returns(df):
+        # Fill returns of the execution rules, only present when the positions come from an ExecutionSimulator
+        return df['fill_return'].to_numpy() if 'fill_return' in df.columns else None
+
+    @PROFILER.timed('scoring')
+    def compute_scores(self, close, positions, fill_returns=None):
+        """
+        Vectorized counterpart of compute_score: computes the rate of return of every column of positions in a single
+        pass, with the same fee and rounding rules as compute_metrics
+        :param close: numpy array of close prices with shape (rows,) or (rows, combinations)
+        :param positions: numpy array of positions with shape (rows, combinations)
+        :param fill_returns: optional log returns of the exits filled inside the bar, see _strategy_log_returns
+        :return: numpy array with the score of each combination
+        """
+        positions = positions.astype(float)
+        log_ret = np.log(close[1:] / close[:-1])
+
+        # A new order is placed every time the position differs from the previous one (flat before the first row)
+        previous = np.vstack([np.zeros((1, positions.shape[1])), positions[:-1]])
+        turnover = np.abs(positions[:-1] - previous[:-1]).sum(axis=0)
+
+        market_return = log_ret @ positions[:-1] if log_ret.ndim == 1 else (log_ret * positions[:-1]).sum(axis=0)
+        s_log_ret = market_return + np.log(1 - self.taker_fee) * turnover
+        if fill_returns is not None:
+            s_log_ret += fill_returns[1:].sum(axis=0)
+        return np.round((np.exp(s_log_ret) - 1) * 100, 2)
 
     def plot_results(self, results_df, cols: list = None):
+        # Plotly is imported on first plot, it is not needed to run backtests
+        import plotly.express as px
+
         try:
             if not cols:
                 cols = ['cum_ret', 'cum_s_ret']
-                results_df['cum_ret'] = results_df['log_ret'].cumsum().apply(np.exp) - 1
-                results_df['cum_s_ret'] = results_df['s_log_ret'].cumsum().apply(np.exp) - 1
+                log_ret, _, s_log_ret = self._strategy_log_returns(results_df['close'].to_numpy(),
+                                                                   results_df[['position']].to_numpy(),
+                                                                   self._fill_returns(results_df))
+                results_df = results_df.assign(cum_ret=np.exp(log_ret.cumsum()) - 1,
+                                               cum_s_ret=np.exp(s_log_ret[:, 0].cumsum()) - 1)
             fig = px.line(results_df[cols], x=results_df.index, y=cols)
             fig.show()
         except Exception as e:
@@ -0,0 +1,156 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import inspect
+import functools
+import contextlib
+from pathlib import Path
+import pandas as pd
+# -- User custom function, classes and objects
+
+
+class Profiler:
+    """
+    Per-stage instrumentation: cumulative wall time, CPU time and calls of every stage of a run (data update, SQL
+    reads, indicators, signals, scoring...). Stages are marked with the timed decorator or the stage context manager and
+    nested stages are subtracted from the self time of their parent, so the self times add up to the time of the run.
+    When disabled a stage only checks the enabled flag.
+
+    CPU time is the CPU time of the whole process, and stages run in pool workers are only seen as the wall time of the
+    stage that waits for them.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile_stats = ''
+
+        # Internal variables
+        self._stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def timed(self, stage: str):
+        """
+        Decorator that records every call of a function as the given stage. When the function returns a generator,
+        every step of its iteration is recorded as the stage too, as that is when the generator does its work
+        :param stage: name of the stage
+        :return: decorator
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.stage(stage):
+                    result = func(*args, **kwargs)
+                return self._timed_iteration(stage, result) if inspect.isgenerator(result) else result
+            return wrapper
+        return decorator
+
+    def _timed_iteration(self, stage: str, generator):
+        """
+        :return: generator yielding the items of generator, recording the time taken by every one as the stage
+        """
+        with contextlib.closing(generator):
+            while True:
+                with self.stage(stage):
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                yield item
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Context manager that records the enclosed code as the given stage
+        :param name: name of the stage
+        """
+        if not self.enabled:
+            yield
+            return
+
+        # Each thread keeps the wall time of the children of every open stage
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            children = stack.pop()
+            if stack:
+                stack[-1] += wall
+            with self._lock:
+                stats = self._stats.setdefault(name, [0, 0.0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += wall
+                stats[2] += cpu
+                stats[3] += wall - children
+
+    def reset(self):
+        """
+        Clears the recorded stages
+        :return:
+        """
+        with self._lock:
+            self._stats = {}
+        self.cprofile_stats = ''
+
+    @contextlib.contextmanager
+    def run(self, cprofile: bool = False, path: str = None, top: int = 30):
+        """
+        Enables the stages for the enclosed code, optionally under cProfile, and restores the previous state afterwards
+        :param cprofile: True to also profile every function call with cProfile
+        :param path: file where the cProfile stats are dumped, readable with pstats or snakeviz
+        :param top: number of functions kept in cprofile_stats, sorted by cumulative time
+        """
+        enabled = self.enabled
+        self.reset()
+        self.enabled = True
+        profile = cProfile.Profile() if cprofile else None
+        if profile:
+            profile.enable()
+        try:
+            yield self
+        finally:
+            self.enabled = enabled
+            if profile:
+                profile.disable()
+                if path:
+                    profile.dump_stats(path)
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(top)
+                self.cprofile_stats = stream.getvalue()
+
+    def report(self):
+        """
+        :return: dataframe with the calls, wall, CPU and self time of every stage, sorted by self time
+        """
+        with self._lock:
+            rows = [[name, *stats] for name, stats in self._stats.items()]
+        report = pd.DataFrame(rows, columns=['stage', 'calls', 'wall_s', 'cpu_s', 'self_s'])
+        total = report['self_s'].sum()
+        report['self_perc'] = (report['self_s'] / total * 100 if total else 0)
+        return report.sort_values('self_s', ascending=False, ignore_index=True).round(4)
+
+    def to_dict(self):
+        """
+        :return: machine-readable report
+        """
+        return {'stages': self.report().to_dict(orient='records'), 'cprofile': self.cprofile_stats}
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+# Instance shared by the instrumented classes
+PROFILER = Profiler()
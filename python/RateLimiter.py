@@ -0,0 +1,70 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import threading
+import time
+# -- User custom function, classes and objects
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket of request weight. The bucket holds at most weight_limit tokens and refills at
+    weight_limit tokens per period, every request takes its weight from the bucket and waits while it is empty.
+    """
+
+    def __init__(self, weight_limit: int = 1200, period_s: float = 60):
+        # Parameters
+        self.weight_limit = weight_limit
+        self.period_s = period_s
+
+        # Internal variables
+        self._tokens = float(weight_limit)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.weight_limit,
+                           self._tokens + (now - self._last_refill) * self.weight_limit / self.period_s)
+        self._last_refill = now
+
+    def acquire(self, weight: int = 1):
+        """
+        Takes weight tokens from the bucket, waiting until they are available
+        :param weight: weight of the request
+        :return: seconds waited
+        """
+        waited = 0
+        weight = min(weight, self.weight_limit)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= weight:
+                    self._tokens -= weight
+                    return waited
+                wait = (weight - self._tokens) * self.period_s / self.weight_limit
+            time.sleep(wait)
+            waited += wait
+
+    def observe(self, used_weight: float):
+        """
+        Aligns the bucket with the weight the exchange reports as used in the current period, which also counts the
+        requests of other processes sharing the same address
+        :param used_weight: weight used according to the exchange
+        :return:
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, max(self.weight_limit - used_weight, 0))
+
+    def available(self):
+        """
+        :return: weight that can be used right now without waiting
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+# Bucket shared by every exchange request of the process
+EXCHANGE_RATE_LIMITER = RateLimiter()
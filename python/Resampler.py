@@ -0,0 +1,89 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+
+
+class Resampler:
+    """
+    Builds the candles of a higher interval from the candles of a base interval. Buckets are aligned in UTC as the
+    exchange aligns them: minutes, hours and days on the epoch and weeks on Monday 00:00. open and close are the first
+    and last of the bucket, high and low its extremes and volume and number_of_trades its sums. The last bucket is
+    returned even if it is not complete yet, as the exchange returns the candle still open.
+    """
+    MS_PER_UNIT = {'m': 60 * 1000,
+                   'h': 60 * 60 * 1000,
+                   'd': 24 * 60 * 60 * 1000,
+                   'w': 7 * 24 * 60 * 60 * 1000}
+    # The epoch is a Thursday, weekly buckets start on the following Monday
+    WEEK_OFFSET_MS = 4 * 24 * 60 * 60 * 1000
+    SUM_COLUMNS = ['volume', 'number_of_trades']
+
+    @classmethod
+    def interval_ms(cls, interval: str):
+        """
+        :param interval: data granularity as string (e.g. '15m', '1h', '4h', '1d', '1w')
+        :return: duration of a candle in milliseconds
+        """
+        if interval[-1] not in cls.MS_PER_UNIT or not interval[:-1].isdigit():
+            raise ValueError(f'Interval {interval} can not be resampled, months have no fixed length')
+        return int(interval[:-1]) * cls.MS_PER_UNIT[interval[-1]]
+
+    @classmethod
+    def bucket_start(cls, open_time_ms, interval: str):
+        """
+        :param open_time_ms: numpy array of open times in epoch milliseconds
+        :param interval: data granularity as string (e.g. '15m', '1h', '4h', '1d', '1w')
+        :return: numpy array with the open time of the bucket of every candle, in epoch milliseconds
+        """
+        step = cls.interval_ms(interval)
+        offset = cls.WEEK_OFFSET_MS if interval[-1] == 'w' else 0
+        return (open_time_ms - offset) // step * step + offset
+
+    @classmethod
+    def check(cls, base_interval: str, interval: str):
+        """
+        Raises a ValueError if interval can not be built from base_interval
+        :return:
+        """
+        base_step, step = cls.interval_ms(base_interval), cls.interval_ms(interval)
+        if step <= base_step or step % base_step:
+            raise ValueError(f'{interval} candles can not be built from {base_interval} candles')
+
+    @classmethod
+    def resample(cls, data: pd.DataFrame, interval: str):
+        """
+        :param data: base candles indexed by open_time and sorted, as returned by DatabaseWrapper.read_candles
+        :param interval: interval of the candles to build
+        :return: pandas dataframe with the candles of interval, with the same columns as data
+        """
+        step = cls.interval_ms(interval)
+        open_time = data.index.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+        buckets = cls.bucket_start(open_time, interval)
+
+        # First and last row of every bucket
+        first = np.flatnonzero(np.diff(buckets, prepend=buckets[:1] - 1))
+        last = np.append(first[1:] - 1, len(buckets) - 1) if len(first) else first
+        bucket_open_time = buckets[first]
+
+        resampled = {}
+        for column in data.columns:
+            values = data[column].to_numpy()
+            if not len(first):
+                resampled[column] = values[:0]
+            elif column == 'open':
+                resampled[column] = values[first]
+            elif column == 'high':
+                resampled[column] = np.maximum.reduceat(values, first)
+            elif column == 'low':
+                resampled[column] = np.minimum.reduceat(values, first)
+            elif column in cls.SUM_COLUMNS:
+                resampled[column] = np.add.reduceat(values, first)
+            elif column == 'close_time':
+                resampled[column] = (bucket_open_time + step - 1).astype('datetime64[ms]')
+            else:
+                resampled[column] = values[last]
+        index = pd.DatetimeIndex(bucket_open_time.astype('datetime64[ms]'), name=data.index.name)
+        return pd.DataFrame(resampled, index=index, columns=data.columns)
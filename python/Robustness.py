@@ -0,0 +1,182 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import math
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+# -- User custom function, classes and objects
+from python.PerformanceMetrics import PerformanceMetrics
+from python.Logger import Logger
+
+
+def _simulate_chunk(robustness, method: str, paths: int, seed, kwargs: dict):
+    # Module level so that the pool workers can run it
+    return robustness.simulate(method, paths, np.random.default_rng(seed), **kwargs)
+
+
+class Robustness:
+    """
+    Monte Carlo analysis of the returns of a backtest, e.g. results_all after run_wfa. Thousands of alternative return
+    paths are resampled from the strategy log returns as columns of a 2-D array and the return, maximum drawdown and
+    sharpe ratio of every path are computed at once, giving their distributions and confidence intervals. Paths are
+    simulated in chunks of CHUNK_PATHS, each with its own seed spawned from the seed of the analysis, so the results
+    are the same whatever the number of processes.
+    """
+    METHODS = ['block_bootstrap', 'trade_shuffle', 'start_offset']
+    METRICS = ['rate_of_return', 'max_drawdown', 'sharpe_ratio']
+    DEFAULT_PATHS = 10000
+    CHUNK_PATHS = 500
+
+    def __init__(self, results: pd.DataFrame, taker_fee: float = 0.1 / 100, seed: int = None, workers: int = 1):
+        """
+        :param results: dataframe with close and position columns, and fill_return with execution rules
+        :param taker_fee: fee paid on every unit of position traded
+        :param seed: seed of the random generator, None for a different analysis every time
+        :param workers: number of processes simulating the chunks of paths, None uses all available cores
+        """
+        # Parameters
+        self.seed = seed
+        self.workers = workers
+        self.distribution = pd.DataFrame()
+
+        # Strategy log returns and trades, with the same fee and trade rules as PerformanceMetrics
+        metrics = PerformanceMetrics(0, taker_fee)
+        positions = results[['position']].to_numpy(dtype=float)
+        _, new_order, s_log_ret = metrics._strategy_log_returns(results['close'].to_numpy(dtype=float), positions,
+                                                                metrics._fill_returns(results))
+        self.s_log_ret = s_log_ret[:, 0]
+
+        # A trade is every run of rows between two new orders, as in PerformanceMetrics._win_rate
+        last_row = np.append(new_order[1:, 0], True) if len(new_order) else new_order[:, 0]
+        ends = np.flatnonzero(last_row)
+        self.trade_starts = np.concatenate([[0], ends[:-1] + 1]) if len(ends) else ends
+        self.trade_lengths = ends + 1 - self.trade_starts
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def block_bootstrap(self, paths: int, rng: np.random.Generator, block_length: int = None):
+        """
+        Circular block bootstrap: every path is made of blocks of consecutive returns starting at random rows, which
+        keeps the autocorrelation and volatility clustering within a block
+        :param paths: number of paths
+        :param rng: random generator
+        :param block_length: rows of every block, the cube root of the number of rows by default
+        :return: numpy array of log returns with shape (rows, paths)
+        """
+        rows = len(self.s_log_ret)
+        block_length = int(block_length) if block_length else max(int(round(rows ** (1 / 3))), 1)
+        blocks = math.ceil(rows / block_length)
+        # Blocks wrap around the end, every possible block is a view of the padded returns
+        padded = np.concatenate([self.s_log_ret, self.s_log_ret[:block_length - 1]])
+        windows = sliding_window_view(padded, block_length)
+        starts = rng.integers(0, rows, size=(blocks, paths))
+        return windows[starts].transpose(0, 2, 1).reshape(blocks * block_length, paths)[:rows]
+
+    def trade_shuffle(self, paths: int, rng: np.random.Generator):
+        """
+        Shuffles the order of the trades: every path has the same trades, with their returns and fees, in a random
+        order, so the return stays the same but the drawdown and the path to it change
+        :param paths: number of paths
+        :param rng: random generator
+        :return: numpy array of log returns with shape (rows, paths)
+        """
+        trades = len(self.trade_starts)
+        order = rng.permuted(np.tile(np.arange(trades), (paths, 1)), axis=1).ravel()
+
+        # Row of the original returns read by every row of every path, paths one after the other. Rows within a trade
+        # are consecutive, so the rows are the cumulative sum of steps of one that jump at the first row of every trade
+        lengths = self.trade_lengths[order]
+        trade_ends = self.trade_starts + self.trade_lengths - 1
+        steps = np.ones(lengths.sum(), dtype=np.int64)
+        steps[np.cumsum(lengths) - lengths] = self.trade_starts[order] - np.concatenate([[0], trade_ends[order][:-1]])
+        return self.s_log_ret[np.cumsum(steps).reshape(paths, -1).T]
+
+    def start_offset(self, paths: int, rng: np.random.Generator, max_offset: int = 100):
+        """
+        Starts every path at a random row within the first max_offset rows, as if the first fold had started later, and
+        keeps the same number of rows in all of them
+        :param paths: number of paths
+        :param rng: random generator
+        :param max_offset: last possible start row, the test window of run_wfa by default
+        :return: numpy array of log returns with shape (rows - max_offset, paths)
+        """
+        max_offset = min(int(max_offset), len(self.s_log_ret) - 1)
+        offsets = rng.integers(0, max_offset + 1, size=paths)
+        return self.s_log_ret[np.arange(len(self.s_log_ret) - max_offset)[:, None] + offsets[None, :]]
+
+    @staticmethod
+    def path_metrics(s_log_ret):
+        """
+        :param s_log_ret: numpy array of log returns with shape (rows, paths)
+        :return: numpy array with shape (paths, metrics) with the metrics in METRICS of every path, computed as in
+        PerformanceMetrics.compute_metrics
+        """
+        rows = len(s_log_ret)
+        cum_s_log_ret = s_log_ret.cumsum(axis=0)
+        # The arrays are as large as the paths, the drawdown is computed in place of the peak
+        drawdown = np.maximum.accumulate(cum_s_log_ret, axis=0)
+        np.subtract(cum_s_log_ret, drawdown, out=drawdown)
+        max_dd = drawdown.min(axis=0)
+
+        # Variance from the sums of the returns and of their squares, a pass less than std
+        s_ret = np.expm1(s_log_ret)
+        mean = s_ret.sum(axis=0) / rows
+        variance = (np.einsum('ij,ij->j', s_ret, s_ret) - rows * mean ** 2) / (rows - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe_ratio = mean / np.sqrt(np.maximum(variance, 0)) * math.sqrt(PerformanceMetrics.YEARLY_TRADING_DAYS)
+        return np.column_stack([(np.exp(cum_s_log_ret[-1]) - 1) * 100, (np.exp(max_dd) - 1) * 100, sharpe_ratio])
+
+    def simulate(self, method: str, paths: int, rng: np.random.Generator, **kwargs):
+        """
+        :param method: resampling method, one of METHODS
+        :param paths: number of paths
+        :param rng: random generator
+        :param kwargs: arguments of the method
+        :return: numpy array with shape (paths, metrics) with the metrics of every simulated path
+        """
+        if method not in self.METHODS:
+            raise ValueError(f'Unknown method {method}, use one of {self.METHODS}')
+        return self.path_metrics(getattr(self, method)(paths, rng, **kwargs))
+
+    def run(self, method: str = 'block_bootstrap', paths: int = DEFAULT_PATHS, **kwargs):
+        """
+        Simulates the paths in chunks, spread across processes when there are several workers
+        :param method: resampling method, one of METHODS
+        :param paths: number of paths
+        :param kwargs: arguments of the method (block_length, max_offset)
+        :return: dataframe with the metrics of every path, also kept in distribution
+        """
+        chunks = [min(self.CHUNK_PATHS, paths - start) for start in range(0, paths, self.CHUNK_PATHS)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(chunks))
+        self.logger.info(f'Simulating {paths} paths of {len(self.s_log_ret)} rows with {method}')
+        if self.workers == 1 or len(chunks) == 1:
+            results = [_simulate_chunk(self, method, size, seed, kwargs) for size, seed in zip(chunks, seeds)]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(_simulate_chunk, [self] * len(chunks), [method] * len(chunks), chunks, seeds,
+                                        [kwargs] * len(chunks)))
+
+        self.distribution = pd.DataFrame(np.vstack(results) if results else np.empty((0, len(self.METRICS))),
+                                         columns=self.METRICS)
+        return self.distribution
+
+    def summary(self, confidence: float = 0.9):
+        """
+        :param confidence: probability covered by the confidence interval
+        :return: dataframe with the metric of the backtest, and the mean, standard deviation, confidence interval and
+        median of the simulated paths for every metric
+        """
+        lower, upper = (1 - confidence) / 2, (1 + confidence) / 2
+        actual = self.path_metrics(self.s_log_ret[:, None])[0]
+        summary = pd.DataFrame({'actual': actual,
+                                'mean': self.distribution.mean(),
+                                'std': self.distribution.std(),
+                                f'p{lower * 100:g}': self.distribution.quantile(lower),
+                                'median': self.distribution.median(),
+                                f'p{upper * 100:g}': self.distribution.quantile(upper)},
+                               index=self.METRICS)
+        summary['prob_loss'] = [(self.distribution['rate_of_return'] < 0).mean(), np.nan, np.nan]
+        return summary.round(4)
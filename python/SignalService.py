@@ -0,0 +1,451 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import json
+import time
+import asyncio
+import argparse
+import collections
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Logger import Logger
+from python.StreamingIndicators import StreamingSMA, StreamingMomentum, StreamingHurst
+
+# Closed candle of a feed. Times are epoch milliseconds and received is the time.perf_counter() at which it arrived
+Kline = collections.namedtuple('Kline', ['pair', 'interval', 'open_time', 'open', 'high', 'low', 'close', 'volume',
+                                         'close_time', 'number_of_trades', 'received'])
+
+
+class KlineFeed:
+    """
+    Base class of the sources of closed candles of the signal service
+    """
+
+    async def klines(self):
+        """
+        Asynchronous generator of the closed candles of every subscribed series, in the order they close
+        :return: Kline
+        """
+        raise NotImplementedError
+        yield
+
+    def close(self):
+        """
+        Stops the feed
+        :return:
+        """
+
+
+class ReplayFeed(KlineFeed):
+    """
+    Replays stored candles of several series in the order they closed, for tests and dry runs of the service
+    """
+
+    def __init__(self, candles: dict, delay: float = 0):
+        """
+        :param candles: dictionary of (pair, interval) and candles indexed by open_time, as returned by
+        DatabaseWrapper.read_candles
+        :param delay: seconds waited between candles, 0 only yields control to the event loop
+        """
+        self.candles = candles
+        self.delay = delay
+        self._closed = False
+
+    async def klines(self):
+        # Columns of every series as epoch milliseconds and floats, merged in close_time order
+        series = []
+        for (pair, interval), data in self.candles.items():
+            open_time = data.index.to_numpy(dtype='datetime64[ms]').astype('int64')
+            close_time = data['close_time'].to_numpy(dtype='datetime64[ms]').astype('int64') \
+                if 'close_time' in data.columns else open_time
+            values = [data[column].to_numpy(dtype=float) if column in data.columns else np.full(len(data), np.nan)
+                      for column in ['open', 'high', 'low', 'close', 'volume', 'number_of_trades']]
+            series.append((pair, interval, open_time, close_time, values))
+        close_times = np.concatenate([s[3] for s in series]) if series else np.empty(0, dtype='int64')
+        series_ids = np.concatenate([np.full(len(s[2]), i) for i, s in enumerate(series)]) if series else close_times
+        rows = np.concatenate([np.arange(len(s[2])) for s in series]) if series else close_times
+        order = np.lexsort((series_ids, close_times))
+
+        for i in order:
+            if self._closed:
+                return
+            pair, interval, open_time, close_time, values = series[series_ids[i]]
+            row = rows[i]
+            open_, high, low, close, volume, trades = (column[row] for column in values)
+            await asyncio.sleep(self.delay)
+            yield Kline(pair, interval, int(open_time[row]), open_, high, low, close, volume, int(close_time[row]),
+                        trades, time.perf_counter())
+
+    def close(self):
+        self._closed = True
+
+
+class BinanceKlineFeed(KlineFeed):
+    """
+    Closed candles of the Binance kline websocket streams. The websocket client runs in its own thread, parses every
+    message as it arrives and only hands the closed candles to the event loop.
+    """
+    STREAM_URL = 'wss://stream.binance.com:9443'
+    # Streams subscribed per message, the exchange limits the incoming messages per second of a connection
+    STREAMS_PER_MESSAGE = 200
+
+    def __init__(self, subscriptions: list, stream_url: str = STREAM_URL):
+        """
+        :param subscriptions: list of (pair, interval) tuples
+        :param stream_url: base url of the websocket streams
+        """
+        self.subscriptions = list(subscriptions)
+        self.stream_url = stream_url
+
+        # Internal variables
+        self._client = None
+        self._loop = None
+        self._queue = None
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    @staticmethod
+    def parse(message: str, received: float = None):
+        """
+        :param message: message of a kline stream, raw or combined
+        :param received: time.perf_counter() at which the message arrived
+        :return: Kline if the message closes a candle, None otherwise
+        """
+        data = json.loads(message)
+        data = data.get('data', data)
+        if data.get('e') != 'kline' or not data['k']['x']:
+            return None
+        k = data['k']
+        return Kline(k['s'], k['i'], int(k['t']), float(k['o']), float(k['h']), float(k['l']), float(k['c']),
+                     float(k['v']), int(k['T']), float(k['n']), received if received else time.perf_counter())
+
+    async def klines(self):
+        # The websocket client is only loaded when the feed is used
+        from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
+
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+        def on_message(_, message):
+            received = time.perf_counter()
+            try:
+                kline = self.parse(message, received)
+            except Exception as e:
+                self.logger.error(f'Error parsing kline message: {e}')
+                return
+            if kline is not None:
+                self._put(kline)
+
+        def on_close(_, error=None):
+            # The connection dropped or was closed, the iteration ends
+            self.logger.warning(f'Kline websocket closed{f": {error}" if error else ""}')
+            self._put(None)
+
+        self._client = SpotWebsocketStreamClient(stream_url=self.stream_url, on_message=on_message,
+                                                 on_close=on_close, on_error=on_close)
+        streams = [f'{pair.lower()}@kline_{interval}' for pair, interval in self.subscriptions]
+        for i in range(0, len(streams), self.STREAMS_PER_MESSAGE):
+            self._client.subscribe(streams[i:i + self.STREAMS_PER_MESSAGE], id=i + 1)
+        self.logger.info(f'Subscribed to {len(streams)} kline streams')
+
+        try:
+            while True:
+                kline = await self._queue.get()
+                # None is posted by close and when the connection ends
+                if kline is None:
+                    break
+                yield kline
+        finally:
+            self.close()
+
+    def _put(self, kline):
+        # Hands a kline, or None to end the iteration, from the websocket thread to the event loop
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, kline)
+
+    def close(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            client.stop()
+        # Wakes up klines if it is waiting for a candle
+        self._put(None)
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in logarithmic buckets from 1 microsecond to 100 seconds, cheap enough to record every candle
+    """
+    BUCKETS_PER_DECADE = 10
+    MIN_EXPONENT = -6
+    MAX_EXPONENT = 2
+
+    def __init__(self):
+        self.edges = np.logspace(self.MIN_EXPONENT, self.MAX_EXPONENT,
+                                 (self.MAX_EXPONENT - self.MIN_EXPONENT) * self.BUCKETS_PER_DECADE + 1)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the recorded latencies
+        :return:
+        """
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """
+        :param seconds: latency to record
+        :return:
+        """
+        self.counts[np.searchsorted(self.edges, seconds, 'right')] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float):
+        """
+        :param q: percentile between 0 and 100
+        :return: upper edge in seconds of the bucket holding the percentile, NaN without records
+        """
+        if not self.count:
+            return np.nan
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count, 'left'))
+        return min(self.edges[min(bucket, len(self.edges) - 1)], self.max)
+
+    def summary(self):
+        """
+        :return: dictionary with the count and the mean, p50, p90, p99 and max latencies in milliseconds
+        """
+        summary = {'count': self.count, 'mean_ms': self.total / self.count * 1000 if self.count else np.nan}
+        for q in [50, 90, 99]:
+            summary[f'p{q}_ms'] = self.percentile(q) * 1000
+        summary['max_ms'] = self.max * 1000
+        return {k: round(v, 4) if isinstance(v, float) else v for k, v in summary.items()}
+
+    def to_frame(self):
+        """
+        :return: dataframe with the upper edge in milliseconds and the count of every non-empty bucket
+        """
+        edges = np.append(self.edges, np.inf) * 1000
+        buckets = pd.DataFrame({'upper_ms': edges, 'count': self.counts})
+        return buckets[buckets['count'] > 0].reset_index(drop=True)
+
+
+class StreamingStrategy:
+    """
+    Incremental counterpart of a run_<strategy> function of Strategy for one series. Its indicators are streaming
+    indicators, so every closed candle only updates the last bar and gives the position run_<strategy> computes for
+    that row.
+    """
+    # Same confirmation as the Strategy functions
+    CONFIRMATION_PERC = 0.02
+    STRATEGIES = ['macd', 'modified_macd', 'bnh', 'momentum_h']
+
+    def __init__(self, strategy: str, params: dict):
+        """
+        :param strategy: strategy name corresponding to a function in Strategy class
+        :param params: set of parameters of the strategy
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Strategy {strategy} has no streaming version, use one of {self.STRATEGIES}')
+        self.strategy = strategy
+        self.params = params
+        self.position = 0
+        self.open_time = None
+
+        if strategy in ['macd', 'modified_macd']:
+            self.indicators = {'sma_short': StreamingSMA(int(params.get('sma_short'))),
+                               'sma_long': StreamingSMA(int(params.get('sma_long')))}
+        elif strategy == 'momentum_h':
+            self.indicators = {'hurst': StreamingHurst(int(params.get('hurst_length'))),
+                               'mom': StreamingMomentum(int(params.get('hurst_length')))}
+        else:
+            self.indicators = {}
+
+    def seed(self, data: pd.DataFrame):
+        """
+        Initialises the indicators and the position from the history of a series
+        :param data: candles indexed by open_time
+        :return: the strategy itself
+        """
+        for indicator in self.indicators.values():
+            indicator.seed(data)
+        if len(data):
+            self.position = self._position(float(data['close'].iloc[-1]))
+            self.open_time = int(data.index[-1:].to_numpy(dtype='datetime64[ms]').astype('int64')[0])
+        return self
+
+    def update(self, kline: Kline):
+        """
+        :param kline: new closed candle of the series
+        :return: position after the candle
+        """
+        for indicator in self.indicators.values():
+            indicator.update(kline.close)
+        self.open_time = kline.open_time
+        self.position = self._position(kline.close)
+        return self.position
+
+    def _position(self, close: float):
+        values = {name: indicator.value for name, indicator in self.indicators.items()}
+        confirmation = 1 + self.CONFIRMATION_PERC
+        if self.strategy == 'bnh':
+            return 1
+        if self.strategy == 'momentum_h':
+            return int(values['hurst'] > self.params.get('hurst_threshold') and values['mom'] > 0)
+        if int(self.params.get('sma_short')) >= int(self.params.get('sma_long')):
+            return 0
+        short, long = values['sma_short'], values['sma_long']
+        if self.strategy == 'macd':
+            return int(short > long * confirmation)
+        return int(close > long * confirmation and (short > long * confirmation or close > short * confirmation))
+
+
+class SignalService:
+    """
+    Long-running asyncio service that keeps the live position of many series. Every series holds its strategy state in
+    memory, seeded from its history, and each closed candle of the feed only updates that state, so a new signal costs
+    microseconds instead of a backtest. Position changes are put in the signals queue and passed to on_signal, and the
+    time from the arrival of a candle to its position is recorded in the latency histogram.
+    """
+
+    def __init__(self, feed: KlineFeed, strategies: dict, on_signal=None):
+        """
+        :param feed: source of closed candles
+        :param strategies: dictionary of (pair, interval) and (strategy name, parameters), e.g. the parameters of the
+        last fold of a walk forward analysis
+        :param on_signal: optional function or coroutine function called with every position change
+        """
+        self.feed = feed
+        self.states = {key: StreamingStrategy(strategy, params) for key, (strategy, params) in strategies.items()}
+        self.on_signal = on_signal
+        self.signals = asyncio.Queue()
+        self.latency = LatencyHistogram()
+        self.candles = 0
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    @property
+    def positions(self):
+        """
+        :return: dictionary of (pair, interval) and current position
+        """
+        return {key: state.position for key, state in self.states.items()}
+
+    def seed(self, pair: str, interval: str, data: pd.DataFrame):
+        """
+        Initialises the state of a series from its history
+        :param pair: currency pair
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :param data: candles indexed by open_time, as returned by DatabaseWrapper.read_candles
+        :return:
+        """
+        # The candle still open is left out, the feed sends it once it closes
+        if 'close_time' in data.columns:
+            data = data[data['close_time'] <= pd.Timestamp.now(tz='UTC').tz_localize(None)]
+        self.states[(pair, interval)].seed(data)
+
+    def process(self, kline: Kline):
+        """
+        Updates the state of the series of a closed candle
+        :param kline: closed candle
+        :return: signal dictionary if the position changed, None otherwise
+        """
+        state = self.states.get((kline.pair, kline.interval))
+        if state is None or (state.open_time is not None and kline.open_time <= state.open_time):
+            # Other series and candles already processed, feeds may repeat the last one after a reconnection
+            return None
+
+        previous = state.position
+        position = state.update(kline)
+        latency = time.perf_counter() - kline.received
+        self.latency.record(latency)
+        self.candles += 1
+        if position == previous:
+            return None
+        return {'pair': kline.pair,
+                'interval': kline.interval,
+                'open_time': pd.Timestamp(kline.open_time, unit='ms'),
+                'close': kline.close,
+                'position': position,
+                'previous_position': previous,
+                'latency_ms': latency * 1000}
+
+    async def run(self, max_candles: int = None):
+        """
+        Processes the candles of the feed until it ends, the service is stopped or max_candles are processed
+        :param max_candles: optional number of candles after which the service stops
+        :return:
+        """
+        self.logger.info(f'Serving signals of {len(self.states)} series')
+        try:
+            async for kline in self.feed.klines():
+                signal = self.process(kline)
+                if signal is not None:
+                    self.signals.put_nowait(signal)
+                    self._notify(signal)
+                if max_candles and self.candles >= max_candles:
+                    break
+        finally:
+            self.feed.close()
+            self.logger.info(f'Tick to signal latency: {self.latency.summary()}')
+
+    def _notify(self, signal: dict):
+        if self.on_signal is None:
+            return
+        try:
+            if asyncio.iscoroutinefunction(self.on_signal):
+                # Callbacks that wait do not delay the next candles
+                asyncio.get_running_loop().create_task(self.on_signal(signal))
+            else:
+                self.on_signal(signal)
+        except Exception as e:
+            self.logger.error(f'Error notifying signal: {e}')
+
+    def stop(self):
+        """
+        Stops the feed, and with it the service
+        :return:
+        """
+        self.feed.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves live position changes of a strategy for many pairs')
+    parser.add_argument('--pairs', nargs='+', default=['BTCUSDT'], help='pairs to follow')
+    parser.add_argument('--intervals', nargs='+', default=['1h'], help='intervals to follow')
+    parser.add_argument('--strategy', default='modified_macd', help='strategy name of the Strategy class')
+    parser.add_argument('--params', default='{"sma_short": 20, "sma_long": 100}', help='strategy parameters as JSON')
+    parser.add_argument('--history', type=int, default=1000, help='candles of history read to seed every series')
+    parser.add_argument('--replay', type=int, help='replay this many synthetic candles per series instead of '
+                                                   'following the exchange')
+    args = parser.parse_args()
+
+    strategy_params = json.loads(args.params)
+    keys = [(pair, interval) for pair in args.pairs for interval in args.intervals]
+    if args.replay:
+        from python.SyntheticCandles import SyntheticCandles
+        candles = {key: SyntheticCandles(seed=i).generate(args.history + args.replay, key[1])
+                   for i, key in enumerate(keys)}
+        history = {key: data.iloc[:args.history] for key, data in candles.items()}
+        kline_feed = ReplayFeed({key: data.iloc[args.history:] for key, data in candles.items()})
+    else:
+        from python.DatabaseWrapper import DatabaseWrapper
+        dbwrapper = DatabaseWrapper()
+        dbwrapper.market_data_update_many(args.pairs, args.intervals)
+        history = {key: dbwrapper.read_candles(*key).iloc[-args.history:] for key in keys}
+        kline_feed = BinanceKlineFeed(keys)
+
+    service = SignalService(kline_feed, {key: (args.strategy, strategy_params) for key in keys}, on_signal=print)
+    for key, data in history.items():
+        service.seed(*key, data)
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        service.stop()
+    print(service.latency.to_frame().to_string(index=False))
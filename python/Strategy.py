@@ -3,12 +3,11 @@
 # -- Built-in and installed packages
 import pandas as pd
 import numpy as np
-import plotly.express as px
-from plotly.subplots import make_subplots
 # -- User custom function, classes and objects
 from python.Indicators import Indicators
 from python.PerformanceMetrics import PerformanceMetrics
 from python.Logger import Logger
+from python.Profiler import PROFILER
 
 
 class Strategy(Indicators, PerformanceMetrics):
@@ -23,24 +22,34 @@ class Strategy(Indicators, PerformanceMetrics):
         self.results = pd.DataFrame
         self.results_all = pd.DataFrame()
 
+        # Exit and sizing rules applied to the positions by execute, None trades the signals as they are
+        self.execution = None
+
         # Logger
-        self.logger = Logger('Strat').get_logger()
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def _results_frame(self):
+        """
+        :return: results dataframe whose close column is a view of the close prices of data, the columns added by the
+        strategies are new arrays
+        """
+        return pd.DataFrame({'close': self.data['close']}, copy=False)
 
+    @PROFILER.timed('signals')
     def run_macd(self, params):
         try:
             # Set parameters
             confirmation_perc = 0.02
-            sma_short = params.get('sma_short')
-            sma_long = params.get('sma_long')
+            sma_short = int(params.get('sma_short'))
+            sma_long = int(params.get('sma_long'))
             sma_short_name = f'SMA_{sma_short}'
             sma_long_name = f'SMA_{sma_long}'
-            columns = ['close']
 
             # Compute indicators
-            self.results = self.data[columns].copy()
+            self.results = self._results_frame()
             if sma_short < sma_long:
-                self.sma(sma_short)
-                self.sma(sma_long)
+                self.results[sma_short_name] = self.sma(self.results, sma_short)
+                self.results[sma_long_name] = self.sma(self.results, sma_long)
 
                 # Set position based on indicators
                 conditions = self.results[sma_short_name] > (self.results[sma_long_name] * (1+confirmation_perc))
@@ -50,6 +59,7 @@ class Strategy(Indicators, PerformanceMetrics):
         except Exception as e:
             self.logger.error(f'Error running the strategy: {e}')
 
+    @PROFILER.timed('signals')
     def run_modified_macd(self, params):
         try:
             # Set parameters
@@ -58,13 +68,12 @@ class Strategy(Indicators, PerformanceMetrics):
             sma_long = int(params.get('sma_long'))
             sma_short_name = f'SMA_{sma_short}'
             sma_long_name = f'SMA_{sma_long}'
-            columns = ['close']
 
             # Compute indicators
-            self.results = self.data[columns].copy()
+            self.results = self._results_frame()
             if sma_short < sma_long:
-                self.sma(sma_short)
-                self.sma(sma_long)
+                self.results[sma_short_name] = self.sma(self.results, sma_short)
+                self.results[sma_long_name] = self.sma(self.results, sma_long)
 
                 # Set position based on indicators
                 conditions = ((self.results.close > self.results[sma_long_name] * (1+confirmation_perc)) &
@@ -78,27 +87,26 @@ class Strategy(Indicators, PerformanceMetrics):
         except Exception as e:
             self.logger.error(f'Error running the strategy: {e}')
 
+    @PROFILER.timed('signals')
     def run_bnh(self, params):
-        columns = ['close']
-
         # Compute indicators
-        self.results = self.data[columns].copy()
+        self.results = self._results_frame()
         self.results['position'] = 1
 
+    @PROFILER.timed('signals')
     def run_momentum_h(self, params):
         try:
             # Set parameters
-            hurst_length = params.get('hurst_length')
+            hurst_length = int(params.get('hurst_length'))
             hurst_threshold = params.get('hurst_threshold')
             hurst_name = f'hurst_{hurst_length}'
             mom_name = f'mom_{hurst_length}'
-            columns = ['close']
 
             # Compute indicators
-            self.results = self.data[columns].copy()
+            self.results = self._results_frame()
 
-            self.hurst(hurst_length)
-            self.mom(hurst_length)
+            self.results[hurst_name] = self.hurst(self.results, hurst_length)
+            self.results[mom_name] = self.mom(self.results, hurst_length)
 
             # Set position based on indicators
             conditions = (self.results[hurst_name] > hurst_threshold) & (self.results[mom_name] > 0)
@@ -106,13 +114,118 @@ class Strategy(Indicators, PerformanceMetrics):
         except Exception as e:
             self.logger.error(f'Error running the strategy: {e}')
 
+    @PROFILER.timed('signals')
+    def batch_macd(self, param_grid):
+        """
+        Computes the positions of run_macd for every parameter combination at once
+        :param param_grid: list of parameter dictionaries as returned by Backtester.create_parameter_grid
+        :return: numpy array of shape (rows, combinations) with the position of each combination
+        """
+        # Set parameters
+        confirmation_perc = 0.02
+        sma_short = np.array([int(params.get('sma_short')) for params in param_grid])
+        sma_long = np.array([int(params.get('sma_long')) for params in param_grid])
+
+        # Compute every required window once
+        windows, inverse = np.unique(np.concatenate([sma_short, sma_long]), return_inverse=True)
+        smas = np.column_stack([self.sma(self.data, window).to_numpy() for window in windows])
+        short_vals = smas[:, inverse[:len(param_grid)]]
+        long_vals = smas[:, inverse[len(param_grid):]]
+
+        # Set position based on indicators
+        conditions = (short_vals > long_vals * (1+confirmation_perc)) & (sma_short < sma_long)
+        return conditions.astype(np.int8)
+
+    @PROFILER.timed('signals')
+    def batch_modified_macd(self, param_grid):
+        """
+        Computes the positions of run_modified_macd for every parameter combination at once
+        :param param_grid: list of parameter dictionaries as returned by Backtester.create_parameter_grid
+        :return: numpy array of shape (rows, combinations) with the position of each combination
+        """
+        # Set parameters
+        confirmation_perc = 0.02
+        sma_short = np.array([int(params.get('sma_short')) for params in param_grid])
+        sma_long = np.array([int(params.get('sma_long')) for params in param_grid])
+
+        # Compute every required window once
+        windows, inverse = np.unique(np.concatenate([sma_short, sma_long]), return_inverse=True)
+        smas = np.column_stack([self.sma(self.data, window).to_numpy() for window in windows])
+        close = self.data['close'].to_numpy()[:, None]
+        short_vals = smas[:, inverse[:len(param_grid)]]
+        long_vals = smas[:, inverse[len(param_grid):]]
+
+        # Set position based on indicators
+        above_long = close > long_vals * (1+confirmation_perc)
+        conditions = above_long & ((short_vals > long_vals * (1+confirmation_perc)) |
+                                   (close > short_vals * (1+confirmation_perc)))
+        return (conditions & (sma_short < sma_long)).astype(np.int8)
+
+    @PROFILER.timed('signals')
+    def batch_bnh(self, param_grid):
+        """
+        Computes the positions of run_bnh for every parameter combination at once
+        :param param_grid: list of parameter dictionaries as returned by Backtester.create_parameter_grid
+        :return: numpy array of shape (rows, combinations) with the position of each combination
+        """
+        return np.ones((len(self.data), len(param_grid)), dtype=np.int8)
+
+    @PROFILER.timed('signals')
+    def batch_momentum_h(self, param_grid):
+        """
+        Computes the positions of run_momentum_h for every parameter combination at once
+        :param param_grid: list of parameter dictionaries as returned by Backtester.create_parameter_grid
+        :return: numpy array of shape (rows, combinations) with the position of each combination
+        """
+        # Set parameters
+        hurst_length = np.array([int(params.get('hurst_length')) for params in param_grid])
+        hurst_threshold = np.array([params.get('hurst_threshold') for params in param_grid])
+
+        # Compute every required window once
+        lengths, inverse = np.unique(hurst_length, return_inverse=True)
+        hurst_vals = self.hurst_many(self.data, lengths).to_numpy()
+        mom_vals = np.column_stack([self.mom(self.data, length).to_numpy() for length in lengths])
+
+        # Set position based on indicators
+        conditions = (hurst_vals[:, inverse] > hurst_threshold) & (mom_vals[:, inverse] > 0)
+        return conditions.astype(np.int8)
+
+    def grid_positions(self, strategy: str, param_grid: list):
+        """
+        Positions of run_<strategy> for every parameter set, one run at a time, so that the execution rules and the
+        scores of strategies without a batch function are still computed for all the sets at once
+        :param strategy: strategy name corresponding to a run function
+        :param param_grid: list of parameter sets
+        :return: numpy array of positions with shape (rows, combinations)
+        """
+        positions = np.zeros((len(self.data), len(param_grid)))
+        for column, params in enumerate(param_grid):
+            getattr(self, 'run_' + strategy)(params)
+            positions[:, column] = self.results['position'].to_numpy()
+        return positions
+
+    @PROFILER.timed('execution')
+    def execute(self, positions):
+        """
+        Applies the execution rules to positions computed on the current data
+        :param positions: numpy array of positions with shape (rows,) or (rows, combinations)
+        :return: tuple of (positions, fill_returns), fill_returns being None without execution rules
+        """
+        if self.execution is None:
+            return positions, None
+        return self.execution.run(positions, self.data)
+
     def get_last_position(self):
         if not isinstance(self.results, pd.DataFrame):
             self.run_strategy()
         position_map = {-1: 'SHORT',
                         0: 'HOLD CASH',
                         1: 'LONG'}
-        return position_map[self.results['position'].iloc[-1]]
+        # Volatility sizing gives fractional positions, their size is reported next to the direction
+        position = np.nan_to_num(self.results['position'].iloc[-1])
+        direction = position_map[int(np.sign(position))]
+        return direction if position in position_map else f'{direction} {abs(position):.2f}'
+
 
     def set_data(self, data: pd.DataFrame):
         self.data = data
@@ -122,6 +235,8 @@ class Strategy(Indicators, PerformanceMetrics):
         :param cols:
         :return:
         """
+        import plotly.express as px
+
         columns = ['close']
         for word in words:
             columns = columns + [col for col in self.results.columns if word in col.lower()]
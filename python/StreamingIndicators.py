@@ -0,0 +1,190 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Indicators import Indicators
+
+
+class StreamingIndicator:
+    """
+    Base class of the stateful counterparts of Indicators. Values are fed one candle (or a small batch) at a time with
+    update/update_many and the state can be seeded from the history of an existing dataframe, so a new signal only costs
+    the update of the last bar instead of recomputing the whole history.
+    """
+
+    def __init__(self, length: int, column: str = 'close'):
+        # Parameters
+        self.length = int(length)
+        self.column = column
+
+        # Internal variables
+        self.value = np.nan
+        self.count = 0
+
+    def update(self, value: float):
+        """
+        Adds a new value to the indicator
+        :param value: new value of the input column
+        :return: indicator value after the update
+        """
+        raise NotImplementedError
+
+    def update_many(self, values):
+        """
+        Adds several values to the indicator in order
+        :param values: iterable with the new values of the input column
+        :return: numpy array with the indicator value after each update
+        """
+        return np.array([self.update(value) for value in values], dtype=float)
+
+    def seed(self, df: pd.DataFrame):
+        """
+        Initialises the state from the history of a dataframe, as if every row had been passed to update
+        :param df: dataframe containing the input column
+        :return: the indicator itself
+        """
+        self.reset()
+        self.update_many(df[self.column].to_numpy(dtype=float))
+        return self
+
+    def reset(self):
+        """
+        Clears the state of the indicator
+        :return:
+        """
+        self.value = np.nan
+        self.count = 0
+
+
+class _WindowIndicator(StreamingIndicator):
+    """
+    Streaming indicator that only depends on the last window_size values, kept in a fixed size ring buffer
+    """
+
+    def __init__(self, length: int, column: str = 'close', window_size: int = None):
+        super().__init__(length, column)
+        self._window = np.full(window_size if window_size else self.length, np.nan)
+        self._pos = 0
+
+    def _push(self, value: float):
+        # Returns the value leaving the window
+        old = self._window[self._pos]
+        self._window[self._pos] = value
+        self._pos = (self._pos + 1) % len(self._window)
+        self.count += 1
+        return old
+
+    def _ordered_window(self):
+        return np.concatenate([self._window[self._pos:], self._window[:self._pos]])
+
+    def seed(self, df: pd.DataFrame):
+        # Only the last values of the history are part of the state
+        self.reset()
+        values = df[self.column].to_numpy(dtype=float)
+        tail = values[-len(self._window):]
+        self._window[:len(tail)] = tail
+        self._pos = len(tail) % len(self._window)
+        self.count = len(values)
+        self._refresh()
+        return self
+
+    def reset(self):
+        super().reset()
+        self._window[:] = np.nan
+        self._pos = 0
+
+    def _refresh(self):
+        # Recomputes the value from the ring buffer
+        raise NotImplementedError
+
+
+class StreamingSMA(_WindowIndicator):
+    """
+    Streaming counterpart of Indicators.sma with a running sum, O(1) per update. The sum is recomputed from the window
+    every time the ring buffer wraps around so that rounding errors do not accumulate.
+    """
+
+    def __init__(self, length: int, column: str = 'close'):
+        super().__init__(length, column)
+        self._sum = 0.0
+
+    def update(self, value: float):
+        old = self._push(value)
+        if self._pos == 0:
+            self._sum = self._window.sum() if self.count >= self.length else np.nansum(self._window)
+        else:
+            self._sum += value - (old if self.count > self.length else 0.0)
+        self.value = self._sum / self.length if self.count >= self.length else np.nan
+        return self.value
+
+    def reset(self):
+        super().reset()
+        self._sum = 0.0
+
+    def _refresh(self):
+        self._sum = np.nansum(self._window)
+        self.value = self._sum / self.length if self.count >= self.length else np.nan
+
+
+class StreamingEMA(StreamingIndicator):
+    """
+    Streaming counterpart of Indicators.ema (adjust=False), O(1) per update
+    """
+
+    def __init__(self, length: int, column: str = 'close'):
+        super().__init__(length, column)
+        self._alpha = 2 / (self.length + 1)
+
+    def update(self, value: float):
+        self.value = value if self.count == 0 else self.value + self._alpha * (value - self.value)
+        self.count += 1
+        return self.value
+
+    def seed(self, df: pd.DataFrame):
+        # The whole history is part of the state, the batch version gives the last value
+        self.reset()
+        if len(df):
+            self.value = Indicators.ema(df, self.length, self.column).iloc[-1]
+            self.count = len(df)
+        return self
+
+
+class StreamingMomentum(_WindowIndicator):
+    """
+    Streaming counterpart of Indicators.mom, O(1) per update
+    """
+
+    def __init__(self, length: int, column: str = 'close'):
+        super().__init__(length, column, window_size=int(length) + 1)
+
+    def update(self, value: float):
+        self._push(value)
+        self._refresh()
+        return self.value
+
+    def _refresh(self):
+        if self.count > self.length:
+            # The oldest value of the window is the one length periods ago
+            self.value = self._window[-1 if self._pos == 0 else self._pos - 1] / self._window[self._pos] - 1
+        else:
+            self.value = np.nan
+
+
+class StreamingHurst(_WindowIndicator):
+    """
+    Streaming counterpart of Indicators.hurst. Each update only refits the rescaled range of the last window, so its
+    cost depends on length but not on the length of the history.
+    """
+
+    def update(self, value: float):
+        self._push(value)
+        self._refresh()
+        return self.value
+
+    def _refresh(self):
+        if self.count >= self.length:
+            self.value = Indicators.hurst_exponent(self._ordered_window())
+        else:
+            self.value = np.nan
@@ -0,0 +1,143 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import math
+import numpy as np
+# -- User custom function, classes and objects
+from python.PerformanceMetrics import PerformanceMetrics
+
+
+class StreamingMetrics:
+    """
+    Performance metrics of a backtest fed in consecutive chunks of rows. Only the running state of the metrics is kept
+    (last close and position, cumulative return, peak, sums of the returns and the trade being open), so the memory
+    does not grow with the history. get_metrics returns the dictionary of PerformanceMetrics.compute_metrics for all
+    the rows fed so far: the cumulative returns, drawdowns and trades are computed on the same values in the same
+    order, only the sums behind the sharpe, gain to pain and profit ratios can differ in the last digits.
+    """
+
+    def __init__(self, initial_capital, taker_fee):
+        # Parameters
+        self.initial_capital = initial_capital
+        self.taker_fee = taker_fee
+        self.reset()
+
+    def reset(self):
+        # Last row fed
+        self._rows = 0
+        self._close = np.nan
+        self._position = 0.
+        self._turnover = 0.
+        # Cumulative returns and drawdown
+        self._cum_s_log_ret = np.float64(0)
+        self._peak = -np.inf
+        self._max_dd = np.inf
+        self._max_dd_period = None
+        self._market_log_ret = np.float64(0)
+        # Sums of the simple returns, mean and sum of squared deviations combined chunk by chunk
+        self._gains = np.float64(0)
+        self._losses = np.float64(0)
+        self._mean = np.float64(0)
+        self._m2 = np.float64(0)
+        # Trades, the last one is open until the next order or the end of the rows
+        self._trades = 0
+        self._closed_trades = 0
+        self._winning_trades = 0
+        self._trade_start = np.float64(0)
+
+    def update(self, close, positions, index, fill_returns=None):
+        """
+        Adds the next rows of the backtest
+        :param close: numpy array of close prices with shape (rows,)
+        :param positions: numpy array of positions with shape (rows,)
+        :param index: labels of the rows, used to report the date of the maximum drawdown
+        :param fill_returns: optional log returns of the exits filled inside the bar, see _strategy_log_returns
+        :return:
+        """
+        close = np.asarray(close, dtype=float)
+        positions = np.asarray(positions, dtype=float)
+        rows = len(close)
+        if not rows:
+            return
+        first = self._rows == 0
+        if first:
+            self._close = close[0]
+
+        # Returns and orders as in PerformanceMetrics._strategy_log_returns, continued from the previous row
+        log_ret = np.log(close / np.concatenate([[self._close], close[:-1]]))
+        turnover = np.abs(positions - np.concatenate([[self._position], positions[:-1]]))
+        new_order = turnover != 0
+        s_log_ret = np.concatenate([[self._position], positions[:-1]]) * log_ret + \
+            np.log(1 - self.taker_fee) * np.concatenate([[self._turnover], turnover[:-1]])
+        if fill_returns is not None:
+            # The first row of the backtest has no return
+            s_log_ret[int(first):] += np.asarray(fill_returns, dtype=float)[int(first):]
+
+        # Cumulative sums are sequential, starting them from the previous total gives the values of a single pass
+        cum_s_log_ret = np.cumsum(np.concatenate([[self._cum_s_log_ret], s_log_ret]))[1:]
+        peak = np.maximum.accumulate(np.concatenate([[self._peak], cum_s_log_ret]))[1:]
+        drawdown = cum_s_log_ret - peak
+        row = drawdown.argmin()
+        if drawdown[row] < self._max_dd:
+            self._max_dd, self._max_dd_period = drawdown[row], str(index[row])
+
+        # Trades end at the row before a new order, the last row of the previous chunk ends one if this one starts
+        # with an order
+        ends = cum_s_log_ret[:-1][new_order[1:]]
+        if not first and new_order[0]:
+            ends = np.concatenate([[self._cum_s_log_ret], ends])
+        trade_returns = np.diff(np.concatenate([[self._trade_start], ends]))
+        self._closed_trades += len(ends)
+        self._winning_trades += (trade_returns > 0).sum()
+        self._trade_start = ends[-1] if len(ends) else self._trade_start
+        self._trades += new_order.sum()
+
+        # Simple returns
+        s_ret = np.exp(s_log_ret) - 1
+        mean = s_ret.mean()
+        total_rows = self._rows + rows
+        delta = mean - self._mean
+        self._m2 += ((s_ret - mean) ** 2).sum() + delta ** 2 * self._rows * rows / total_rows
+        self._mean += delta * rows / total_rows
+        self._gains += np.where(s_ret > 0, s_ret, 0).sum()
+        self._losses -= np.where(s_ret < 0, s_ret, 0).sum()
+        self._market_log_ret += log_ret.sum()
+
+        # Last row
+        self._rows = total_rows
+        self._close = close[-1]
+        self._position = positions[-1]
+        self._turnover = turnover[-1]
+        self._cum_s_log_ret = cum_s_log_ret[-1]
+        self._peak = peak[-1]
+
+    def get_metrics(self):
+        """
+        :return: dictionary of metrics of all the rows fed, as returned by PerformanceMetrics.compute_metrics for 1-D
+        positions
+        """
+        total_log_ret = self._cum_s_log_ret
+        max_dd = self._max_dd
+        # The open trade ends at the last row
+        winning_trades = self._winning_trades + (total_log_ret - self._trade_start > 0)
+        yearly_trading_days = PerformanceMetrics.YEARLY_TRADING_DAYS
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annual_return = np.exp(total_log_ret * yearly_trading_days / self._rows) - 1
+            calmar_ratio = annual_return / (1 - np.exp(max_dd))
+            gain_to_pain_ratio = (self._gains - self._losses) / self._losses
+            profit_ratio = self._gains / self._losses
+            sharpe_ratio = self._mean / np.sqrt(self._m2 / (self._rows - 1)) * math.sqrt(yearly_trading_days)
+            win_rate = np.float64(winning_trades) / (self._closed_trades + 1)
+
+        return {'rate_of_return': np.round((np.exp(total_log_ret) - 1) * 100, 2),
+                'profit_and_loss': np.round(self.initial_capital * np.exp(total_log_ret) - self.initial_capital, 2),
+                'buy_and_hold': np.round((np.exp(self._market_log_ret + np.log(1 - self.taker_fee)) - 1) * 100, 2),
+                'max_drawdown': {'max_dd_period': self._max_dd_period,
+                                 'max_dd_value': np.round((np.exp(max_dd) - 1) * 100, 2)},
+                'sharpe_ratio': np.round(sharpe_ratio, 2),
+                'number_of_trades': self._trades,
+                'win_rate': win_rate,
+                'calmar_ratio': np.round(calmar_ratio, 2),
+                'gain_to_pain_ratio': np.round(gain_to_pain_ratio, 2),
+                'profit_ratio': np.round(profit_ratio, 2)}
@@ -0,0 +1,97 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+
+
+class SyntheticCandles:
+    """
+    Deterministic generator of OHLCV candles for benchmarks and offline runs. Prices follow a random walk whose drift
+    switches between trending regimes and whose volatility clusters, so that the strategies trade as they would on
+    market data. The same seed always gives the same candles.
+    """
+    MS_PER_UNIT = {'m': 60 * 1000,
+                   'h': 60 * 60 * 1000,
+                   'd': 24 * 60 * 60 * 1000,
+                   'w': 7 * 24 * 60 * 60 * 1000}
+
+    def __init__(self, seed: int = 0, start_date='2017-01-01', price: float = 20000, volatility: float = 0.01,
+                 regime_length: int = 200):
+        """
+        :param seed: seed of the random generator
+        :param start_date: open_time of the first candle
+        :param price: open price of the first candle
+        :param volatility: average standard deviation of the log returns per candle
+        :param regime_length: average number of candles of a trend regime
+        """
+        # Parameters
+        self.seed = seed
+        self.start_date = pd.Timestamp(start_date)
+        self.price = price
+        self.volatility = volatility
+        self.regime_length = regime_length
+
+    def interval_ms(self, interval: str):
+        """
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :return: duration of a candle in milliseconds
+        """
+        return int(interval[:-1]) * self.MS_PER_UNIT[interval[-1]]
+
+    def generate(self, rows: int, interval: str = '4h'):
+        """
+        Generates candles in the shape returned by DatabaseWrapper.read_candles
+        :param rows: number of candles
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :return: pandas dataframe with candlestick data indexed by open_time
+        """
+        rng = np.random.default_rng(self.seed)
+
+        # Trend regimes of random length and direction
+        lengths = rng.geometric(1 / self.regime_length, size=rows // self.regime_length * 2 + 2)
+        drifts = rng.normal(0, self.volatility / 5, size=len(lengths))
+        drift = np.repeat(drifts, lengths)[:rows]
+        drift = np.pad(drift, (0, rows - len(drift)))
+
+        # Volatility clustering: smoothed absolute shocks scale the noise
+        shocks = np.abs(rng.standard_normal(rows))
+        clustering = pd.Series(shocks).ewm(span=50, adjust=False).mean().to_numpy() / np.sqrt(2 / np.pi)
+        log_ret = drift + rng.standard_normal(rows) * self.volatility * clustering
+        close = self.price * np.exp(np.cumsum(log_ret))
+
+        # Open gaps from the previous close, high and low beyond the body of the candle
+        open_ = np.empty(rows)
+        open_[:1] = self.price
+        open_[1:] = close[:-1] * np.exp(rng.normal(0, self.volatility / 10, rows - 1))
+        wick = np.abs(rng.normal(0, self.volatility / 2, (2, rows)))
+        high = np.maximum(open_, close) * np.exp(wick[0])
+        low = np.minimum(open_, close) * np.exp(-wick[1])
+        volume = rng.lognormal(3, 0.5, rows) * (1 + 20 * np.abs(log_ret) / self.volatility)
+        number_of_trades = np.round(volume * 10)
+
+        step = self.interval_ms(interval)
+        open_time = self.start_date.value // 10 ** 6 + np.arange(rows, dtype=np.int64) * step
+        index = pd.DatetimeIndex(open_time.astype('datetime64[ms]'), name='open_time')
+        return pd.DataFrame({'open': open_,
+                             'high': high,
+                             'low': low,
+                             'close': close,
+                             'volume': volume,
+                             'close_time': (open_time + step - 1).astype('datetime64[ms]'),
+                             'number_of_trades': number_of_trades}, index=index)
+
+    def generate_raw(self, rows: int, pair: str = 'BTCUSDT', interval: str = '4h'):
+        """
+        Generates candles in the shape returned by ExchangeConnector.read_candlestick_data, ready to be written with
+        DatabaseWrapper.upsert_candles or CandleStore.append
+        :param rows: number of candles
+        :param pair: currency pair written in the pair column
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :return: pandas dataframe with candlestick data
+        """
+        data = self.generate(rows, interval).reset_index()
+        data.insert(0, 'interval', interval)
+        data.insert(0, 'pair', pair)
+        return data
@@ -0,0 +1,226 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import datetime
+import numpy as np
+import pandas as pd
+# -- User custom function, classes and objects
+from python.Logger import Logger
+from python.DatabaseWrapper import DatabaseWrapper
+from python.CandleStore import CandleStore
+from python.Candles import Candles
+from python.Backtester import Backtester
+from python.Strategy import Strategy
+
+
+class UniverseBacktester:
+    """
+    Runs a strategy over many pairs and intervals at once. The candles of every interval are loaded with a single
+    database refresh and aligned on a common time axis, so the positions of every (pair, parameter set) are columns of
+    one matrix and their metrics are computed together instead of one Backtester per series.
+    """
+    # Maximum number of (row, column) cells of the position matrix scored in one pass
+    METRICS_CHUNK_ELEMENTS = 2 ** 24
+
+    def __init__(self, pairs: list, intervals: list = None, initial_capital: int = 5000,
+                 start_date: datetime = None, end_date: datetime = None, storage: str = 'sql',
+                 columns: list = None, update: bool = True, precision: str = 'float64', base_interval: str = None):
+        """
+        :param precision: 'float64' or 'float32', dtype in which the prices and volumes of every series are kept. float32
+        halves the memory of the aligned dataframes
+        :param base_interval: stored interval from which the other intervals are resampled, only the base interval is
+        downloaded
+        """
+        # Parameters
+        self.pairs = list(pairs)
+        self.intervals = list(intervals) if intervals else ['4h']
+        self.start_date = start_date
+        self.end_date = end_date
+        self.initial_capital = initial_capital
+        self.columns = columns if columns else ['close']
+        self.precision = precision
+        self.base_interval = base_interval
+        self._taker_fee = 0.1 / 100
+        self.data = {}
+        self.results = pd.DataFrame()
+        self.summary = pd.DataFrame()
+
+        # Internal variables
+        self._dbwrapper = DatabaseWrapper(candle_store=CandleStore() if storage == 'columnar' else None)
+        self._strategy = Strategy(self.initial_capital, self.taker_fee)
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+        # Initialise data
+        self.get_data(update)
+
+    @property
+    def taker_fee(self):
+        return self._taker_fee
+
+    def get_data(self, update: bool = True):
+        """
+        Updates every pair and interval in one concurrent pass and reads them into one aligned dataframe per interval,
+        with (pair, column) columns. Pairs that are listed later or miss candles have NaN in those rows.
+        :param update: False to use the data already in the database
+        :return:
+        """
+        if update:
+            try:
+                self._dbwrapper.market_data_update_many(self.pairs, self.intervals, self.base_interval)
+            except Exception as e:
+                self.logger.error(f'Data could not be updated: {e}')
+        elif self.base_interval:
+            # Derived intervals are resampled from the stored base candles
+            for pair in self.pairs:
+                for interval in self.intervals:
+                    if interval == self.base_interval:
+                        continue
+                    try:
+                        self._dbwrapper.resample_update(pair, interval, self.base_interval)
+                    except Exception as e:
+                        self.logger.error(f'{pair} {interval} could not be resampled from {self.base_interval}: {e}')
+
+        for interval in self.intervals:
+            frames = {}
+            for pair in self.pairs:
+                try:
+                    frame = self._dbwrapper.read_candles(pair, interval, self.start_date, self.end_date, self.columns)
+                except Exception as e:
+                    self.logger.error(f'Error reading {pair} {interval} from the db: {e}')
+                    continue
+                if len(frame):
+                    frames[pair] = Candles.from_frame(frame, pair, interval, self.precision).frame()
+                else:
+                    self.logger.warning(f'No data for {pair} {interval}')
+
+            # Outer join on open_time, every pair keeps its own columns
+            self.data[interval] = pd.concat(frames, axis=1, names=['pair', None]).sort_index() if frames else \
+                pd.DataFrame()
+            self.logger.info(f'Loaded {len(frames)} pairs and {len(self.data[interval])} rows of {interval} data')
+
+    def get_close(self, interval: str):
+        """
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :return: dataframe of close prices with one column per pair
+        """
+        return self.data[interval].xs('close', axis=1, level=1)
+
+    def create_parameter_grid(self, strategy: str):
+        """
+        Same parameter grid as Backtester.create_parameter_grid, read from the same database
+        :param strategy: name of the backtesting strategy
+        :return: list of parameter sets
+        """
+        query = f"SELECT * FROM {self._dbwrapper.parameters_table} WHERE strategy = '{strategy}'"
+        return Backtester.parameter_grid(self._dbwrapper.read_sql_table(query))
+
+    def get_positions(self, strategy: str, param_grid: list, interval: str):
+        """
+        Computes the positions of every pair for every parameter set with Strategy.batch_<strategy>. Each pair is
+        evaluated from its first candle, missing candles in between are filled with the previous close.
+        :param strategy: strategy name corresponding to a batch function in Strategy class
+        :param param_grid: list of parameter sets
+        :param interval: data granularity as string (e.g. '1h', '4h', '1d', '1w')
+        :return: numpy array of shape (rows, pairs, combinations), zero before the first candle of each pair
+        """
+        data = self.data[interval]
+        pairs = data.columns.get_level_values('pair').unique()
+        positions = np.zeros((len(data), len(pairs), len(param_grid)), dtype=np.int8)
+        for i, pair in enumerate(pairs):
+            pair_data = data[pair].ffill()
+            first = pair_data['close'].first_valid_index()
+            if first is None:
+                continue
+            start = data.index.get_loc(first)
+            self._strategy.set_data(pair_data.iloc[start:])
+            positions[start:, i] = getattr(self._strategy, 'batch_' + strategy)(param_grid)
+        return positions
+
+    def run_backtest(self, strategy: str, param_grid: list = None, first_date: datetime = None):
+        """
+        Runs a strategy on every pair and interval for every parameter set and computes all the performance metrics
+        in vectorized form. Rows before the listing of a pair count as holding cash at a constant price.
+        :param strategy: strategy name corresponding to a batch function in Strategy class
+        :param param_grid: list of parameter sets, the grid of the strategy in the database by default
+        :param first_date: first date used to calculate the metrics, earlier rows only warm up the indicators
+        :return: dataframe with one row of metrics per interval, pair and parameter set
+        """
+        if param_grid is None:
+            param_grid = self.create_parameter_grid(strategy)
+
+        results = []
+        for interval in self.intervals:
+            if self.data[interval].empty:
+                continue
+            close = self.get_close(interval)
+            positions = self.get_positions(strategy, param_grid, interval)
+            index = close.index
+            if first_date:
+                mask = index >= first_date
+                close, positions, index = close[mask], positions[mask], index[mask]
+
+            # Constant price before the first candle and on missing candles, so that those rows have no returns
+            close_values = close.ffill().bfill().to_numpy(dtype=float)
+            results.append(self._score_interval(interval, close.columns, close_values, positions, index, param_grid))
+            self.logger.info(f'Backtested {strategy} on {close.shape[1]} pairs of {interval} data')
+
+        self.results = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+        self.summary = self.get_summary(self.results)
+        return self.results
+
+    def _score_interval(self, interval: str, pairs, close: np.ndarray, positions: np.ndarray, index, param_grid: list):
+        """
+        Computes the metrics of every (pair, parameter set) column of one interval, in chunks of pairs so that the
+        intermediate arrays stay within METRICS_CHUNK_ELEMENTS cells
+        :return: dataframe with one row of metrics per pair and parameter set
+        """
+        rows, n_pairs, n_params = positions.shape
+        chunk = max(1, self.METRICS_CHUNK_ELEMENTS // max(rows * n_params, 1))
+        frames = []
+        for start in range(0, n_pairs, chunk):
+            stop = min(start + chunk, n_pairs)
+            # Columns are pair-major: every parameter set of a pair shares the close prices of the pair
+            chunk_positions = positions[:, start:stop].reshape(rows, -1)
+            chunk_close = np.repeat(close[:, start:stop], n_params, axis=1)
+            metrics = self._strategy.compute_metrics(chunk_close, chunk_positions, index)
+
+            max_drawdown = metrics.pop('max_drawdown')
+            frame = pd.DataFrame({'interval': interval,
+                                  'pair': np.repeat(np.asarray(pairs[start:stop]), n_params),
+                                  'parameters': [params for _ in range(start, stop) for params in param_grid],
+                                  **metrics, **max_drawdown})
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def get_summary(results: pd.DataFrame):
+        """
+        Aggregates the results of every parameter set across pairs
+        :param results: dataframe returned by run_backtest
+        :return: dataframe with one row per interval and parameter set
+        """
+        if results.empty:
+            return pd.DataFrame()
+        grouped = results.assign(parameters=results['parameters'].map(str),
+                                 profitable=results['rate_of_return'] > 0).groupby(['interval', 'parameters'],
+                                                                                    sort=False)
+        return grouped.agg(pairs=('pair', 'count'),
+                           mean_rate_of_return=('rate_of_return', 'mean'),
+                           median_rate_of_return=('rate_of_return', 'median'),
+                           profitable_pairs=('profitable', 'mean'),
+                           mean_sharpe_ratio=('sharpe_ratio', 'mean'),
+                           mean_max_dd_value=('max_dd_value', 'mean'),
+                           number_of_trades=('number_of_trades', 'sum')).round(2).reset_index()
+
+    def get_best(self, metric: str = 'rate_of_return'):
+        """
+        :param metric: column of results used to rank the parameter sets
+        :return: dataframe with the best parameter set of every interval and pair
+        """
+        if self.results.empty:
+            return self.results
+        best = self.results[metric].fillna(-np.inf).groupby([self.results['interval'], self.results['pair']],
+                                                             sort=False).idxmax()
+        return self.results.loc[best.to_numpy()].sort_values(metric, ascending=False).reset_index(drop=True)
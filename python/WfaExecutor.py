@@ -0,0 +1,134 @@
+# -- Created by carlesferreres at 18/10/26
+
+# -- Built-in and installed packages
+import os
+import math
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+# -- User custom function, classes and objects
+from python.Logger import Logger
+from python.Strategy import Strategy
+
+# Per-process state of the pool workers, set by _init_worker
+_worker = {}
+
+
+def _attach(name: str, shape: tuple, dtype: str):
+    """
+    Attaches to an existing shared memory block and returns it together with a numpy view over it
+    :param name: name of the shared memory block
+    :param shape: shape of the array stored in the block
+    :param dtype: dtype of the array stored in the block
+    :return: tuple of (shared memory block, numpy view)
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(values_spec: tuple, index_spec: tuple, columns: list, initial_capital, taker_fee, execution):
+    """
+    Initialises a pool worker: attaches the candle arrays and rebuilds the candle dataframe over them without copying
+    """
+    values_shm, values = _attach(*values_spec)
+    index_shm, index = _attach(*index_spec)
+    _worker['shm'] = (values_shm, index_shm)
+    _worker['data'] = pd.DataFrame(values, index=pd.DatetimeIndex(index.view('datetime64[ns]'), name='open_time'),
+                                   columns=columns, copy=False)
+    _worker['strategy'] = Strategy(initial_capital, taker_fee)
+    _worker['strategy'].execution = execution
+
+
+def _score_fold(strategy: str, param_grid: list, warm_start: int, first_pos: int, stop: int, batched: bool):
+    """
+    Scores a chunk of the parameter grid on the in-sample window of one fold
+    :param strategy: strategy name corresponding to a function in Strategy class
+    :param param_grid: chunk of parameter sets to score
+    :param warm_start: position of the first row of the window, including the warm-up rows
+    :param first_pos: position of the first row used to calculate the score
+    :param stop: position after the last row of the window
+    :param batched: True to score the chunk with Strategy.batch_<strategy>
+    :return: list with the score of each parameter set
+    """
+    data = _worker['data'].iloc[warm_start:stop]
+    first_date = _worker['data'].index[first_pos]
+    strat = _worker['strategy']
+    strat.set_data(data)
+
+    # Without a batch function the positions come from one run per parameter set, the execution rules and scores are
+    # still computed for the whole chunk at once
+    if batched:
+        signals = getattr(strat, 'batch_' + strategy)(param_grid)
+    else:
+        signals = strat.grid_positions(strategy, param_grid)
+    positions, fill_returns = strat.execute(signals)
+    mask = data.index >= first_date
+    return list(strat.compute_scores(data['close'].to_numpy()[mask], positions[mask],
+                                     None if fill_returns is None else fill_returns[mask]))
+
+
+class WfaExecutor:
+    """
+    Runs the in-sample optimisation of the walk forward analysis folds on a pool of processes. The candle arrays are
+    placed once in shared memory and every worker reads them from there, only the fold positions and the parameter
+    sets are sent with each task.
+    """
+
+    def __init__(self, initial_capital, taker_fee, workers: int = None, execution=None):
+        # Parameters
+        self.initial_capital = initial_capital
+        self.taker_fee = taker_fee
+        self.workers = workers if workers else os.cpu_count()
+        self.execution = execution
+
+        # Logger
+        self.logger = Logger(self.__class__.__name__).logger
+
+    def optimise(self, strategy: str, param_grid: list, data: pd.DataFrame, folds: list, batched: bool = False):
+        """
+        Finds the best parameter set for each fold
+        :param strategy: strategy name corresponding to a function in Strategy class
+        :param param_grid: list of parameter sets as returned by Backtester.create_parameter_grid
+        :param data: dataframe containing the candles of the whole analysis
+        :param folds: list of (warm_start, first_pos, stop) positions of the in-sample window of each fold
+        :param batched: True to score the parameter sets with Strategy.batch_<strategy>
+        :return: list of (best_score, best_params) tuples in the same order as folds
+        """
+        # Split the grid so that every worker gets work even when there are fewer folds than workers
+        chunks_per_fold = max(1, math.ceil(self.workers / max(len(folds), 1)))
+        chunk_size = math.ceil(len(param_grid) / chunks_per_fold)
+        chunks = [(start, param_grid[start:start + chunk_size]) for start in range(0, len(param_grid), chunk_size)]
+
+        # Place the candle arrays in shared memory
+        numeric = data.select_dtypes('number')
+        values = np.ascontiguousarray(numeric.to_numpy(dtype=float))
+        index = data.index.to_numpy(dtype='datetime64[ns]').view('int64')
+        values_shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        index_shm = shared_memory.SharedMemory(create=True, size=max(index.nbytes, 1))
+        try:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=values_shm.buf)[:] = values
+            np.ndarray(index.shape, dtype=index.dtype, buffer=index_shm.buf)[:] = index
+            initargs = ((values_shm.name, values.shape, values.dtype.str),
+                        (index_shm.name, index.shape, index.dtype.str),
+                        list(numeric.columns), self.initial_capital, self.taker_fee, self.execution)
+
+            self.logger.info(f'Optimising {len(folds)} folds on {self.workers} workers')
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs) as pool:
+                futures = {(i, start): pool.submit(_score_fold, strategy, chunk, *fold, batched)
+                           for i, fold in enumerate(folds) for start, chunk in chunks}
+
+                # Merge chunks in grid order so that ties resolve to the first combination, as the serial search does
+                results = []
+                for i in range(len(folds)):
+                    scores = np.array([score for start, _ in chunks for score in futures[(i, start)].result()],
+                                      dtype=float)
+                    best = int(np.argmax(np.nan_to_num(scores, nan=-np.inf)))
+                    results.append((scores[best], param_grid[best]))
+        finally:
+            values_shm.close()
+            values_shm.unlink()
+            index_shm.close()
+            index_shm.unlink()
+
+        return results